@@ -0,0 +1,268 @@
+"""
+Feeds synthetic updates through the Dispatcher with all routers registered,
+against a freshly seeded SQLite database and a Bot session that never
+touches the network, and reports latency, throughput, SQL statements and
+API calls per update and peak RSS for every scenario.
+
+Usage:
+    python -m benchmarks.dispatcher [--classes 20] [--users 30] [--lessons 6]
+        [--homework 200] [--updates 500] [--concurrency 1]
+        [--only hw,hw_page] [--save baseline.json] [--compare baseline.json]
+
+With --compare the run fails if a scenario got slower than --tolerance
+(p95 latency or throughput) or issues more SQL statements per update.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+
+def _percentile(samples: list[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def build_scenarios(ctx: dict, rnd: random.Random) -> dict:
+    """Scenario name -> function returning the next update to feed."""
+    from services.homework import HomeworkPage
+    from benchmarks.fixtures import SUBJECTS, FIRST_TELEGRAM_ID, message_update, callback_update
+
+    members = ctx["telegram_ids"]
+    headmen = ctx["headmen"]
+    new_users = itertools.count(FIRST_TELEGRAM_ID - 1, -1)
+
+    def member():
+        return rnd.choice(members)
+
+    def page_callback():
+        user_id = member()
+        ids = ctx["homework_ids"].get(ctx["class_of"][user_id]) or [0]
+        return callback_update(user_id, HomeworkPage(d=rnd.choice("on"), c=rnd.choice(ids)).pack())
+
+    return {
+        "start": lambda: message_update(member(), "/start"),
+        "start_new": lambda: message_update(next(new_users), "/start"),
+        "help": lambda: message_update(member(), "/help"),
+        "schedule": lambda: message_update(member(), "/schedule"),
+        "schedule_day": lambda: message_update(member(), f"/schedule_day {rnd.randint(0, 5)}"),
+        "schedule_button": lambda: message_update(member(), "📚 Расписание"),
+        "my_class": lambda: message_update(member(), "🏫 Мой класс"),
+        "hw": lambda: message_update(member(), "/hw"),
+        "hw_subject": lambda: message_update(member(), f"/hw {rnd.choice(SUBJECTS)[:3]}"),
+        "hw_page": page_callback,
+        "add_hw": lambda: message_update(
+            rnd.choice(headmen), f"/add_hw {rnd.choice(SUBJECTS)} Параграф {rnd.randint(1, 40)}"
+        ),
+        "add_schedule": lambda: message_update(
+            rnd.choice(headmen), f"/add_schedule {rnd.randint(0, 5)} {rnd.randint(1, 8)} {rnd.choice(SUBJECTS)}"
+        ),
+        "reminders": lambda: message_update(rnd.choice(headmen), "/reminders"),
+        "set_reminders": lambda: message_update(
+            rnd.choice(headmen), f"/reminders 07:{rnd.randint(10, 59)} 14:30"
+        ),
+        "bells": lambda: message_update(member(), "/bells"),
+        "hw_retention": lambda: message_update(member(), "/hw_retention"),
+        "lesson_alerts": lambda: message_update(member(), "/lesson_alerts"),
+        "hw_archive": lambda: message_update(member(), "/hw_archive"),
+        "class_exists": lambda: message_update(member(), f"/create_class {rnd.choice(ctx['class_names'])}"),
+        "free_text": lambda: message_update(member(), "привет"),
+    }
+
+
+async def run_scenario(dp, bot, make_update, updates: int, warmup: int, concurrency: int, counter: dict) -> dict:
+    for _ in range(warmup):
+        await dp.feed_update(bot, make_update())
+
+    batch = [make_update() for _ in range(updates)]
+    latencies, errors = [], 0
+    slots = asyncio.Semaphore(concurrency)
+
+    async def feed(update):
+        nonlocal errors
+        async with slots:
+            started = time.perf_counter()
+            try:
+                await dp.feed_update(bot, update)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    counter["sql"] = 0
+    bot.session.calls = 0
+    started = time.perf_counter()
+    await asyncio.gather(*(feed(update) for update in batch))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "updates": updates,
+        "errors": errors,
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 3),
+        "updates_per_sec": round(updates / elapsed, 1),
+        "sql_per_update": round(counter["sql"] / updates, 2),
+        "api_calls_per_update": round(bot.session.calls / updates, 2),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+    }
+
+
+def reset_caches():
+    from services import timetable
+    from services.users import user_cache
+    from services.classes import class_directories
+
+    user_cache.clear()
+    timetable._rendered.clear()
+    timetable._subject_days.clear()
+    class_directories.clear()
+
+
+async def run(args) -> dict:
+    # Imported here: database.setup reads DB_NAME when it is first imported
+    from aiogram import Bot, Dispatcher
+    from sqlalchemy import event
+    from database.setup import engine, read_engine, async_session, init_db
+    from benchmarks.fixtures import RecordingSession, seed
+    from main import setup_dispatcher
+
+    await init_db()
+    async with async_session() as session:
+        ctx = await seed(session, args.classes, args.users, args.lessons, args.homework, args.seed)
+
+    counter = {"sql": 0}
+
+    def count_statement(*_):
+        counter["sql"] += 1
+
+    for eng in (engine, read_engine):
+        event.listen(eng.sync_engine, "before_cursor_execute", count_statement)
+
+    bot = Bot(token="42:BENCHMARK", session=RecordingSession())
+    dp = Dispatcher()
+    setup_dispatcher(dp)
+
+    rnd = random.Random(args.seed)
+    scenarios = build_scenarios(ctx, rnd)
+    if args.only:
+        scenarios = {name: scenarios[name] for name in args.only.split(",")}
+
+    results = {}
+    for name, make_update in scenarios.items():
+        # Every scenario starts from the same state, so --only runs stay comparable
+        rnd.seed(f"{args.seed}:{name}")
+        reset_caches()
+        results[name] = await run_scenario(
+            dp, bot, make_update, args.updates, args.warmup, args.concurrency, counter
+        )
+        print_row(name, results[name])
+
+    await engine.dispose()
+    await read_engine.dispose()
+    return {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "classes": args.classes, "users": args.users, "lessons": args.lessons,
+            "homework": args.homework, "updates": args.updates,
+            "warmup": args.warmup, "concurrency": args.concurrency, "seed": args.seed,
+        },
+        "results": results,
+    }
+
+
+COLUMNS = ["p50_ms", "p95_ms", "p99_ms", "updates_per_sec", "sql_per_update", "api_calls_per_update", "peak_rss_mb"]
+
+
+def print_header():
+    print(f"{'scenario':<16}" + "".join(f"{column:>{len(column) + 2}}" for column in COLUMNS) + f"{'errors':>8}")
+
+
+def print_row(name: str, result: dict):
+    print(f"{name:<16}" + "".join(f"{result[column]:>{len(column) + 2}}" for column in COLUMNS) + f"{result['errors']:>8}")
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Lines describing every regression against the baseline."""
+    if baseline["meta"].get("updates") != report["meta"]["updates"] or \
+            baseline["meta"].get("concurrency") != report["meta"]["concurrency"]:
+        print("Warning: the baseline was recorded with different --updates/--concurrency")
+
+    regressions = []
+    print(f"\n{'scenario':<16}{'p95 ms':>24}{'updates/s':>24}{'sql/update':>18}")
+    for name, result in report["results"].items():
+        base = baseline["results"].get(name)
+        if not base:
+            continue
+        print(f"{name:<16}{base['p95_ms']:>10} → {result['p95_ms']:<11}"
+              f"{base['updates_per_sec']:>10} → {result['updates_per_sec']:<11}"
+              f"{base['sql_per_update']:>7} → {result['sql_per_update']}")
+        if result["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {base['p95_ms']} → {result['p95_ms']} ms")
+        if result["updates_per_sec"] < base["updates_per_sec"] * (1 - tolerance):
+            regressions.append(f"{name}: {base['updates_per_sec']} → {result['updates_per_sec']} updates/s")
+        if result["sql_per_update"] > base["sql_per_update"]:
+            regressions.append(f"{name}: {base['sql_per_update']} → {result['sql_per_update']} SQL statements/update")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Dispatcher load benchmark")
+    parser.add_argument("--classes", type=int, default=20)
+    parser.add_argument("--users", type=int, default=30, help="users per class")
+    parser.add_argument("--lessons", type=int, default=6, help="lessons per school day")
+    parser.add_argument("--homework", type=int, default=200, help="homework per class")
+    parser.add_argument("--updates", type=int, default=500, help="measured updates per scenario")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured updates per scenario")
+    parser.add_argument("--concurrency", type=int, default=1, help="updates processed at once")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", help="comma separated scenario names")
+    parser.add_argument("--db", help="database file (default: a temporary one)")
+    parser.add_argument("--save", help="write the report as a JSON baseline")
+    parser.add_argument("--compare", help="JSON baseline to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown, 0.2 = 20%%")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="school_bot_bench_")
+    os.environ["DB_NAME"] = args.db or os.path.join(workdir, "bench.db")
+    # main.py refuses to load without a token; the benchmark never calls Telegram
+    os.environ.setdefault("BOT_TOKEN", "42:BENCHMARK")
+    # A few users send hundreds of updates a second here; THROTTLING=1 measures the drop path
+    os.environ.setdefault("THROTTLING", "0")
+
+    print_header()
+    report = asyncio.run(run(args))
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nBaseline saved to {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print("\nRegressions:\n" + "\n".join(regressions))
+            return 1
+        print("\nNo regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+import itertools
+import random
+from typing import get_args
+from datetime import date, datetime, timedelta
+
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Chat, Message, Update
+from sqlalchemy import insert, select
+
+from database.models import ClassGroup, Homework, Schedule, User
+
+SUBJECTS = ["Алгебра", "Геометрия", "Русский язык", "Литература", "Физика", "Химия",
+            "Биология", "История", "География", "Английский язык", "Информатика"]
+# Telegram ids of seeded users start here; ids below are "new" users
+FIRST_TELEGRAM_ID = 1_000_000
+INSERT_CHUNK = 500
+
+
+class RecordingSession(BaseSession):
+    """
+    A Bot session that never touches the network. Every API call is counted
+    and answered with a minimal valid response.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls += 1
+        returning = method.__returning__
+        if returning is Message or Message in get_args(returning):
+            return Message(
+                message_id=next(self._message_ids),
+                date=datetime.now(),
+                chat=Chat(id=getattr(method, "chat_id", None) or 0, type="private"),
+                text=getattr(method, "text", None)
+            )
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+async def _insert(session, model, rows: list[dict]):
+    for i in range(0, len(rows), INSERT_CHUNK):
+        await session.execute(insert(model), rows[i:i + INSERT_CHUNK])
+
+
+async def seed(session, classes: int, users: int, lessons: int, homework: int, seed: int = 0) -> dict:
+    """
+    Fill an empty database: `users` and `homework` are per class,
+    `lessons` per school day. Returns what the scenarios need to build updates.
+    """
+    rnd = random.Random(seed)
+    await _insert(session, ClassGroup, [{"name": f"{5 + i % 7}-{i}"} for i in range(classes)])
+    class_ids = list((await session.execute(select(ClassGroup.id).order_by(ClassGroup.id))).scalars())
+
+    await _insert(session, Schedule, [
+        {"class_group_id": class_id, "day_of_week": day, "lesson_number": lesson,
+         "subject_name": rnd.choice(SUBJECTS)}
+        for class_id in class_ids for day in range(6) for lesson in range(1, lessons + 1)
+    ])
+
+    telegram_ids = itertools.count(FIRST_TELEGRAM_ID)
+    await _insert(session, User, [
+        {"telegram_id": next(telegram_ids), "full_name": f"Ученик {n}",
+         # The first user of every class is its headman
+         "role": "headman" if n == 0 else "student", "class_group_id": class_id}
+        for class_id in class_ids for n in range(users)
+    ])
+
+    today = date.today()
+    await _insert(session, Homework, [
+        {"class_group_id": class_id, "subject_name": rnd.choice(SUBJECTS),
+         "content": f"Задание {n + 1}: " + "упражнения " * rnd.randint(1, 30),
+         "date_assigned": (today - timedelta(days=rnd.randint(0, 365))).isoformat()}
+        for class_id in class_ids for n in range(homework)
+    ])
+    await session.commit()
+
+    homework_ids = {}
+    for class_id, hw_id in (await session.execute(select(Homework.class_group_id, Homework.id))).all():
+        homework_ids.setdefault(class_id, []).append(hw_id)
+    members, headmen = {}, []
+    for telegram_id, class_id, role in (await session.execute(
+        select(User.telegram_id, User.class_group_id, User.role)
+    )).all():
+        members.setdefault(class_id, []).append(telegram_id)
+        if role == "headman":
+            headmen.append(telegram_id)
+
+    return {
+        "class_ids": class_ids,
+        "class_names": [f"{5 + i % 7}-{i}" for i in range(classes)],
+        "telegram_ids": [tid for class_id in class_ids for tid in members.get(class_id, [])],
+        "headmen": headmen,
+        "class_of": {tid: class_id for class_id, tids in members.items() for tid in tids},
+        "homework_ids": homework_ids,
+    }
+
+
+_update_ids = itertools.count(1)
+
+
+def message_update(user_id: int, text: str) -> Update:
+    n = next(_update_ids)
+    return Update.model_validate({"update_id": n, "message": {
+        "message_id": n, "date": 0, "text": text,
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"U{user_id}"}
+    }})
+
+
+def callback_update(user_id: int, data: str) -> Update:
+    n = next(_update_ids)
+    return Update.model_validate({"update_id": n, "callback_query": {
+        "id": str(n), "chat_instance": str(user_id), "data": data,
+        "from": {"id": user_id, "is_bot": False, "first_name": f"U{user_id}"},
+        "message": {"message_id": n, "date": 0, "text": "…",
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": {"id": 1, "is_bot": True, "first_name": "bot"}}
+    }})
@@ -0,0 +1,159 @@
+"""
+Measures update throughput of the multi-process mode (services/workers.py)
+for different numbers of worker processes, against a freshly seeded SQLite
+database and a Bot session that never touches the network. The updates are
+the read commands students send most (/schedule, /hw and the menu buttons).
+
+Also measures what the supervisor spends on one update (parsing, re-encoding,
+picking the worker, pickling for the queue). Throughput can only grow with
+the number of workers while there are free CPU cores and the supervisor keeps
+up, so the report ends with both limits for this machine.
+
+Usage:
+    python -m benchmarks.workers [--workers 1,2,4] [--updates 3000]
+        [--classes 20] [--users 30] [--homework 200]
+"""
+import argparse
+import asyncio
+import multiprocessing as mp
+import os
+import pickle
+import random
+import signal
+import sys
+import tempfile
+import time
+
+
+def bench_worker(index: int, inbox, events, ready):
+    """A worker process as in BOT_WORKERS mode, with a Bot that never calls Telegram."""
+    from services.workers import _setup_logging
+
+    _setup_logging()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_run_worker(index, inbox, events, ready))
+
+
+async def _run_worker(index: int, inbox, events, ready):
+    from aiogram import Bot
+    from benchmarks.fixtures import RecordingSession
+    from services.workers import _worker
+    # Handlers and their imports load before the clock starts
+    import main  # noqa: F401
+
+    bot = Bot(token="42:BENCHMARK", session=RecordingSession())
+    ready.put(index)
+    await _worker(index, inbox, events, bot=bot)
+
+
+def build_updates(ctx: dict, count: int, seed: int) -> list[dict]:
+    """Raw updates as the supervisor hands them to workers."""
+    from benchmarks.fixtures import SUBJECTS, message_update
+
+    rnd = random.Random(seed)
+    texts = ["/schedule", "/hw", "📚 Расписание", "📖 Домашка", "🏫 Мой класс"]
+    updates = []
+    for _ in range(count):
+        text = rnd.choice(texts + [f"/hw {rnd.choice(SUBJECTS)[:3]}"])
+        update = message_update(rnd.choice(ctx["telegram_ids"]), text)
+        updates.append(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+    return updates
+
+
+def supervisor_cost(updates: list[dict], count: int) -> float:
+    """Seconds the supervisor spends per update before a worker sees it."""
+    from aiogram.types import Update
+    from services.updates import chat_key
+
+    started = time.perf_counter()
+    for raw in updates:
+        # Polling parses the update, then re-encodes it for the worker's queue
+        update = Update.model_validate(raw)
+        payload = update.model_dump(mode="json", by_alias=True, exclude_none=True)
+        chat_key(payload) % count
+        pickle.dumps(("update", payload))
+    return (time.perf_counter() - started) / len(updates)
+
+
+def measure(count: int, updates: list[dict]) -> float:
+    """Updates per second processed by `count` workers, from the first update to the last exit."""
+    from services.updates import chat_key
+    from services.workers import WORKER_QUEUE_SIZE
+
+    ctx = mp.get_context("spawn")
+    inboxes = [ctx.Queue(WORKER_QUEUE_SIZE) for _ in range(count)]
+    events, ready = ctx.Queue(), ctx.Queue()
+    workers = [
+        ctx.Process(target=bench_worker, args=(i, inboxes[i], events, ready), name=f"worker-{i}")
+        for i in range(count)
+    ]
+    for worker in workers:
+        worker.start()
+    for _ in workers:
+        ready.get(timeout=300)
+
+    started = time.perf_counter()
+    for update in updates:
+        inboxes[chat_key(update) % count].put(("update", update))
+    for inbox in inboxes:
+        inbox.put(None)
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    if any(worker.exitcode for worker in workers):
+        raise RuntimeError(f"A worker failed with {count} workers")
+    return len(updates) / elapsed
+
+
+async def prepare(args) -> dict:
+    from database.setup import engine, read_engine, async_session, init_db
+    from benchmarks.fixtures import seed
+
+    await init_db()
+    async with async_session() as session:
+        ctx = await seed(session, args.classes, args.users, 6, args.homework, args.seed)
+    await engine.dispose()
+    await read_engine.dispose()
+    return ctx
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Multi-process worker throughput benchmark")
+    parser.add_argument("--workers", default="1,2,4", help="comma separated worker counts")
+    parser.add_argument("--updates", type=int, default=3000)
+    parser.add_argument("--classes", type=int, default=20)
+    parser.add_argument("--users", type=int, default=30, help="users per class")
+    parser.add_argument("--homework", type=int, default=200, help="homework per class")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="school_bot_workers_")
+    # Spawned workers inherit this environment
+    os.environ["DB_NAME"] = os.path.join(workdir, "bench.db")
+    os.environ.setdefault("BOT_TOKEN", "42:BENCHMARK")
+    os.environ.setdefault("THROTTLING", "0")
+    os.environ["SCHEDULER_WORKER"] = "-1"  # no reminders during the run
+    os.environ.pop("METRICS_PORT", None)
+
+    ctx = asyncio.run(prepare(args))
+    updates = build_updates(ctx, args.updates, args.seed)
+    counts = [int(n) for n in args.workers.split(",")]
+
+    print(f"{'workers':<10}{'updates/s':>12}{'speedup':>10}")
+    rates = {}
+    for count in counts:
+        rates[count] = measure(count, updates)
+        print(f"{count:<10}{rates[count]:>12.1f}{rates[count] / rates[counts[0]] * counts[0]:>10.2f}")
+
+    per_update = supervisor_cost(updates, max(counts))
+    # One worker's time per update, measured with a single worker when there is one
+    worker_cost = 1 / rates[min(counts)] * min(counts)
+    print(f"\nCPU cores: {os.cpu_count()}")
+    print(f"Worker: {worker_cost * 1000:.2f} ms/update, supervisor: {per_update * 1000:.3f} ms/update")
+    print(f"The supervisor keeps up with about {worker_cost / per_update:.0f} busy workers")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
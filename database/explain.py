@@ -0,0 +1,122 @@
+"""
+Prints EXPLAIN QUERY PLAN for the queries the handlers run on every update
+and fails if any of them scans a whole table. The plans come from a fresh
+database in a temporary directory; `python -m database.upgrade_check`
+makes sure migrated files end up with the same schema.
+
+Usage: python -m database.explain
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+from datetime import date
+
+from sqlalchemy import select, update, tuple_, table, column, func
+from sqlalchemy.dialects import sqlite
+
+from .upgrade_check import build
+from .models import (
+    DEFAULT_TENANT, User, ClassGroup, Schedule, Homework, HomeworkAttachment, ReminderTime, JobLease, OutboxMessage
+)
+
+# A sample value for every bound parameter is enough for the planner
+CLASS_ID, TELEGRAM_ID, DAY = 1, 1, 0
+DUE = date(2024, 9, 2)
+
+homeworks_fts = table("homeworks_fts", column("rowid"), column("homeworks_fts"))
+
+QUERIES = {
+    "resolve_user": select(User.id, User.tenant, User.telegram_id, User.role, User.class_group_id)
+        .where(User.tenant == DEFAULT_TENANT, User.telegram_id == TELEGRAM_ID),
+    "timetable_day": select(Schedule.lesson_number, Schedule.subject_name).where(
+        Schedule.class_group_id == CLASS_ID, Schedule.day_of_week == DAY
+    ).order_by(Schedule.lesson_number),
+    "schedule_lesson": select(Schedule).where(
+        Schedule.class_group_id == CLASS_ID, Schedule.day_of_week == DAY, Schedule.lesson_number == 1
+    ),
+    "homework_list": select(Homework).where(Homework.class_group_id == CLASS_ID)
+        .order_by(Homework.date_assigned.desc()),
+    "homework_page": select(Homework.id, Homework.subject_name, Homework.content, Homework.date_assigned)
+        .where(Homework.class_group_id == CLASS_ID,
+               tuple_(Homework.date_assigned, Homework.id) < ("2024-09-01", 10))
+        .order_by(Homework.date_assigned.desc(), Homework.id.desc()).limit(6),
+    "homework_page_subject": select(Homework.id, Homework.subject_name, Homework.content, Homework.date_assigned)
+        .where(Homework.class_group_id == CLASS_ID,
+               Homework.subject_name >= "Алг", Homework.subject_name < "Алг\uffff")
+        .order_by(Homework.date_assigned.desc(), Homework.id.desc()).limit(6),
+    "homework_page_dates": select(Homework.id, Homework.subject_name, Homework.content, Homework.date_assigned)
+        .where(Homework.class_group_id == CLASS_ID,
+               Homework.date_assigned >= "2024-09-01", Homework.date_assigned < "2025-01-01")
+        .order_by(Homework.date_assigned.desc(), Homework.id.desc()).limit(6),
+    "subject_days": select(Schedule.subject_name, Schedule.day_of_week)
+        .where(Schedule.class_group_id == CLASS_ID).distinct(),
+    "homework_due_on": select(Homework.id, Homework.subject_name, Homework.content)
+        .where(Homework.class_group_id == CLASS_ID, Homework.due_date == DUE).order_by(Homework.id),
+    "reminders_due": select(Homework.id, Homework.class_group_id, Homework.subject_name, Homework.content)
+        .where(Homework.class_group_id.in_([CLASS_ID, 2]), Homework.due_date == DUE)
+        .order_by(Homework.class_group_id, Homework.id),
+    "homework_by_subject": select(Homework).where(
+        Homework.class_group_id == CLASS_ID, Homework.subject_name == "Алгебра"
+    ),
+    "class_by_name": select(ClassGroup).where(ClassGroup.tenant == DEFAULT_TENANT, ClassGroup.name == "9A"),
+    "class_directory": select(ClassGroup.id, ClassGroup.name).where(ClassGroup.tenant == DEFAULT_TENANT),
+    "class_by_id": select(ClassGroup).where(ClassGroup.id == CLASS_ID),
+    "join_class": update(User).where(User.id == 1).values(class_group_id=CLASS_ID),
+    "class_members": select(User.telegram_id, User.class_group_id).where(User.class_group_id.in_([CLASS_ID])),
+    "reminder_times": select(ReminderTime.time).where(ReminderTime.class_group_id == CLASS_ID)
+        .order_by(ReminderTime.time),
+    "lesson_subscribers": select(User.telegram_id).where(
+        User.class_group_id == CLASS_ID, User.lesson_alerts.is_(True)
+    ),
+    "lesson_homework": select(Homework.id, Homework.content).where(
+        Homework.class_group_id == CLASS_ID, Homework.due_date == DUE, Homework.subject_name == "Алгебра"
+    ).order_by(Homework.id),
+    "outbox_due": select(OutboxMessage.id).where(
+        OutboxMessage.status.in_(("pending", "sending")), OutboxMessage.next_attempt_at <= "2024-09-01T08:00:00"
+    ).order_by(OutboxMessage.next_attempt_at, OutboxMessage.id).limit(100),
+    "job_lease": select(JobLease).where(JobLease.job_id == "reminder:08:00"),
+    "homework_attachments": select(HomeworkAttachment.homework_id, HomeworkAttachment.file_id)
+        .where(HomeworkAttachment.homework_id.in_([1, 2, 3]))
+        .order_by(HomeworkAttachment.homework_id, HomeworkAttachment.position),
+    "homework_subjects": select(Homework.subject_name).where(Homework.class_group_id == CLASS_ID).distinct(),
+    "homework_search": select(Homework.id, Homework.subject_name, Homework.date_assigned)
+        .select_from(homeworks_fts).join(Homework, Homework.id == homeworks_fts.c.rowid)
+        .where(homeworks_fts.c.homeworks_fts.op("MATCH")('"параграф"*'), Homework.class_group_id == CLASS_ID)
+        .order_by(func.bm25(column("homeworks_fts"), 2.0, 1.0)).limit(6),
+}
+
+
+def compile_sql(stmt) -> str:
+    return str(stmt.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}))
+
+
+def main() -> int:
+    failed = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "explain.db")
+        asyncio.run(build(path))
+        conn = sqlite3.connect(path)
+        for name, stmt in QUERIES.items():
+            sql = compile_sql(stmt)
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+            print(f"-- {name}\n{sql}")
+            for row in plan:
+                detail = row[-1]
+                print(f"   {detail}")
+                # "SCAN t" without an index is a full table scan
+                if detail.startswith("SCAN ") and "INDEX" not in detail:
+                    failed.append(name)
+            print()
+        conn.close()
+
+    if failed:
+        print(f"Full scans in: {', '.join(sorted(set(failed)))}")
+        return 1
+    print("No full table scans.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
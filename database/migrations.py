@@ -0,0 +1,170 @@
+import logging
+import re
+from dataclasses import dataclass
+
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from .models import HOMEWORK_FTS_DDL
+
+# Migrations are forward-only and applied in order at startup.
+# The applied version is kept in SQLite's PRAGMA user_version.
+# Fresh databases are built by create_all and stamped with the latest version,
+# so every table, column and index added here must also be declared in
+# models.py. Existing files are only ever migrated: a migration creates the
+# tables it introduces as they were at its version, and later migrations
+# alter them. `python -m database.upgrade_check` compares the two paths.
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    statements: tuple[str, ...]
+
+
+MIGRATIONS = [
+    Migration(1, "indexes and unique constraints on hot lookups", (
+        # Tables added before migrations existed; files from that time already have them
+        "CREATE TABLE IF NOT EXISTS reminder_times ("
+        "id INTEGER NOT NULL, class_group_id INTEGER NOT NULL, time VARCHAR(5) NOT NULL, "
+        "PRIMARY KEY (id), FOREIGN KEY(class_group_id) REFERENCES class_groups (id))",
+        "CREATE TABLE IF NOT EXISTS job_leases ("
+        "job_id VARCHAR(64) NOT NULL, fired_at VARCHAR(32) NOT NULL, owner VARCHAR(128) NOT NULL, "
+        "PRIMARY KEY (job_id))",
+        # Keep the newest row of duplicated lessons so the unique index can be built
+        "DELETE FROM schedules WHERE id NOT IN ("
+        "SELECT MAX(id) FROM schedules GROUP BY class_group_id, day_of_week, lesson_number)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_schedules_class_day_lesson "
+        "ON schedules (class_group_id, day_of_week, lesson_number)",
+        "CREATE INDEX IF NOT EXISTS ix_homeworks_class_date ON homeworks (class_group_id, date_assigned)",
+        "CREATE INDEX IF NOT EXISTS ix_users_class_group_id ON users (class_group_id)",
+        "DROP INDEX IF EXISTS ix_reminder_times_class_group_id",
+        "DELETE FROM reminder_times WHERE id NOT IN ("
+        "SELECT MIN(id) FROM reminder_times GROUP BY class_group_id, time)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_reminder_times_class_time ON reminder_times (class_group_id, time)",
+    )),
+    Migration(2, "index for homework filtered by subject", (
+        "CREATE INDEX IF NOT EXISTS ix_homeworks_class_subject_date "
+        "ON homeworks (class_group_id, subject_name, date_assigned)",
+    )),
+    # Switching an existing file to incremental auto_vacuum needs a full VACUUM,
+    # which the maintenance job does in its nightly window.
+    Migration(3, "per-class homework retention", (
+        "ALTER TABLE class_groups ADD COLUMN homework_retention_days INTEGER",
+        "CREATE TABLE IF NOT EXISTS homeworks_archive ("
+        "id INTEGER NOT NULL, class_group_id INTEGER NOT NULL, subject_name VARCHAR(128) NOT NULL, "
+        "content TEXT NOT NULL, attachment_id VARCHAR(256), date_assigned VARCHAR(32) NOT NULL, "
+        "archived_at VARCHAR(32) NOT NULL, "
+        "PRIMARY KEY (id), FOREIGN KEY(class_group_id) REFERENCES class_groups (id))",
+        "CREATE INDEX IF NOT EXISTS ix_homeworks_archive_class_date "
+        "ON homeworks_archive (class_group_id, date_assigned)",
+    )),
+    Migration(4, "opt-in lesson start alerts", (
+        "ALTER TABLE users ADD COLUMN lesson_alerts BOOLEAN NOT NULL DEFAULT 0",
+    )),
+    Migration(5, "notification outbox and blocked users", (
+        "ALTER TABLE users ADD COLUMN blocked_at VARCHAR(32)",
+        "CREATE TABLE IF NOT EXISTS outbox ("
+        "id INTEGER NOT NULL, dedup_key VARCHAR(160) NOT NULL, chat_id BIGINT NOT NULL, text TEXT NOT NULL, "
+        "status VARCHAR(10) NOT NULL, attempts INTEGER NOT NULL, next_attempt_at VARCHAR(32) NOT NULL, "
+        "created_at VARCHAR(32) NOT NULL, sent_at VARCHAR(32), last_error VARCHAR(256), "
+        "PRIMARY KEY (id), UNIQUE (dedup_key))",
+        "CREATE INDEX IF NOT EXISTS ix_outbox_status_next ON outbox (status, next_attempt_at)",
+    )),
+    # Fresh databases get the same table and triggers right after create_all builds homeworks
+    Migration(6, "full-text homework search", (
+        *HOMEWORK_FTS_DDL,
+        "INSERT INTO homeworks_fts (homeworks_fts) VALUES ('rebuild')",
+    )),
+    Migration(7, "homework attachments", (
+        "CREATE TABLE IF NOT EXISTS homework_attachments ("
+        "id INTEGER NOT NULL, homework_id INTEGER NOT NULL, position INTEGER NOT NULL, kind VARCHAR(10) NOT NULL, "
+        "file_id VARCHAR(256) NOT NULL, file_unique_id VARCHAR(64) NOT NULL, "
+        "PRIMARY KEY (id), FOREIGN KEY(homework_id) REFERENCES homeworks (id))",
+        "CREATE INDEX IF NOT EXISTS ix_homework_attachments_homework "
+        "ON homework_attachments (homework_id, position)",
+        "ALTER TABLE outbox ADD COLUMN attachments TEXT",
+    )),
+    # SQLite can't drop the old unique constraints on users.telegram_id and
+    # class_groups.name, so both tables are rebuilt; existing rows become the
+    # default tenant (the bot from BOT_TOKEN)
+    Migration(8, "several schools in one database", (
+        "CREATE TABLE class_groups_new ("
+        "id INTEGER NOT NULL, tenant VARCHAR(32) DEFAULT 'default' NOT NULL, name VARCHAR(32) NOT NULL, "
+        "schedule_calls TEXT, homework_retention_days INTEGER, PRIMARY KEY (id))",
+        "INSERT INTO class_groups_new (id, name, schedule_calls, homework_retention_days) "
+        "SELECT id, name, schedule_calls, homework_retention_days FROM class_groups",
+        "DROP TABLE class_groups",
+        "ALTER TABLE class_groups_new RENAME TO class_groups",
+        "CREATE UNIQUE INDEX ux_class_groups_tenant_name ON class_groups (tenant, name)",
+        "CREATE TABLE users_new ("
+        "id INTEGER NOT NULL, tenant VARCHAR(32) DEFAULT 'default' NOT NULL, telegram_id BIGINT NOT NULL, "
+        "full_name VARCHAR(128) NOT NULL, role VARCHAR(20) NOT NULL, "
+        "lesson_alerts BOOLEAN DEFAULT '0' NOT NULL, blocked_at VARCHAR(32), class_group_id INTEGER, "
+        "PRIMARY KEY (id), FOREIGN KEY(class_group_id) REFERENCES class_groups (id))",
+        "INSERT INTO users_new (id, telegram_id, full_name, role, lesson_alerts, blocked_at, class_group_id) "
+        "SELECT id, telegram_id, full_name, role, lesson_alerts, blocked_at, class_group_id FROM users",
+        "DROP TABLE users",
+        "ALTER TABLE users_new RENAME TO users",
+        "CREATE INDEX ix_users_class_group_id ON users (class_group_id)",
+        "CREATE UNIQUE INDEX ux_users_tenant_telegram ON users (tenant, telegram_id)",
+        "ALTER TABLE outbox ADD COLUMN tenant VARCHAR(32) NOT NULL DEFAULT 'default'",
+    )),
+    # Existing homework gets the first lesson of its subject after the day it
+    # was assigned. SQLite's 'weekday N' counts from Sunday, schedules from Monday.
+    # Subjects are matched exactly here; new homework ignores case (services/timetable.py)
+    Migration(9, "homework due dates", (
+        "ALTER TABLE homeworks ADD COLUMN due_date DATE",
+        "ALTER TABLE homeworks_archive ADD COLUMN due_date DATE",
+        "UPDATE homeworks SET due_date = ("
+        "SELECT MIN(date(homeworks.date_assigned, '+1 day', 'weekday ' || ((s.day_of_week + 1) % 7))) "
+        "FROM schedules s WHERE s.class_group_id = homeworks.class_group_id "
+        "AND s.subject_name = homeworks.subject_name)",
+        "CREATE INDEX IF NOT EXISTS ix_homeworks_class_due ON homeworks (class_group_id, due_date)",
+    )),
+]
+
+# init_db only runs create_all on a fresh file, so a new table or column
+# needs a migration here too, or existing databases won't get it
+LATEST_VERSION = MIGRATIONS[-1].version
+
+ADD_COLUMN_RE = re.compile(r"ALTER TABLE (\w+) ADD COLUMN (\w+)", re.IGNORECASE)
+
+
+async def get_version(engine: AsyncEngine) -> int:
+    async with engine.connect() as conn:
+        return (await conn.exec_driver_sql("PRAGMA user_version")).scalar()
+
+
+async def stamp(engine: AsyncEngine, version: int = LATEST_VERSION):
+    async with engine.begin() as conn:
+        await conn.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+
+
+async def _column_exists(conn: AsyncConnection, statement: str) -> bool:
+    """True if `statement` adds a column the table already has."""
+    match = ADD_COLUMN_RE.match(statement)
+    if not match:
+        return False
+    table, column = match.groups()
+    columns = (await conn.exec_driver_sql(f"PRAGMA table_info({table})")).all()
+    return any(row[1] == column for row in columns)
+
+
+async def migrate(engine: AsyncEngine) -> int:
+    """Apply pending migrations, each in its own transaction. Returns the new version."""
+    version = await get_version(engine)
+    for migration in MIGRATIONS:
+        if migration.version <= version:
+            continue
+        logging.warning(f"Applying migration {migration.version}: {migration.description}")
+        async with engine.begin() as conn:
+            for statement in migration.statements:
+                if await _column_exists(conn, statement):
+                    # Older releases ran create_all before migrating, which
+                    # could build a table with this column already in it
+                    continue
+                await conn.exec_driver_sql(statement)
+            await conn.exec_driver_sql(f"PRAGMA user_version = {migration.version}")
+        version = migration.version
+    return version
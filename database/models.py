@@ -1,38 +1,63 @@
-from sqlalchemy import ForeignKey, String, Integer, Text, BigInteger
+from datetime import date
+
+from sqlalchemy import ForeignKey, String, Integer, Text, BigInteger, Boolean, Date, Index, DDL, event
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
+# Tenant of rows written before multi-bot mode and of the bot from BOT_TOKEN
+DEFAULT_TENANT = "default"
+
 class Base(DeclarativeBase):
     pass
 
 class ClassGroup(Base):
     """Represents a school class (e.g. '9A')."""
     __tablename__ = "class_groups"
+    __table_args__ = (
+        Index("ux_class_groups_tenant_name", "tenant", "name", unique=True),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    name: Mapped[str] = mapped_column(String(32), unique=True)
+    # The school (bot) the class belongs to; its users, lessons and homework follow the class
+    tenant: Mapped[str] = mapped_column(String(32), default=DEFAULT_TENANT, server_default=DEFAULT_TENANT)
+    name: Mapped[str] = mapped_column(String(32))
     # Storing schedule call times as JSON string for now, or could be a separate table
     # format: {"1": ["08:30", "09:15"], "2": ...}
     schedule_calls: Mapped[str] = mapped_column(Text, nullable=True) 
+    # Days to keep homework before archiving; NULL - default, 0 - keep forever
+    homework_retention_days: Mapped[int] = mapped_column(Integer, nullable=True)
 
     users: Mapped[list["User"]] = relationship(back_populates="class_group")
     schedules: Mapped[list["Schedule"]] = relationship(back_populates="class_group")
     homeworks: Mapped[list["Homework"]] = relationship(back_populates="class_group")
+    reminder_times: Mapped[list["ReminderTime"]] = relationship(back_populates="class_group")
 
 class User(Base):
     """Represents a Telegram user."""
     __tablename__ = "users"
+    __table_args__ = (
+        # One Telegram account is a separate user in every school's bot
+        Index("ux_users_tenant_telegram", "tenant", "telegram_id", unique=True),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    telegram_id: Mapped[int] = mapped_column(BigInteger, unique=True)
+    tenant: Mapped[str] = mapped_column(String(32), default=DEFAULT_TENANT, server_default=DEFAULT_TENANT)
+    telegram_id: Mapped[int] = mapped_column(BigInteger)
     full_name: Mapped[str] = mapped_column(String(128))
     role: Mapped[str] = mapped_column(String(20), default="student") # student, headman
+    # Wants a message before every lesson (see services/timeline.py)
+    lesson_alerts: Mapped[bool] = mapped_column(Boolean, default=False, server_default="0")
+    # Set when Telegram says the user blocked the bot; such users get no broadcasts
+    blocked_at: Mapped[str] = mapped_column(String(32), nullable=True)
     
-    class_group_id: Mapped[int] = mapped_column(ForeignKey("class_groups.id"), nullable=True)
+    class_group_id: Mapped[int] = mapped_column(ForeignKey("class_groups.id"), nullable=True, index=True)
     class_group: Mapped["ClassGroup"] = relationship(back_populates="users")
 
 class Schedule(Base):
     """Represents the schedule for a specific class and day."""
     __tablename__ = "schedules"
+    __table_args__ = (
+        Index("ux_schedules_class_day_lesson", "class_group_id", "day_of_week", "lesson_number", unique=True),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     class_group_id: Mapped[int] = mapped_column(ForeignKey("class_groups.id"))
@@ -45,12 +70,116 @@ class Schedule(Base):
 class Homework(Base):
     """Represents homework for a subject."""
     __tablename__ = "homeworks"
+    __table_args__ = (
+        Index("ix_homeworks_class_date", "class_group_id", "date_assigned"),
+        Index("ix_homeworks_class_subject_date", "class_group_id", "subject_name", "date_assigned"),
+        Index("ix_homeworks_class_due", "class_group_id", "due_date"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     class_group_id: Mapped[int] = mapped_column(ForeignKey("class_groups.id"))
     subject_name: Mapped[str] = mapped_column(String(128))
     content: Mapped[str] = mapped_column(Text)
-    attachment_id: Mapped[str] = mapped_column(String(256), nullable=True) # file_id from Telegram
+    attachment_id: Mapped[str] = mapped_column(String(256), nullable=True) # file_id of the first attachment, if any
     date_assigned: Mapped[str] = mapped_column(String(32)) # ISO format YYYY-MM-DD
+    # Next lesson of the subject after it was assigned; NULL if the subject isn't in the timetable
+    due_date: Mapped[date] = mapped_column(Date, nullable=True)
     
     class_group: Mapped["ClassGroup"] = relationship(back_populates="homeworks")
+
+class HomeworkAttachment(Base):
+    """A photo or document sent with homework; resent by file_id, never re-uploaded."""
+    __tablename__ = "homework_attachments"
+    __table_args__ = (
+        Index("ix_homework_attachments_homework", "homework_id", "position"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    homework_id: Mapped[int] = mapped_column(ForeignKey("homeworks.id"))
+    position: Mapped[int] = mapped_column(Integer, default=0)
+    kind: Mapped[str] = mapped_column(String(10)) # photo, document
+    file_id: Mapped[str] = mapped_column(String(256))
+    file_unique_id: Mapped[str] = mapped_column(String(64))
+
+class HomeworkArchive(Base):
+    """Homework moved out of the hot table by the maintenance job."""
+    __tablename__ = "homeworks_archive"
+    __table_args__ = (
+        Index("ix_homeworks_archive_class_date", "class_group_id", "date_assigned"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True) # same id as in homeworks
+    class_group_id: Mapped[int] = mapped_column(ForeignKey("class_groups.id"))
+    subject_name: Mapped[str] = mapped_column(String(128))
+    content: Mapped[str] = mapped_column(Text)
+    attachment_id: Mapped[str] = mapped_column(String(256), nullable=True)
+    date_assigned: Mapped[str] = mapped_column(String(32))
+    due_date: Mapped[date] = mapped_column(Date, nullable=True)
+    archived_at: Mapped[str] = mapped_column(String(32))
+
+class ReminderTime(Base):
+    """A daily homework reminder time configured for a class."""
+    __tablename__ = "reminder_times"
+    __table_args__ = (
+        Index("ux_reminder_times_class_time", "class_group_id", "time", unique=True),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    class_group_id: Mapped[int] = mapped_column(ForeignKey("class_groups.id"))
+    time: Mapped[str] = mapped_column(String(5)) # HH:MM
+
+    class_group: Mapped["ClassGroup"] = relationship(back_populates="reminder_times")
+
+class OutboxMessage(Base):
+    """A notification waiting to be sent (or already sent) by the outbox drainer."""
+    __tablename__ = "outbox"
+    __table_args__ = (
+        Index("ix_outbox_status_next", "status", "next_attempt_at"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    # The same key is never queued twice, so re-running a job adds no duplicates
+    dedup_key: Mapped[str] = mapped_column(String(160), unique=True)
+    # Whose bot sends it
+    tenant: Mapped[str] = mapped_column(String(32), default=DEFAULT_TENANT, server_default=DEFAULT_TENANT)
+    chat_id: Mapped[int] = mapped_column(BigInteger)
+    text: Mapped[str] = mapped_column(Text)
+    status: Mapped[str] = mapped_column(String(10), default="pending") # pending, sending, delivered, dead
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[str] = mapped_column(String(32)) # ISO format; for "sending" - when the claim expires
+    created_at: Mapped[str] = mapped_column(String(32))
+    sent_at: Mapped[str] = mapped_column(String(32), nullable=True)
+    last_error: Mapped[str] = mapped_column(String(256), nullable=True)
+    attachments: Mapped[str] = mapped_column(Text, nullable=True) # JSON, sent with `text` as caption
+
+class JobLease(Base):
+    """Last fire time claimed for a scheduled job, shared by all replicas."""
+    __tablename__ = "job_leases"
+
+    job_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    fired_at: Mapped[str] = mapped_column(String(32)) # ISO format of the scheduled fire time
+    owner: Mapped[str] = mapped_column(String(128))
+
+# Full-text index over homework subject and text (/hw_search). The FTS5 table
+# stores no text of its own: it reads rows from homeworks, and the triggers
+# keep it in sync with every insert, update and delete, bulk ones included.
+HOMEWORK_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS homeworks_fts USING fts5("
+    "subject_name, content, content='homeworks', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS homeworks_fts_insert AFTER INSERT ON homeworks BEGIN "
+    "INSERT INTO homeworks_fts (rowid, subject_name, content) VALUES (new.id, new.subject_name, new.content); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS homeworks_fts_delete AFTER DELETE ON homeworks BEGIN "
+    "INSERT INTO homeworks_fts (homeworks_fts, rowid, subject_name, content) "
+    "VALUES ('delete', old.id, old.subject_name, old.content); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS homeworks_fts_update AFTER UPDATE OF subject_name, content ON homeworks BEGIN "
+    "INSERT INTO homeworks_fts (homeworks_fts, rowid, subject_name, content) "
+    "VALUES ('delete', old.id, old.subject_name, old.content); "
+    "INSERT INTO homeworks_fts (rowid, subject_name, content) VALUES (new.id, new.subject_name, new.content); "
+    "END",
+)
+
+for _statement in HOMEWORK_FTS_DDL:
+    event.listen(Homework.__table__, "after_create", DDL(_statement))
@@ -0,0 +1,183 @@
+from datetime import date
+
+from sqlalchemy import select, update, delete
+from sqlalchemy.dialects.sqlite import insert
+
+from .models import User, ClassGroup, Schedule, Homework, HomeworkArchive, ReminderTime
+
+# Repositories run Core statements through the update's UnitOfWork, so the
+# same code serves the read-only path (row tuples from a bare connection)
+# and the write session. They never commit.
+
+
+class Repository:
+    def __init__(self, db):
+        self.db = db
+
+
+class ScheduleRepository(Repository):
+    async def day(self, class_group_id: int, day_of_week: int) -> list[tuple[int, str]]:
+        return (await self.db.execute(
+            select(Schedule.lesson_number, Schedule.subject_name).where(
+                Schedule.class_group_id == class_group_id,
+                Schedule.day_of_week == day_of_week
+            ).order_by(Schedule.lesson_number)
+        )).all()
+
+    async def subject_days(self, class_group_id: int) -> list[tuple[str, int]]:
+        return (await self.db.execute(
+            select(Schedule.subject_name, Schedule.day_of_week)
+            .where(Schedule.class_group_id == class_group_id).distinct()
+        )).all()
+
+    async def upsert(self, class_group_id: int, day_of_week: int, lesson_number: int, subject_name: str):
+        stmt = insert(Schedule).values(
+            class_group_id=class_group_id,
+            day_of_week=day_of_week,
+            lesson_number=lesson_number,
+            subject_name=subject_name
+        )
+        await self.db.execute(stmt.on_conflict_do_update(
+            index_elements=[Schedule.class_group_id, Schedule.day_of_week, Schedule.lesson_number],
+            set_={"subject_name": stmt.excluded.subject_name}
+        ))
+
+    async def delete(self, class_group_id: int, day_of_week: int, lesson_number: int) -> bool:
+        """False if there was no such lesson."""
+        result = await self.db.execute(delete(Schedule).where(
+            Schedule.class_group_id == class_group_id,
+            Schedule.day_of_week == day_of_week,
+            Schedule.lesson_number == lesson_number
+        ))
+        return result.rowcount > 0
+
+
+class HomeworkRepository(Repository):
+    async def add(self, class_group_id: int, subject_name: str, content: str,
+                  date_assigned: str, due_date: date | None = None, attachment_id: str | None = None) -> int:
+        return (await self.db.execute(
+            insert(Homework).values(
+                class_group_id=class_group_id,
+                subject_name=subject_name,
+                content=content,
+                attachment_id=attachment_id,
+                date_assigned=date_assigned,
+                due_date=due_date
+            ).returning(Homework.id)
+        )).scalar_one()
+
+    async def due_on(self, class_group_id: int, day: date):
+        """Homework due on `day`, in the page row shape of services.homework."""
+        return (await self.db.execute(
+            select(Homework.id, Homework.subject_name, Homework.content, Homework.date_assigned,
+                   Homework.attachment_id, Homework.due_date)
+            .where(Homework.class_group_id == class_group_id, Homework.due_date == day)
+            .order_by(Homework.id)
+        )).all()
+
+    async def ids_by_subject(self, class_group_id: int, subject_name: str) -> list[int]:
+        return list((await self.db.execute(
+            select(Homework.id).where(
+                Homework.class_group_id == class_group_id,
+                Homework.subject_name == subject_name
+            )
+        )).scalars().all())
+
+    async def delete(self, homework_ids: list[int]):
+        await self.db.execute(delete(Homework).where(Homework.id.in_(homework_ids)))
+
+    async def find(self, class_group_id: int, homework_id: int) -> int | None:
+        """The id back if the homework belongs to the class."""
+        return (await self.db.execute(
+            select(Homework.id).where(Homework.id == homework_id, Homework.class_group_id == class_group_id)
+        )).scalar_one_or_none()
+
+    async def archived(self, class_group_id: int, subject_name: str | None, limit: int):
+        """Newest archived homework: (subject_name, content, date_assigned) rows."""
+        query = select(HomeworkArchive.subject_name, HomeworkArchive.content, HomeworkArchive.date_assigned).where(
+            HomeworkArchive.class_group_id == class_group_id
+        )
+        if subject_name:
+            query = query.where(HomeworkArchive.subject_name == subject_name)
+        return (await self.db.execute(query.order_by(HomeworkArchive.date_assigned.desc()).limit(limit))).all()
+
+
+class ClassRepository(Repository):
+    async def add(self, tenant: str, name: str) -> int | None:
+        """None if the school already has a class with this name."""
+        return (await self.db.execute(
+            insert(ClassGroup).values(tenant=tenant, name=name)
+            .on_conflict_do_nothing(index_elements=[ClassGroup.tenant, ClassGroup.name])
+            .returning(ClassGroup.id)
+        )).scalar_one_or_none()
+
+    async def reminder_times(self, class_group_id: int) -> list[str]:
+        return list((await self.db.execute(
+            select(ReminderTime.time).where(ReminderTime.class_group_id == class_group_id).order_by(ReminderTime.time)
+        )).scalars().all())
+
+    async def set_reminder_times(self, class_group_id: int, times: list[str]):
+        await self.db.execute(delete(ReminderTime).where(ReminderTime.class_group_id == class_group_id))
+        await self.db.execute(insert(ReminderTime).values(
+            [{"class_group_id": class_group_id, "time": t} for t in times]
+        ))
+
+    async def bells(self, class_group_id: int) -> str | None:
+        """The stored JSON; services.timetable.parse_bells reads it."""
+        return (await self.db.execute(
+            select(ClassGroup.schedule_calls).where(ClassGroup.id == class_group_id)
+        )).scalar_one_or_none()
+
+    async def set_bells(self, class_group_id: int, schedule_calls: str):
+        await self.db.execute(
+            update(ClassGroup).where(ClassGroup.id == class_group_id).values(schedule_calls=schedule_calls)
+        )
+
+    async def retention_days(self, class_group_id: int) -> int | None:
+        """None means the global default."""
+        return (await self.db.execute(
+            select(ClassGroup.homework_retention_days).where(ClassGroup.id == class_group_id)
+        )).scalar_one_or_none()
+
+    async def set_retention_days(self, class_group_id: int, days: int):
+        await self.db.execute(
+            update(ClassGroup).where(ClassGroup.id == class_group_id).values(homework_retention_days=days)
+        )
+
+
+class UserRepository(Repository):
+    # The columns of services.users.CachedUser
+    COLUMNS = (User.id, User.tenant, User.telegram_id, User.role, User.class_group_id)
+
+    async def find(self, tenant: str, telegram_id: int):
+        """The CachedUser columns plus blocked_at, or None."""
+        return (await self.db.execute(
+            select(*self.COLUMNS, User.blocked_at).where(User.tenant == tenant, User.telegram_id == telegram_id)
+        )).one_or_none()
+
+    async def add(self, tenant: str, telegram_id: int, full_name: str):
+        """Register a user; returns the CachedUser columns."""
+        return (await self.db.execute(
+            insert(User).values(tenant=tenant, telegram_id=telegram_id, full_name=full_name).returning(*self.COLUMNS)
+        )).one()
+
+    async def set_class(self, user_id: int, class_group_id: int):
+        await self.db.execute(update(User).where(User.id == user_id).values(class_group_id=class_group_id))
+
+    async def make_headman(self, user_id: int, class_group_id: int | None = None):
+        """Grant the headman role, moving the user into `class_group_id` if given."""
+        values = {"role": "headman"}
+        if class_group_id is not None:
+            values["class_group_id"] = class_group_id
+        await self.db.execute(update(User).where(User.id == user_id).values(**values))
+
+    async def set_blocked(self, tenant: str, telegram_id: int, blocked_at: str | None):
+        await self.db.execute(
+            update(User).where(User.tenant == tenant, User.telegram_id == telegram_id).values(blocked_at=blocked_at)
+        )
+
+    async def lesson_alerts(self, user_id: int) -> bool:
+        return (await self.db.execute(select(User.lesson_alerts).where(User.id == user_id))).scalar_one()
+
+    async def set_lesson_alerts(self, user_id: int, enabled: bool):
+        await self.db.execute(update(User).where(User.id == user_id).values(lesson_alerts=enabled))
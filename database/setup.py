@@ -1,14 +1,77 @@
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, async_sessionmaker
 from .models import Base
+from .migrations import LATEST_VERSION, migrate, stamp
 import os
 
 # For now using SQLite
 DB_NAME = os.getenv("DB_NAME", "school_bot.db")
 DATABASE_URL = f"sqlite+aiosqlite:///{DB_NAME}"
 
-engine = create_async_engine(DATABASE_URL, echo=False)
+# Engine profile, tunable through the environment
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # safe with WAL
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))  # ms
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-16000"))  # negative means KiB
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(64 * 1024 * 1024)))
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+DB_WRITE_TIMEOUT = float(os.getenv("DB_WRITE_TIMEOUT", "30"))  # s to wait for the writer
+
+def _apply_pragmas(dbapi_connection, read_only: bool):
+    cursor = dbapi_connection.cursor()
+    if not read_only:
+        # Only takes effect on a new database file; existing ones are
+        # switched over by the maintenance job's VACUUM
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        # WAL lets readers keep going while a write is in progress
+        cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+    cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    if read_only:
+        cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+# SQLite allows a single writer at a time. The write engine owns exactly one
+# connection, so write sessions queue for it in the pool instead of failing
+# with "database is locked" on commit. A write session holds that connection
+# from its first statement until commit, rollback or close, so handlers that
+# only show data are flagged {"db": "read"} and write handlers commit or roll
+# back (UnitOfWork.commit/rollback) before replying.
+engine = create_async_engine(
+    DATABASE_URL, echo=False,
+    pool_size=1, max_overflow=0, pool_timeout=DB_WRITE_TIMEOUT
+)
+# Readers get their own pool and never wait for the writer under WAL
+read_engine = create_async_engine(
+    DATABASE_URL, echo=False,
+    pool_size=DB_READ_POOL_SIZE, max_overflow=0
+)
+
+@event.listens_for(engine.sync_engine, "connect")
+def _on_write_connect(dbapi_connection, connection_record):
+    _apply_pragmas(dbapi_connection, read_only=False)
+
+@event.listens_for(read_engine.sync_engine, "connect")
+def _on_read_connect(dbapi_connection, connection_record):
+    _apply_pragmas(dbapi_connection, read_only=True)
+
 async_session = async_sessionmaker(engine, expire_on_commit=False)
+read_session = async_sessionmaker(read_engine, expire_on_commit=False)
+
+async def init_db(db_engine: AsyncEngine = engine):
+    async with db_engine.begin() as conn:
+        # Fast path: an up-to-date database needs no schema inspection at all
+        if (await conn.exec_driver_sql("PRAGMA user_version")).scalar() == LATEST_VERSION:
+            return
+        fresh = not (await conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'class_groups'"
+        )).first()
+        if fresh:
+            # The latest schema in one go; migrations only ever touch existing files
+            await conn.run_sync(Base.metadata.create_all)
 
-async def init_db():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    if fresh:
+        await stamp(db_engine)
+    else:
+        await migrate(db_engine)
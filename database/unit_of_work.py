@@ -0,0 +1,69 @@
+import logging
+from typing import Callable
+
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from .setup import read_engine
+from .repositories import ScheduleRepository, HomeworkRepository, UserRepository, ClassRepository
+
+
+class UnitOfWork:
+    """
+    The database access of one update, handed to handlers as `db`.
+
+    Without a session it is read-only: statements run on a bare connection
+    of the read engine, taken on the first query, so there is no ORM
+    session or identity map and rows come back as tuples. With a session
+    it is the update's single write transaction; cache invalidations
+    registered with on_commit() run only once the data is committed.
+    """
+
+    def __init__(self, session: AsyncSession | None = None):
+        self._session = session
+        self._conn: AsyncConnection | None = None
+        self._after_commit: list[Callable[[], None]] = []
+        self.schedule = ScheduleRepository(self)
+        self.homework = HomeworkRepository(self)
+        self.users = UserRepository(self)
+        self.classes = ClassRepository(self)
+
+    @property
+    def read_only(self) -> bool:
+        return self._session is None
+
+    @property
+    def session(self) -> AsyncSession:
+        if self._session is None:
+            raise RuntimeError('The handler is flagged read-only; flag it {"db": "write"} to get a session')
+        return self._session
+
+    async def execute(self, statement):
+        if self._session is not None:
+            return await self._session.execute(statement)
+        if self._conn is None:
+            self._conn = await read_engine.connect()
+        return await self._conn.execute(statement)
+
+    def on_commit(self, callback: Callable[[], None]):
+        self._after_commit.append(callback)
+
+    async def commit(self):
+        """Commit now, e.g. before confirming to the user; the middleware commits the rest."""
+        await self.session.commit()
+        callbacks, self._after_commit = self._after_commit, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logging.error(f"After-commit callback failed: {e}")
+
+    async def rollback(self):
+        """Give up the transaction now, e.g. before telling the user there was nothing to change.
+        Leaves the writer connection free while the reply goes out."""
+        await self.session.rollback()
+        self._after_commit = []
+
+    async def close(self):
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
@@ -0,0 +1,97 @@
+"""
+Upgrades a copy of a database file (the committed school_bot.db by default)
+and fails unless the result has the same tables, columns and indexes as a
+fresh database built from models.py.
+
+Usage: python -m database.upgrade_check [path/to/file.db]
+"""
+import asyncio
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from .migrations import LATEST_VERSION
+from .setup import init_db
+
+SOURCE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "school_bot.db")
+
+
+async def build(path: str):
+    """init_db() on the file at `path`: migrates an existing file, creates a missing one."""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    try:
+        await init_db(engine)
+    finally:
+        await engine.dispose()
+
+
+def describe(path: str) -> dict[str, dict]:
+    """Columns and indexes of every table. Column order and defaults are left out:
+    ALTER TABLE appends columns and spells defaults its own way."""
+    conn = sqlite3.connect(path)
+    schema = {}
+    tables = [name for (name,) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+    )]
+    for table in tables:
+        columns = {name: (col_type.upper(), bool(notnull), pk)
+                   for _, name, col_type, notnull, _, pk in conn.execute(f"PRAGMA table_info('{table}')")}
+        indexes = set()
+        for _, index, unique, *_ in conn.execute(f"PRAGMA index_list('{table}')"):
+            index_columns = tuple(row[2] for row in conn.execute(f"PRAGMA index_info('{index}')"))
+            # Indexes behind inline UNIQUE constraints get generated names
+            indexes.add((None if index.startswith("sqlite_autoindex") else index, index_columns, bool(unique)))
+        schema[table] = {"columns": columns, "indexes": indexes}
+    conn.close()
+    return schema
+
+
+def compare(upgraded: dict[str, dict], fresh: dict[str, dict]) -> list[str]:
+    problems = []
+    for table in sorted(upgraded.keys() | fresh.keys()):
+        if table not in upgraded:
+            problems.append(f"{table}: missing after upgrade")
+            continue
+        if table not in fresh:
+            problems.append(f"{table}: left over after upgrade")
+            continue
+        for kind in ("columns", "indexes"):
+            old, new = upgraded[table][kind], fresh[table][kind]
+            if old != new:
+                problems.append(f"{table} {kind}: upgraded {sorted(old, key=str)} != fresh {sorted(new, key=str)}")
+    return problems
+
+
+def main() -> int:
+    source = sys.argv[1] if len(sys.argv) > 1 else SOURCE
+    with tempfile.TemporaryDirectory() as tmp:
+        upgraded, fresh = os.path.join(tmp, "upgraded.db"), os.path.join(tmp, "fresh.db")
+        shutil.copyfile(source, upgraded)
+        asyncio.run(build(upgraded))
+        asyncio.run(build(fresh))
+
+        conn = sqlite3.connect(upgraded)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        conn.close()
+
+        problems = compare(describe(upgraded), describe(fresh))
+    if version != LATEST_VERSION:
+        problems.append(f"user_version {version}, expected {LATEST_VERSION}")
+    if integrity != "ok":
+        problems.append(f"integrity_check: {integrity}")
+
+    for problem in problems:
+        print(problem)
+    if problems:
+        return 1
+    print(f"{source} upgrades cleanly to version {LATEST_VERSION}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
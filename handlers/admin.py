@@ -1,18 +1,35 @@
+import html
 from aiogram import Router, F
-from aiogram.filters import Command
-from aiogram.types import Message
-from sqlalchemy import select
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message, CallbackQuery
+from datetime import date, datetime, timedelta
 
 from database.setup import async_session
-from database.models import User, Schedule, ClassGroup
+from database.unit_of_work import UnitOfWork
+from services.users import CachedUser, resolve_user, invalidate_user
+from services.tenants import tenant_of
+from services.timetable import WEEKDAYS, bump_version, due_date, parse_bells, format_bells
+from services.homework import (
+    HomeworkPage, HomeworkFiles, HomeworkFilter, SearchPage, MAX_CONTENT_LENGTH, parse_filter, homework_page,
+    render_page
+)
+from services.attachments import (
+    Attachment, MediaGroupBuffer, MAX_ATTACHMENTS, from_message, save_attachments, load_attachments,
+    delete_attachments, send_attachments
+)
+from services.invalidation import publish
+from services.classes import class_created
 
 router = Router()
 
+# How many archived homeworks /hw_archive shows
+ARCHIVE_PAGE_SIZE = 10
+
 # Simple text-based schedule adder for MVP
 # Format: /add_schedule [day_num 0-6] [lesson_num] [subject]
 # Example: /add_schedule 0 1 Algebra
-@router.message(Command("add_schedule"))
-async def add_schedule(message: Message):
+@router.message(Command("add_schedule"), flags={"db": "write"})
+async def add_schedule(message: Message, user: CachedUser | None, db: UnitOfWork):
     if not message.text:
         await message.answer("Ошибка: пустое сообщение")
         return
@@ -29,113 +46,201 @@ async def add_schedule(message: Message):
         await message.answer("День и номер урока должны быть числами.")
         return
 
+    # Check permissions (simplified: anyone registered as headman or just first user for now)
+    # For MVP, assuming the user has class_group_id
+    if not user or not user.class_group_id:
+        await message.answer("Ты не привязан к классу.")
+        return
+
+    # Create or update schedule in one statement
+    await db.schedule.upsert(user.class_group_id, day, lesson_num, subject)
+    db.on_commit(lambda: bump_version(user.class_group_id))
+    await db.commit()
+    await message.answer(f"✅ Урок добавлен: День {day}, Урок {lesson_num} - {subject}")
+
+async def _add_album_homework(messages: list[Message]):
+    """An album whose caption is /add_hw becomes one homework with all its files"""
+    command = next((m for m in messages if (m.caption or "").startswith("/add_hw")), None)
+    if command is None:
+        return
+    user = await resolve_user(tenant_of(command.bot), command.from_user.id)
+    # Not a handler call, so there is no `db` from the middleware
     async with async_session() as session:
-        # Check permissions (simplified: anyone registered as headman or just first user for now)
-        # For MVP, assuming the user has class_group_id
-        user = (await session.execute(select(User).where(User.telegram_id == message.from_user.id))).scalar_one_or_none()
-        
-        if not user or not user.class_group_id:
-            await message.answer("Ты не привязан к классу.")
-            return
+        await _store_homework(UnitOfWork(session), command, user,
+                              [attachment for m in messages if (attachment := from_message(m))])
 
-        # Create or update schedule
-        # Check if exists
-        existing_sub = (await session.execute(
-            select(Schedule).where(
-                Schedule.class_group_id == user.class_group_id,
-                Schedule.day_of_week == day,
-                Schedule.lesson_number == lesson_num
-            )
-        )).scalar_one_or_none()
-
-        if existing_sub:
-            existing_sub.subject_name = subject
-        else:
-            new_sch = Schedule(
-                class_group_id=user.class_group_id,
-                day_of_week=day,
-                lesson_number=lesson_num,
-                subject_name=subject
-            )
-            session.add(new_sch)
-        
-        await session.commit()
-        await message.answer(f"✅ Урок добавлен: День {day}, Урок {lesson_num} - {subject}")
+albums = MediaGroupBuffer(_add_album_homework)
 
-@router.message(Command("add_hw"))
-async def add_homework(message: Message):
-    # Format: /add_hw [subject] [text]
-    if not message.text:
-        await message.answer("Ошибка: пустое сообщение")
+@router.message(F.media_group_id)
+async def collect_album(message: Message):
+    """Album items arrive one by one; they are handled together"""
+    albums.add(message)
+
+@router.message(Command("add_hw"), flags={"db": "write"})
+async def add_homework(message: Message, user: CachedUser | None, db: UnitOfWork):
+    # Format: /add_hw [subject] [text], as a message or as the caption of a photo or file,
+    # or in reply to one
+    attachment = from_message(message)
+    if not attachment and message.reply_to_message:
+        attachment = from_message(message.reply_to_message)
+    await _store_homework(db, message, user, [attachment] if attachment else [])
+
+async def _store_homework(db: UnitOfWork, message: Message, user: CachedUser | None, attachments: list[Attachment]):
+    args = (message.text or message.caption or "").split(maxsplit=2)
+    if len(args) < 3 and not (len(args) == 2 and attachments):
+        await message.answer("Использование: /add_hw [предмет] [задание]\n"
+                             "Можно прислать фото или файл с этой подписью.")
         return
-    args = message.text.split(maxsplit=2)
-    if len(args) < 3:
-        await message.answer("Использование: /add_hw [предмет] [задание]")
+    if len(attachments) > MAX_ATTACHMENTS:
+        await message.answer(f"Не больше {MAX_ATTACHMENTS} вложений к одному заданию.")
         return
     
     subject = args[1]
-    content = args[2]
+    content = args[2] if len(args) > 2 else ""
 
-    async with async_session() as session:
-        user = (await session.execute(select(User).where(User.telegram_id == message.from_user.id))).scalar_one_or_none()
-        
-        if not user or not user.class_group_id:
-            await message.answer("Ты не привязан к классу.")
-            return
+    if not user or not user.class_group_id:
+        await message.answer("Ты не привязан к классу.")
+        return
 
-        # Simplified: Just create a new homework entry for "today" or "next lesson"
-        # For this MVP, we just store it. Logic to find "next lesson" is needed but complex.
-        # We will assume it's for the next occurrence of this subject.
-        
-        from database.models import Homework
-        from datetime import datetime
-        
-        new_hw = Homework(
-            class_group_id=user.class_group_id,
-            subject_name=subject,
-            content=content,
-            date_assigned=datetime.now().isoformat()
-        )
-        session.add(new_hw)
-        await session.commit()
-        await message.answer(f"✅ ДЗ по {subject} добавлено: {content}")
+    # Due at the next lesson of the subject
+    now = datetime.now()
+    due = await due_date(db, user.class_group_id, subject, now.date())
+    homework_id = await db.homework.add(
+        user.class_group_id, subject, content, now.isoformat(), due,
+        attachment_id=attachments[0].file_id if attachments else None
+    )
+    if attachments:
+        await save_attachments(db.session, homework_id, attachments)
+    db.on_commit(lambda: publish("homework", user.class_group_id))
+    await db.commit()
+    files = f" (вложений: {len(attachments)})" if attachments else ""
+    if due:
+        when = f"Сдать к {WEEKDAYS[due.weekday()].lower()}, {due:%d.%m}."
+    else:
+        when = "Этого предмета нет в расписании, срок сдачи не определен."
+    await message.answer(f"✅ ДЗ по {html.escape(subject)} добавлено: {html.escape(content)}{files}\n{when}")
 
-@router.message(Command("hw"))
-async def view_homework(message: Message):
-    """View all homework for the user's class"""
+@router.message(Command("hw"), flags={"db": "read"})
+async def view_homework(message: Message, user: CachedUser | None, db: UnitOfWork):
+    """View homework for the user's class, one page at a time"""
     if not message.from_user:
         await message.answer("Ошибка: не удалось определить пользователя")
         return
         
-    async with async_session() as session:
-        user = (await session.execute(select(User).where(User.telegram_id == message.from_user.id))).scalar_one_or_none()
-        
-        if not user or not user.class_group_id:
-            await message.answer("Ты не привязан к классу.")
-            return
+    if not user or not user.class_group_id:
+        await message.answer("Ты не привязан к классу.")
+        return
 
-        from database.models import Homework
-        
-        homeworks = (await session.execute(
-            select(Homework).where(
-                Homework.class_group_id == user.class_group_id
-            ).order_by(Homework.date_assigned.desc())
-        )).scalars().all()
-        
-        if not homeworks:
-            await message.answer("Домашних заданий нет.")
-            return
+    # Format: /hw [subject] [date_from] [date_to]
+    try:
+        flt = parse_filter((message.text or "").split()[1:])
+    except ValueError:
+        await message.answer("Дата должна быть в формате ГГГГ-ММ-ДД, например: /hw Алгебра 2024-09-01 2024-12-31")
+        return
+
+    text, markup = await homework_page(db, user.class_group_id, flt)
+    
+    if not text:
+        await message.answer("Домашних заданий нет.")
+        return
 
-        text = ["📚 <b>Домашние задания:</b>\n"]
-        for hw in homeworks:
-            text.append(f"📖 <b>{hw.subject_name}</b> ({hw.date_assigned})")
-            text.append(f"   {hw.content}")
-            text.append("")
-            
-        await message.answer("\n".join(text))
+    await message.answer(text, reply_markup=markup)
 
-@router.message(Command("create_class"))
-async def create_class(message: Message):
+@router.message(Command("hw_tomorrow"), flags={"db": "read"})
+async def homework_tomorrow(message: Message, user: CachedUser | None, db: UnitOfWork):
+    """Homework due tomorrow"""
+    if not user or not user.class_group_id:
+        await message.answer("Ты не привязан к классу.")
+        return
+
+    rows = await db.homework.due_on(user.class_group_id, date.today() + timedelta(days=1))
+    if not rows:
+        await message.answer("На завтра ничего не задано.")
+        return
+
+    text, markup = render_page(rows, False, False, HomeworkFilter())
+    await message.answer(text, reply_markup=markup)
+
+@router.callback_query(HomeworkPage.filter(), flags={"db": "read"})
+async def homework_page_callback(callback: CallbackQuery, callback_data: HomeworkPage, user: CachedUser | None,
+                                 db: UnitOfWork):
+    """Turn a page of the homework list"""
+    if not user or not user.class_group_id:
+        await callback.answer("Ты не привязан к классу.", show_alert=True)
+        return
+
+    flt = HomeworkFilter(subject=callback_data.s, date_from=callback_data.f, date_to=callback_data.t)
+    text, markup = await homework_page(db, user.class_group_id, flt, callback_data.c, callback_data.d)
+
+    if not text:
+        await callback.answer("Больше заданий нет.")
+        return
+
+    await callback.message.edit_text(text, reply_markup=markup)
+    await callback.answer()
+
+@router.callback_query(HomeworkFiles.filter(), flags={"db": "read"})
+async def homework_files_callback(callback: CallbackQuery, callback_data: HomeworkFiles, user: CachedUser | None,
+                                  db: UnitOfWork):
+    """Send the photos and files of one homework"""
+    if not user or not user.class_group_id:
+        await callback.answer("Ты не привязан к классу.", show_alert=True)
+        return
+
+    # Only homework of the user's own class
+    homework_id = await db.homework.find(user.class_group_id, callback_data.i)
+    attachments = (await load_attachments(db, [homework_id])).get(homework_id) if homework_id else None
+
+    if not attachments:
+        await callback.answer("Вложений нет.")
+        return
+
+    await callback.answer()
+    await send_attachments(callback.bot, callback.message.chat.id, attachments)
+
+@router.message(Command("hw_search"), flags={"db": "read"})
+async def hw_search(message: Message, user: CachedUser | None, db: UnitOfWork):
+    """Full-text search over the class's homework"""
+    if not user or not user.class_group_id:
+        await message.answer("Ты не привязан к классу.")
+        return
+
+    args = (message.text or "").split(maxsplit=1)
+    if len(args) < 2:
+        await message.answer("Использование: /hw_search [слова], например: /hw_search алгебра параграф 5")
+        return
+
+    # FTS5 and the subject matcher are only needed once someone searches
+    from services.search import search_page
+
+    query = args[1].strip()
+    text, markup = await search_page(db, user.class_group_id, query)
+    if not text:
+        await message.answer(f"По запросу «{html.escape(query)}» ничего не найдено.")
+        return
+
+    await message.answer(text, reply_markup=markup)
+
+@router.callback_query(SearchPage.filter(), flags={"db": "read"})
+async def hw_search_page(callback: CallbackQuery, callback_data: SearchPage, user: CachedUser | None,
+                         db: UnitOfWork):
+    """Turn a page of search results"""
+    if not user or not user.class_group_id:
+        await callback.answer("Ты не привязан к классу.", show_alert=True)
+        return
+
+    from services.search import search_page
+
+    text, markup = await search_page(db, user.class_group_id, callback_data.q, callback_data.p)
+    if not text:
+        await callback.answer("Больше результатов нет.")
+        return
+
+    await callback.message.edit_text(text, reply_markup=markup)
+    await callback.answer()
+
+@router.message(Command("create_class"), flags={"db": "write"})
+async def create_class(message: Message, user: CachedUser | None, tenant: str, db: UnitOfWork):
     """Create a new class"""
     if not message.text:
         await message.answer("Ошибка: пустое сообщение")
@@ -147,24 +252,27 @@ async def create_class(message: Message):
     
     class_name = args[1].strip()
     
-    async with async_session() as session:
-        # Check if class already exists
-        existing_class = (await session.execute(
-            select(ClassGroup).where(ClassGroup.name == class_name)
-        )).scalar_one_or_none()
-        
-        if existing_class:
-            await message.answer(f"Класс '{class_name}' уже существует.")
-            return
-        
-        # Create new class
-        new_class = ClassGroup(name=class_name)
-        session.add(new_class)
-        await session.commit()
-        await message.answer(f"✅ Класс '{class_name}' создан! Теперь можно присоединиться командой /join_class {class_name}")
-
-@router.message(Command("remove_schedule"))
-async def remove_schedule(message: Message):
+    # Create new class; the name is unique within the school
+    class_id = await db.classes.add(tenant, class_name)
+    if class_id is None:
+        await db.rollback()
+        await message.answer(f"Класс '{class_name}' уже существует.")
+        return
+
+    db.on_commit(lambda: class_created(tenant, class_id, class_name))
+    # Whoever creates a class runs it: they become headman and, unless
+    # already in another class, a member of it
+    if user:
+        await db.users.make_headman(user.id, None if user.class_group_id else class_id)
+        db.on_commit(lambda: invalidate_user(user.tenant, user.telegram_id))
+    await db.commit()
+    text = f"✅ Класс '{html.escape(class_name)}' создан! Теперь можно присоединиться командой /join_class {html.escape(class_name)}"
+    if user:
+        text += "\nТы староста: можешь загружать расписание других классов через /import_schedule."
+    await message.answer(text)
+
+@router.message(Command("remove_schedule"), flags={"db": "write"})
+async def remove_schedule(message: Message, user: CachedUser | None, db: UnitOfWork):
     """Remove a lesson from schedule"""
     if not message.text:
         await message.answer("Ошибка: пустое сообщение")
@@ -181,32 +289,22 @@ async def remove_schedule(message: Message):
         await message.answer("День и номер урока должны быть числами.")
         return
 
-    async with async_session() as session:
-        user = (await session.execute(select(User).where(User.telegram_id == message.from_user.id))).scalar_one_or_none()
-        
-        if not user or not user.class_group_id:
-            await message.answer("Ты не привязан к классу.")
-            return
+    if not user or not user.class_group_id:
+        await message.answer("Ты не привязан к классу.")
+        return
 
-        # Find and delete the schedule
-        schedule_item = (await session.execute(
-            select(Schedule).where(
-                Schedule.class_group_id == user.class_group_id,
-                Schedule.day_of_week == day,
-                Schedule.lesson_number == lesson_num
-            )
-        )).scalar_one_or_none()
-
-        if not schedule_item:
-            await message.answer(f"Урок на день {day}, номер {lesson_num} не найден.")
-            return
+    # Delete in one statement; no row means there was no such lesson
+    if not await db.schedule.delete(user.class_group_id, day, lesson_num):
+        await db.rollback()
+        await message.answer(f"Урок на день {day}, номер {lesson_num} не найден.")
+        return
 
-        await session.delete(schedule_item)
-        await session.commit()
-        await message.answer(f"✅ Урок удален: День {day}, Урок {lesson_num}")
+    db.on_commit(lambda: bump_version(user.class_group_id))
+    await db.commit()
+    await message.answer(f"✅ Урок удален: День {day}, Урок {lesson_num}")
 
-@router.message(Command("remove_hw"))
-async def remove_homework(message: Message):
+@router.message(Command("remove_hw"), flags={"db": "write"})
+async def remove_homework(message: Message, user: CachedUser | None, db: UnitOfWork):
     """Remove homework by subject"""
     if not message.text:
         await message.answer("Ошибка: пустое сообщение")
@@ -218,27 +316,217 @@ async def remove_homework(message: Message):
     
     subject = args[1]
 
-    async with async_session() as session:
-        user = (await session.execute(select(User).where(User.telegram_id == message.from_user.id))).scalar_one_or_none()
-        
-        if not user or not user.class_group_id:
-            await message.answer("Ты не привязан к классу.")
+    if not user or not user.class_group_id:
+        await message.answer("Ты не привязан к классу.")
+        return
+
+    # Find and delete homework
+    homework_ids = await db.homework.ids_by_subject(user.class_group_id, subject)
+    if not homework_ids:
+        await db.rollback()
+        await message.answer(f"Домашнее задание по предмету '{subject}' не найдено.")
+        return
+
+    await delete_attachments(db.session, homework_ids)
+    await db.homework.delete(homework_ids)
+    db.on_commit(lambda: publish("homework", user.class_group_id))
+    await db.commit()
+    await message.answer(f"✅ Домашнее задание по '{subject}' удалено.")
+
+@router.message(Command("reminders", magic=F.args), flags={"db": "write"})
+async def set_reminders(message: Message, command: CommandObject, user: CachedUser | None, db: UnitOfWork):
+    """Change homework reminder times for the class"""
+    times = []
+    for arg in command.args.split():
+        try:
+            times.append(datetime.strptime(arg, "%H:%M").strftime("%H:%M"))
+        except ValueError:
+            await message.answer("Время должно быть в формате ЧЧ:ММ, например: /reminders 07:45 14:30")
             return
 
-        from database.models import Homework
-        
-        # Find and delete homework
-        homework = (await session.execute(
-            select(Homework).where(
-                Homework.class_group_id == user.class_group_id,
-                Homework.subject_name == subject
-            )
-        )).scalar_one_or_none()
-
-        if not homework:
-            await message.answer(f"Домашнее задание по предмету '{subject}' не найдено.")
+    if not user or not user.class_group_id:
+        await message.answer("Ты не привязан к классу.")
+        return
+
+    times = sorted(set(times))
+    await db.classes.set_reminder_times(user.class_group_id, times)
+    # The process running the scheduler picks the new times up
+    db.on_commit(lambda: publish("reminders", user.class_group_id))
+    await db.commit()
+    await message.answer(f"✅ Напоминания будут приходить в {', '.join(times)}")
+
+@router.message(Command("reminders"), flags={"db": "read"})
+async def show_reminders(message: Message, user: CachedUser | None, db: UnitOfWork):
+    """Show homework reminder times for the class"""
+    # Not imported at module level: it pulls in apscheduler
+    from services.scheduler import DEFAULT_REMINDER_TIMES
+
+    if not user or not user.class_group_id:
+        await message.answer("Ты не привязан к классу.")
+        return
+
+    current = await db.classes.reminder_times(user.class_group_id) or DEFAULT_REMINDER_TIMES
+    await message.answer(
+        f"🔔 Напоминания о ДЗ: {', '.join(current)}\n\n"
+        "Изменить: /reminders [ЧЧ:ММ] [ЧЧ:ММ] ..."
+    )
+
+@router.message(Command("bells", magic=F.args), flags={"db": "write"})
+async def set_bells(message: Message, command: CommandObject, user: CachedUser | None, db: UnitOfWork):
+    """Change the bell times of the class"""
+    if not user or not user.class_group_id:
+        await message.answer("Ты не привязан к классу.")
+        return
+
+    # Format: /bells 08:30-09:15 09:25-10:10 ... (lesson 1, lesson 2, ...)
+    bells = {}
+    try:
+        for lesson_number, arg in enumerate(command.args.split(), start=1):
+            start, end = (datetime.strptime(part, "%H:%M").time() for part in arg.split("-"))
+            previous = bells.get(lesson_number - 1)
+            if start >= end or (previous and start < previous[1]):
+                raise ValueError()
+            bells[lesson_number] = (start, end)
+    except ValueError:
+        await message.answer(
+            "Укажи звонки по порядку уроков, без пересечений:\n"
+            "/bells 08:30-09:15 09:25-10:10 10:20-11:05"
+        )
+        return
+
+    await db.classes.set_bells(user.class_group_id, format_bells(bells))
+    # The lesson timeline replaces this class's events for today
+    db.on_commit(lambda: publish("bells", user.class_group_id))
+    await db.commit()
+    await message.answer(f"✅ Звонки сохранены: уроков {len(bells)}")
+
+@router.message(Command("bells"), flags={"db": "read"})
+async def show_bells(message: Message, user: CachedUser | None, db: UnitOfWork):
+    """Show the bell times of the class"""
+    if not user or not user.class_group_id:
+        await message.answer("Ты не привязан к классу.")
+        return
+
+    current = parse_bells(await db.classes.bells(user.class_group_id))
+    if not current:
+        await message.answer("Звонки не заданы.\n\nЗадать: /bells 08:30-09:15 09:25-10:10 ...")
+        return
+    lines = [f"{n}. {start.strftime('%H:%M')}–{end.strftime('%H:%M')}"
+             for n, (start, end) in sorted(current.items())]
+    await message.answer("🔔 <b>Звонки:</b>\n" + "\n".join(lines))
+
+@router.message(Command("hw_retention", magic=F.args), flags={"db": "write"})
+async def set_homework_retention(message: Message, command: CommandObject, user: CachedUser | None,
+                                 db: UnitOfWork):
+    """Change how long homework is kept before archiving"""
+    if not user or not user.class_group_id:
+        await message.answer("Ты не привязан к классу.")
+        return
+
+    try:
+        days = int(command.args)
+        if days < 0:
+            raise ValueError()
+    except ValueError:
+        await message.answer("Количество дней должно быть целым числом не меньше 0.")
+        return
+
+    await db.classes.set_retention_days(user.class_group_id, days)
+    await db.commit()
+    await message.answer(f"✅ Срок хранения ДЗ: {days} дн." if days else "✅ ДЗ будут храниться всегда.")
+
+@router.message(Command("hw_retention"), flags={"db": "read"})
+async def show_homework_retention(message: Message, user: CachedUser | None, db: UnitOfWork):
+    """Show how long homework is kept before archiving"""
+    if not user or not user.class_group_id:
+        await message.answer("Ты не привязан к классу.")
+        return
+
+    days = await db.classes.retention_days(user.class_group_id)
+    if days is None:
+        from services.maintenance import HW_RETENTION_DAYS
+        days = HW_RETENTION_DAYS
+    current = "не архивируются" if days == 0 else f"архивируются через {days} дн."
+    await message.answer(
+        f"🗄 Домашние задания {current}\n\n"
+        "Изменить: /hw_retention [дни] (0 - хранить всегда)"
+    )
+
+@router.message(Command("hw_archive"), flags={"db": "read"})
+async def view_homework_archive(message: Message, user: CachedUser | None, db: UnitOfWork):
+    """View archived homework for the user's class"""
+    if not user or not user.class_group_id:
+        await message.answer("Ты не привязан к классу.")
+        return
+
+    # Format: /hw_archive [subject]
+    args = (message.text or "").split(maxsplit=1)
+    subject = args[1].strip() if len(args) > 1 else None
+    homeworks = await db.homework.archived(user.class_group_id, subject, ARCHIVE_PAGE_SIZE)
+
+    if not homeworks:
+        await message.answer("В архиве ничего нет.")
+        return
+
+    text = ["🗄 <b>Архив домашних заданий:</b>\n"]
+    for subject_name, content, date_assigned in homeworks:
+        if len(content) > MAX_CONTENT_LENGTH:
+            content = content[:MAX_CONTENT_LENGTH] + "…"
+        text.append(f"📖 <b>{html.escape(subject_name)}</b> ({date_assigned})")
+        text.append(f"   {html.escape(content)}")
+        text.append("")
+
+    await message.answer("\n".join(text))
+
+@router.message(Command("import_schedule"), flags={"db": "write"})
+async def import_schedule(message: Message, user: CachedUser | None, tenant: str, db: UnitOfWork):
+    """Import a timetable from an uploaded CSV or JSON file"""
+    # Rarely used, so imported on first use rather than at startup
+    import csv
+    from services.schedule_import import MAX_IMPORT_BYTES, ScheduleImportError, parse_rows, apply_rows
+
+    # The file can come with the command as a caption or be replied to
+    document = message.document
+    if not document and message.reply_to_message:
+        document = message.reply_to_message.document
+    if not document:
+        await message.answer(
+            "Отправь CSV или JSON файл с подписью /import_schedule\n\n"
+            "Колонки CSV: class (необязательно), day (0-6), lesson, subject\n"
+            "JSON: [{\"class\": \"9A\", \"day\": 0, \"lesson\": 1, \"subject\": \"Алгебра\"}, ...]"
+        )
+        return
+
+    if document.file_size and document.file_size > MAX_IMPORT_BYTES:
+        await message.answer("Файл слишком большой.")
+        return
+
+    data = (await message.bot.download(document)).read()
+
+    try:
+        rows = parse_rows(data, document.file_name or "")
+        if not user or (not user.class_group_id and any(not row.class_name for row in rows)):
+            await message.answer("Ты не привязан к классу. Укажи класс в колонке class.")
             return
+        # Anyone can replace their own class's timetable; other classes need a headman
+        result = await apply_rows(db, rows, user.class_group_id, tenant, other_classes=user.role == "headman")
+        await db.commit()
+    except ScheduleImportError as e:
+        await db.rollback()
+        await message.answer("❌ Расписание не загружено:\n" + "\n".join(e.errors))
+        return
+    except (ValueError, csv.Error) as e:
+        await db.rollback()
+        await message.answer(f"❌ Не удалось прочитать файл: {e}")
+        return
 
-        await session.delete(homework)
-        await session.commit()
-        await message.answer(f"✅ Домашнее задание по '{subject}' удалено.")
+    text = [
+        f"✅ Расписание загружено: добавлено {len(result.added)}, изменено {len(result.changed)}, "
+        f"удалено {len(result.removed)}, без изменений {result.unchanged}."
+    ]
+    for sign, lines in (("+", result.added), ("~", result.changed), ("−", result.removed)):
+        text.extend(f"{sign} {line}" for line in lines)
+    report = "\n".join(text)
+    if len(report) > 4000:
+        report = report[:4000] + "\n…"
+    await message.answer(report, parse_mode=None)
@@ -1,68 +1,63 @@
+import html
 import logging
 from aiogram import Router, F
-from aiogram.filters import CommandStart, Command
-from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
-from sqlalchemy import select
-from sqlalchemy.orm import selectinload
+from aiogram.filters import CommandStart, Command, CommandObject
+from aiogram.types import Message, CallbackQuery, ChatMemberUpdated, ReplyKeyboardMarkup, KeyboardButton
+from datetime import datetime
 
-from database.setup import async_session
-from database.models import User, ClassGroup
+from database.unit_of_work import UnitOfWork
+from services.users import CachedUser, remember_user, invalidate_user
+from services.timetable import get_day_text
+from services.homework import HomeworkFilter, homework_page
+from services.classes import ClassPick, class_directory, class_picker
 
 router = Router()
 
-@router.message(CommandStart())
-async def cmd_start(message: Message):
+@router.message(CommandStart(), flags={"db": "write"})
+async def cmd_start(message: Message, tenant: str, db: UnitOfWork):
     logging.info(f"Received /start from user {message.from_user.id}: {message.from_user.full_name}")
     
     try:
-        async with async_session() as session:
-            result = await session.execute(select(User).where(User.telegram_id == message.from_user.id))
-            user = result.scalar_one_or_none()
-
-            if not user:
-                new_user = User(
-                    telegram_id=message.from_user.id,
-                    full_name=message.from_user.full_name
-                )
-                session.add(new_user)
-                await session.commit()
-                
-                # Create main menu
-                keyboard = ReplyKeyboardMarkup(
-                    keyboard=[
-                        [KeyboardButton(text="📋 Команды")],
-                        [KeyboardButton(text="📚 Расписание"), KeyboardButton(text="📖 Домашка")],
-                        [KeyboardButton(text="🏫 Мой класс"), KeyboardButton(text="⚙️ Управление")]
-                    ],
-                    resize_keyboard=True
-                )
-                
-                await message.answer(
-                    "🎉 <b>Добро пожаловать в Школьного Бота!</b>\n\n"
-                    "Я помогу тебе с расписанием и домашними заданиями.\n"
-                    "Нажми '📋 Команды' или используй /help чтобы увидеть все возможности.",
-                    reply_markup=keyboard,
-                    parse_mode="HTML"
-                )
-            else:
-                # Create main menu for existing users
-                keyboard = ReplyKeyboardMarkup(
-                    keyboard=[
-                        [KeyboardButton(text="📋 Команды")],
-                        [KeyboardButton(text="📚 Расписание"), KeyboardButton(text="📖 Домашка")],
-                        [KeyboardButton(text="🏫 Мой класс"), KeyboardButton(text="⚙️ Управление")]
-                    ],
-                    resize_keyboard=True
-                )
-                
-                await message.answer(
-                    f"👋 <b>С возвращением, {message.from_user.full_name}!</b>\n\n"
-                    "Выбери действие из меню или введи /help",
-                    reply_markup=keyboard,
-                    parse_mode="HTML"
-                )
+        user = await db.users.find(tenant, message.from_user.id)
+        is_new = user is None
+        if is_new:
+            user = await db.users.add(tenant, message.from_user.id, message.from_user.full_name)
+        elif user.blocked_at:
+            # Came back after blocking the bot: include them in broadcasts again
+            await db.users.set_blocked(tenant, message.from_user.id, None)
+        # Committed before replying, so the single writer connection
+        # is never held across a Telegram round trip
+        await db.commit()
+        remember_user(user)
+
+        # Create main menu
+        keyboard = ReplyKeyboardMarkup(
+            keyboard=[
+                [KeyboardButton(text="📋 Команды")],
+                [KeyboardButton(text="📚 Расписание"), KeyboardButton(text="📖 Домашка")],
+                [KeyboardButton(text="🏫 Мой класс"), KeyboardButton(text="⚙️ Управление")]
+            ],
+            resize_keyboard=True
+        )
+
+        if is_new:
+            await message.answer(
+                "🎉 <b>Добро пожаловать в Школьного Бота!</b>\n\n"
+                "Я помогу тебе с расписанием и домашними заданиями.\n"
+                "Нажми '📋 Команды' или используй /help чтобы увидеть все возможности.",
+                reply_markup=keyboard,
+                parse_mode="HTML"
+            )
+        else:
+            await message.answer(
+                f"👋 <b>С возвращением, {message.from_user.full_name}!</b>\n\n"
+                "Выбери действие из меню или введи /help",
+                reply_markup=keyboard,
+                parse_mode="HTML"
+            )
     except Exception as e:
         logging.error(f"Error in /start: {e}")
+        await db.rollback()
         await message.answer("Произошла ошибка. Попробуйте позже.")
 
 @router.message(Command("help"))
@@ -76,7 +71,9 @@ async def help_command(message: Message):
 /help - Показать эту справку
 /schedule - Расписание на сегодня
 /schedule_day [день] - Расписание на конкретный день (0=Пн, 6=Вс)
-/hw - Показать домашние задания
+/hw [предмет] [с ГГГГ-ММ-ДД] [по ГГГГ-ММ-ДД] - Домашние задания
+/hw_tomorrow - Домашние задания на завтра
+/hw_search [слова] - Поиск по домашним заданиям
 
 🔹 <b>🏫 Классы:</b>
 /join_class [название] - Присоединиться к классу
@@ -85,10 +82,16 @@ async def help_command(message: Message):
 🔹 <b>⚙️ Управление расписанием:</b>
 /add_schedule [день] [урок] [предмет] - Добавить урок
 /remove_schedule [день] [урок] - Удалить урок
+/import_schedule - Загрузить расписание из CSV/JSON файла
 
 🔹 <b>📖 Управление ДЗ:</b>
-/add_hw [предмет] [задание] - Добавить домашнее задание
+/add_hw [предмет] [задание] - Добавить домашнее задание (можно с фото или файлом)
 /remove_hw [предмет] - Удалить домашнее задание
+/hw_archive [предмет] - Архив домашних заданий
+/hw_retention [дни] - Срок хранения ДЗ до архивации
+/reminders [ЧЧ:ММ ...] - Время напоминаний о ДЗ
+/bells [ЧЧ:ММ-ЧЧ:ММ ...] - Расписание звонков
+/lesson_alerts on|off - Оповещения перед уроками
 
 🔹 <b>📅 Дни недели (цифры):</b>
 0 - Понедельник
@@ -108,114 +111,78 @@ async def help_command(message: Message):
 async def commands_button(message: Message):
     await help_command(message)
 
-@router.message(F.text == "📚 Расписание")
-async def schedule_button(message: Message):
+@router.message(F.text == "📚 Расписание", flags={"db": "read"})
+async def schedule_button(message: Message, user: CachedUser | None, db: UnitOfWork):
     """Handle schedule button"""
     try:
-        async with async_session() as session:
-            user = (await session.execute(select(User).where(User.telegram_id == message.from_user.id))).scalar_one_or_none()
-            
-            if not user or not user.class_group_id:
-                await message.answer("Сначала выбери класс! Используйте /join_class [название] или кнопку '🏫 Мой класс'")
-                return
-
-            from datetime import datetime
-            
-            today = datetime.now().weekday()
-            target_day = 0 if today == 6 else today
-            
-            from database.models import Schedule
-            
-            lessons = (await session.execute(
-                select(Schedule).where(
-                    Schedule.class_group_id == user.class_group_id,
-                    Schedule.day_of_week == target_day
-                ).order_by(Schedule.lesson_number)
-            )).scalars().all()
-            
-            if not lessons:
-                await message.answer(f"На сегодня расписания нет.")
-                return
-
-            WEEKDAYS = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
-            text = [f"📅 <b>Расписание на {WEEKDAYS[target_day]}</b>\n"]
-            for lesson in lessons:
-                text.append(f"{lesson.lesson_number}. {lesson.subject_name}")
-                
-            await message.answer("\n".join(text), parse_mode="HTML")
+        if not user or not user.class_group_id:
+            await message.answer("Сначала выбери класс! Используйте /join_class [название] или кнопку '🏫 Мой класс'")
+            return
+
+        today = datetime.now().weekday()
+        target_day = 0 if today == 6 else today
+        
+        text = await get_day_text(db, user.class_group_id, target_day)
+        
+        if not text:
+            await message.answer(f"На сегодня расписания нет.")
+            return
+
+        await message.answer(text, parse_mode="HTML")
     except Exception as e:
         logging.error(f"Error in schedule_button: {e}")
         await message.answer("Произошла ошибка при загрузке расписания.")
 
-@router.message(F.text == "📖 Домашка")
-async def homework_button(message: Message):
+@router.message(F.text == "📖 Домашка", flags={"db": "read"})
+async def homework_button(message: Message, user: CachedUser | None, db: UnitOfWork):
     """Handle homework button"""
     try:
-        async with async_session() as session:
-            user = (await session.execute(select(User).where(User.telegram_id == message.from_user.id))).scalar_one_or_none()
-            
-            if not user or not user.class_group_id:
-                await message.answer("Сначала выбери класс! Используйте /join_class [название] или кнопку '🏫 Мой класс'")
-                return
-
-            from database.models import Homework
-            
-            homeworks = (await session.execute(
-                select(Homework).where(
-                    Homework.class_group_id == user.class_group_id
-                ).order_by(Homework.date_assigned.desc())
-            )).scalars().all()
-            
-            if not homeworks:
-                await message.answer("Домашних заданий нет.")
-                return
-
-            text = ["📚 <b>Домашние задания:</b>\n"]
-            for hw in homeworks:
-                text.append(f"📖 <b>{hw.subject_name}</b> ({hw.date_assigned})")
-                text.append(f"   {hw.content}")
-                text.append("")
-                
-            await message.answer("\n".join(text), parse_mode="HTML")
+        if not user or not user.class_group_id:
+            await message.answer("Сначала выбери класс! Используйте /join_class [название] или кнопку '🏫 Мой класс'")
+            return
+
+        text, markup = await homework_page(db, user.class_group_id, HomeworkFilter())
+        
+        if not text:
+            await message.answer("Домашних заданий нет.")
+            return
+
+        await message.answer(text, reply_markup=markup, parse_mode="HTML")
     except Exception as e:
         logging.error(f"Error in homework_button: {e}")
         await message.answer("Произошла ошибка при загрузке домашних заданий.")
 
 @router.message(F.text == "🏫 Мой класс")
-async def my_class_button(message: Message):
+async def my_class_button(message: Message, user: CachedUser | None, tenant: str):
     """Handle my class button"""
     try:
-        async with async_session() as session:
-            user = (await session.execute(select(User).where(User.telegram_id == message.from_user.id))).scalar_one_or_none()
-            
-            if not user:
-                await message.answer("Сначала зарегистрируйтесь командой /start")
-                return
-            
-            if not user.class_group_id:
-                # Show available classes
-                classes = (await session.execute(select(ClassGroup))).scalars().all()
-                if classes:
-                    text = ["🏫 <b>Доступные классы:</b>\n"]
-                    for cls in classes:
-                        text.append(f"• {cls.name}")
-                    text.append("\nИспользуй /join_class [название] чтобы присоединиться")
-                    await message.answer("\n".join(text), parse_mode="HTML")
-                else:
-                    await message.answer("Классы еще не созданы. Используй /create_class [название] для создания класса.")
-                return
-            
-            # Show current class info
-            class_group = (await session.execute(
-                select(ClassGroup).where(ClassGroup.id == user.class_group_id)
-            )).scalar_one_or_none()
-            
-            await message.answer(
-                f"🏫 <b>Твой класс: {class_group.name if class_group else 'Неизвестен'}</b>\n\n"
-                f"👤 Роль: {user.role}\n\n"
-                f"Используй /join_class [название] чтобы сменить класс",
-                parse_mode="HTML"
-            )
+        if not user:
+            await message.answer("Сначала зарегистрируйтесь командой /start")
+            return
+        
+        if not user.class_group_id:
+            # One page of the class directory; a tap joins
+            text, markup = await class_picker(tenant)
+            if text:
+                await message.answer(
+                    text + "\n\nИли /join_class [начало названия], например /join_class 9",
+                    reply_markup=markup, parse_mode="HTML"
+                )
+            else:
+                await message.answer("Классы еще не созданы. Используй /create_class [название] для создания класса.")
+            return
+        
+        # Show current class info
+        directory = class_directory(tenant)
+        await directory.load()
+        class_name = directory.name(user.class_group_id)
+        
+        await message.answer(
+            f"🏫 <b>Твой класс: {html.escape(class_name or 'Неизвестен')}</b>\n\n"
+            f"👤 Роль: {user.role}\n\n"
+            f"Используй /join_class [название] чтобы сменить класс",
+            parse_mode="HTML"
+        )
     except Exception as e:
         logging.error(f"Error in my_class_button: {e}")
         await message.answer("Произошла ошибка при загрузке информации о классе.")
@@ -229,10 +196,13 @@ async def management_button(message: Message):
 📅 <b>Расписание:</b>
 • /add_schedule [день] [урок] [предмет]
 • /remove_schedule [день] [урок]
+• /import_schedule (CSV/JSON файл)
+• /bells [ЧЧ:ММ-ЧЧ:ММ ...]
 
 📚 <b>Домашние задания:</b>  
 • /add_hw [предмет] [задание]
 • /remove_hw [предмет]
+• /reminders [ЧЧ:ММ ...]
 
 🏫 <b>Классы:</b>
 • /create_class [название]
@@ -244,51 +214,112 @@ async def management_button(message: Message):
     
     await message.answer(management_text, parse_mode="HTML")
 
-@router.message(Command("join_class"))
-async def join_class(message: Message):
+@router.message(Command("join_class"), flags={"db": "write"})
+async def join_class(message: Message, user: CachedUser | None, tenant: str, db: UnitOfWork):
     """Join a class by class name"""
     if not message.text:
         await message.answer("Ошибка: пустое сообщение")
         return
         
     args = message.text.split(maxsplit=1)
-    if len(args) < 2:
-        await message.answer("Использование: /join_class [название_класса]")
-        return
-    
-    class_name = args[1].strip()
+    class_name = args[1].strip() if len(args) > 1 else ""
     
     try:
-        async with async_session() as session:
-            # Find class
-            class_group = (await session.execute(
-                select(ClassGroup).where(ClassGroup.name == class_name)
-            )).scalar_one_or_none()
-            
-            if not class_group:
-                await message.answer(f"Класс '{class_name}' не найден. Доступные классы:")
-                
-                # Show available classes
-                classes = (await session.execute(select(ClassGroup))).scalars().all()
-                if classes:
-                    class_list = "\n".join(f"• {cls.name}" for cls in classes)
-                    await message.answer(class_list)
-                else:
+        found = await class_directory(tenant).find(class_name) if class_name else None
+        if not found:
+            # Classes starting with what was typed, or all of them
+            text, markup = await class_picker(tenant, class_name)
+            if not text:
+                text, markup = await class_picker(tenant)
+                if not text:
                     await message.answer("Классы еще не созданы.")
-                return
-            
-            # Update user's class
-            user = (await session.execute(select(User).where(User.telegram_id == message.from_user.id))).scalar_one_or_none()
-            if user:
-                user.class_group_id = class_group.id
-                await session.commit()
-                await message.answer(f"✅ Ты присоединился к классу '{class_name}'!")
-            else:
-                await message.answer("Сначала зарегистрируйтесь командой /start")
+                    return
+                text = f"Класс '{html.escape(class_name)}' не найден.\n\n" + text
+            await message.answer(text, reply_markup=markup, parse_mode="HTML")
+            return
+
+        if not user:
+            await message.answer("Сначала зарегистрируйтесь командой /start")
+            return
+        await _join(db, user, found[0])
+        await message.answer(f"✅ Ты присоединился к классу '{html.escape(found[1])}'!")
     except Exception as e:
         logging.error(f"Error in join_class: {e}")
         await message.answer("Произошла ошибка при присоединении к классу.")
 
+async def _join(db: UnitOfWork, user: CachedUser, class_group_id: int):
+    await db.users.set_class(user.id, class_group_id)
+    db.on_commit(lambda: invalidate_user(user.tenant, user.telegram_id))
+    await db.commit()
+
+@router.callback_query(ClassPick.filter(), flags={"db": "write"})
+async def class_pick_callback(callback: CallbackQuery, callback_data: ClassPick, user: CachedUser | None,
+                              tenant: str, db: UnitOfWork):
+    """Turn a page of the class picker or join the tapped class"""
+    if callback_data.a == "p":
+        text, markup = await class_picker(tenant, callback_data.q, callback_data.i)
+        if not text:
+            await callback.answer("Больше классов нет.")
+            return
+        await callback.message.edit_text(text, reply_markup=markup, parse_mode="HTML")
+        await callback.answer()
+        return
+
+    if not user:
+        await callback.answer("Сначала зарегистрируйтесь командой /start", show_alert=True)
+        return
+    # Only classes of this bot's school can be joined
+    directory = class_directory(tenant)
+    await directory.load()
+    name = directory.name(callback_data.i)
+    if name is None:
+        await callback.answer("Класс не найден.", show_alert=True)
+        return
+    await _join(db, user, callback_data.i)
+    await callback.message.edit_text(f"✅ Ты присоединился к классу '{html.escape(name)}'!", parse_mode="HTML")
+    await callback.answer()
+
+@router.my_chat_member(flags={"db": "write"})
+async def bot_blocked_or_unblocked(event: ChatMemberUpdated, tenant: str, db: UnitOfWork):
+    """Keep users who blocked the bot out of reminders and alerts"""
+    if event.chat.type != "private":
+        return
+    blocked_at = datetime.now().isoformat(timespec="seconds") if event.new_chat_member.status == "kicked" else None
+    await db.users.set_blocked(tenant, event.chat.id, blocked_at)
+
+@router.message(Command("lesson_alerts", magic=F.args), flags={"db": "write"})
+async def set_lesson_alerts(message: Message, command: CommandObject, user: CachedUser | None, db: UnitOfWork):
+    """Turn the message before every lesson on or off"""
+    if not user or not user.class_group_id:
+        await message.answer("Ты не привязан к классу.")
+        return
+
+    choice = command.args.split()[0].lower()
+    if choice not in ("on", "off"):
+        await message.answer("Использование: /lesson_alerts on|off")
+        return
+    enabled = choice == "on"
+    await db.users.set_lesson_alerts(user.id, enabled)
+    await db.commit()
+
+    if enabled:
+        await message.answer("✅ Перед каждым уроком я напишу, какой предмет и что задано.")
+    else:
+        await message.answer("✅ Оповещения перед уроками выключены.")
+
+@router.message(Command("lesson_alerts"), flags={"db": "read"})
+async def lesson_alerts(message: Message, user: CachedUser | None, db: UnitOfWork):
+    """Show whether lesson alerts are on"""
+    if not user or not user.class_group_id:
+        await message.answer("Ты не привязан к классу.")
+        return
+
+    enabled = await db.users.lesson_alerts(user.id)
+    await message.answer(
+        f"🔔 Оповещения перед уроками {'включены' if enabled else 'выключены'}\n\n"
+        "Изменить: /lesson_alerts on или /lesson_alerts off"
+    )
+
 @router.message(F.text & ~F.text.startswith('/') & ~F.text.in_({"📋 Команды", "📚 Расписание", "📖 Домашка", "🏫 Мой класс", "⚙️ Управление"}))
 async def handle_other_messages(message: Message):
     """Handle messages that don't match specific handlers"""
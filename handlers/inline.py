@@ -0,0 +1,33 @@
+import logging
+from datetime import date
+
+from aiogram import Router
+from aiogram.types import InlineQuery, InlineQueryResultsButton
+
+from services.users import CachedUser
+
+router = Router()
+
+@router.inline_query()
+async def inline_lookup(query: InlineQuery, user: CachedUser | None):
+    """@bot завтра / @bot алгебра - timetable and homework without opening the chat"""
+    # The index and its result types load with the first inline query, not at startup
+    from services.inline import INLINE_CACHE_TIME, inline_index, parse_query
+
+    if not user or not user.class_group_id:
+        # Personal, so other users still get their own answers
+        await query.answer(
+            [], cache_time=INLINE_CACHE_TIME, is_personal=True,
+            button=InlineQueryResultsButton(text="Выбрать класс", start_parameter="inline")
+        )
+        return
+
+    try:
+        entry = await inline_index.get(user.class_group_id)
+        results = inline_index.answer(entry, parse_query(query.query, date.today()))
+    except Exception as e:
+        logging.error(f"Error in inline query: {e}")
+        results = []
+
+    # Results depend on the user's class, so Telegram must cache them per user
+    await query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=True)
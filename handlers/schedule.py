@@ -1,51 +1,36 @@
 from aiogram import Router, F
 from aiogram.filters import Command
 from aiogram.types import Message
-from sqlalchemy import select
 from datetime import datetime
 
-from database.setup import async_session
-from database.models import User, Schedule, ClassGroup
+from database.unit_of_work import UnitOfWork
+from services.users import CachedUser
+from services.timetable import WEEKDAYS, get_day_text
 
 router = Router()
 
-WEEKDAYS = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
-
-@router.message(Command("schedule"))
-async def get_schedule(message: Message):
-    async with async_session() as session:
-        # Get user
-        user = (await session.execute(select(User).where(User.telegram_id == message.from_user.id))).scalar_one_or_none()
-        
-        if not user or not user.class_group_id:
-            await message.answer("Сначала выбери класс! (Функция выбора класса будет позже)")
-            return
+@router.message(Command("schedule"), flags={"db": "read"})
+async def get_schedule(message: Message, user: CachedUser | None, db: UnitOfWork):
+    if not user or not user.class_group_id:
+        await message.answer("Сначала выбери класс! (Функция выбора класса будет позже)")
+        return
 
-        # Simple logic: get today's schedule
-        today = datetime.now().weekday()
-        
-        # if Sunday (6), show Monday (0)
-        target_day = 0 if today == 6 else today
-        
-        lessons = (await session.execute(
-            select(Schedule).where(
-                Schedule.class_group_id == user.class_group_id,
-                Schedule.day_of_week == target_day
-            ).order_by(Schedule.lesson_number)
-        )).scalars().all()
-        
-        if not lessons:
-            await message.answer(f"На {WEEKDAYS[target_day]} расписания нет.")
-            return
+    # Simple logic: get today's schedule
+    today = datetime.now().weekday()
+    
+    # if Sunday (6), show Monday (0)
+    target_day = 0 if today == 6 else today
+    
+    text = await get_day_text(db, user.class_group_id, target_day)
+    
+    if not text:
+        await message.answer(f"На {WEEKDAYS[target_day]} расписания нет.")
+        return
 
-        text = [f"📅 <b>Расписание на {WEEKDAYS[target_day]}</b>\n"]
-        for lesson in lessons:
-            text.append(f"{lesson.lesson_number}. {lesson.subject_name}")
-            
-        await message.answer("\n".join(text))
+    await message.answer(text)
 
-@router.message(Command("schedule_day"))
-async def get_schedule_day(message: Message):
+@router.message(Command("schedule_day"), flags={"db": "read"})
+async def get_schedule_day(message: Message, user: CachedUser | None, db: UnitOfWork):
     """Get schedule for specific day"""
     if not message.text:
         await message.answer("Ошибка: пустое сообщение")
@@ -63,26 +48,14 @@ async def get_schedule_day(message: Message):
         await message.answer("День должен быть числом от 0 до 6 (0=Понедельник, 6=Воскресенье)")
         return
     
-    async with async_session() as session:
-        user = (await session.execute(select(User).where(User.telegram_id == message.from_user.id))).scalar_one_or_none()
-        
-        if not user or not user.class_group_id:
-            await message.answer("Сначала выбери класс! Используйте /join_class [название]")
-            return
-        
-        lessons = (await session.execute(
-            select(Schedule).where(
-                Schedule.class_group_id == user.class_group_id,
-                Schedule.day_of_week == target_day
-            ).order_by(Schedule.lesson_number)
-        )).scalars().all()
-        
-        if not lessons:
-            await message.answer(f"На {WEEKDAYS[target_day]} расписания нет.")
-            return
+    if not user or not user.class_group_id:
+        await message.answer("Сначала выбери класс! Используйте /join_class [название]")
+        return
+    
+    text = await get_day_text(db, user.class_group_id, target_day)
+    
+    if not text:
+        await message.answer(f"На {WEEKDAYS[target_day]} расписания нет.")
+        return
 
-        text = [f"📅 <b>Расписание на {WEEKDAYS[target_day]}</b>\n"]
-        for lesson in lessons:
-            text.append(f"{lesson.lesson_number}. {lesson.subject_name}")
-            
-        await message.answer("\n".join(text))
+    await message.answer(text)
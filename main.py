@@ -1,3 +1,6 @@
+# First, so the startup report covers the imports below
+from services import startup
+
 import asyncio
 import logging
 import sys
@@ -6,46 +9,134 @@ from dotenv import load_dotenv
 
 from aiogram import Bot, Dispatcher, html
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.enums import ParseMode
+startup.mark("import aiogram")
 
-from database.setup import init_db
-from handlers import common, schedule, admin
+from database.setup import init_db, engine, read_engine
+startup.mark("import sqlalchemy")
 
-from services.scheduler import start_scheduler
+from handlers import common, schedule, admin, inline
+from middlewares.user import UserMiddleware
+from middlewares.throttling import ThrottlingMiddleware
+from middlewares.metrics import MetricsMiddleware, HandlerNameMiddleware
+from middlewares.database import DatabaseMiddleware
+from services.metrics import instrument_engine
+from services.tenants import configured_tokens, register
+startup.mark("import handlers")
+# The scheduler (apscheduler) is imported once polling is already running
 
 # Load environment variables
 load_dotenv()
 
-# Config
-TOKEN = getenv("BOT_TOKEN")
-if not TOKEN:
+# Config: BOT_TOKEN, and/or BOT_TOKENS="school=token,..." to serve several schools
+TOKENS = configured_tokens()
+if not TOKENS:
     raise ValueError("BOT_TOKEN not found in environment variables")
 
+# "polling" or "webhook"
+BOT_MODE = getenv("BOT_MODE", "polling")
+# More than 1 starts a supervisor with this many worker processes
+BOT_WORKERS = int(getenv("BOT_WORKERS", "1"))
+LOG_LEVEL = getenv("LOG_LEVEL", "WARNING")
+# Set to 0 to turn off per-user rate limits
+THROTTLING = getenv("THROTTLING", "1") != "0"
+
 # Dispatcher
 dp = Dispatcher()
 
-async def main() -> None:
-    # Initialize Bot instance
-    bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    
-    # Init DB
-    await init_db()
-    
+# One HTTP session (connection pool) for all bots
+_session: AiohttpSession | None = None
+
+def create_bot(tenant: str | None = None) -> Bot:
+    """The bot of one tenant (the first configured one by default)."""
+    global _session
+    if _session is None:
+        _session = AiohttpSession()
+    tenant = tenant or next(iter(TOKENS))
+    bot = Bot(token=TOKENS[tenant], session=_session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    register(tenant, bot)
+    return bot
+
+def create_bots() -> list[Bot]:
+    return [create_bot(tenant) for tenant in TOKENS]
+
+def setup_dispatcher(dp: Dispatcher):
+    # Latency and SQL statements of every update, by handler
+    instrument_engine(engine)
+    instrument_engine(read_engine)
+    dp.update.outer_middleware(MetricsMiddleware())
+    for name, observer in dp.observers.items():
+        if name not in ("update", "error"):
+            observer.middleware(HandlerNameMiddleware())
+
+    # Drop floods before they reach the database
+    if THROTTLING:
+        dp.update.outer_middleware(ThrottlingMiddleware())
+
+    # Resolve the sender's User once per update
+    dp.update.outer_middleware(UserMiddleware())
+
+    # One UnitOfWork per update for handlers flagged {"db": "read" | "write"}
+    for name, observer in dp.observers.items():
+        if name not in ("update", "error"):
+            observer.middleware(DatabaseMiddleware())
+
     # Register routers
     dp.include_router(common.router)
     dp.include_router(schedule.router)
     dp.include_router(admin.router)
+    dp.include_router(inline.router)
+
+async def start_background(bot: Bot):
+    """Scheduler, missed reminders and metrics; none of it has to delay the first update."""
+    from services.scheduler import start_scheduler
+    from services.metrics import start_metrics_server
+
+    try:
+        await start_scheduler(bot)
+        await start_metrics_server()
+    except Exception as e:
+        logging.error(f"Failed to start background services: {e}")
+    startup.report("scheduler")
+
+async def on_startup(bot: Bot):
+    startup.mark("receiving updates")
+    task = asyncio.create_task(start_background(bot))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+_background_tasks: set[asyncio.Task] = set()
 
-    # Start Scheduler
-    start_scheduler(bot)
+async def main() -> None:
+    # Initialize Bot instances; every school shares the dispatcher, database and caches
+    bots = create_bots()
+    
+    # Init DB
+    await init_db()
+    startup.mark("init_db")
+    
+    setup_dispatcher(dp)
+    dp.startup.register(on_startup)
 
-    # Start polling
-    await dp.start_polling(bot)
+    if BOT_MODE == "webhook":
+        from services.webhook import run_webhook
+        await run_webhook(dp, bots)
+    else:
+        # Start polling; chats are processed concurrently, each one in order
+        from services.updates import run_polling
+        await run_polling(dp, *bots)
 
 if __name__ == "__main__":
     logging.basicConfig(
-        level=logging.WARNING,  # Changed from INFO to WARNING for less logging
+        level=LOG_LEVEL,  # WARNING by default for less logging
         stream=sys.stdout,
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
-    asyncio.run(main())
+    if BOT_WORKERS > 1:
+        if len(TOKENS) > 1:
+            raise ValueError("BOT_WORKERS > 1 serves a single bot; unset BOT_TOKENS or BOT_WORKERS")
+        from services.workers import run_supervisor
+        asyncio.run(run_supervisor(BOT_WORKERS))
+    else:
+        asyncio.run(main())
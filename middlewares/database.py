@@ -0,0 +1,38 @@
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import TelegramObject
+
+from database.setup import async_session
+from database.unit_of_work import UnitOfWork
+
+
+class DatabaseMiddleware(BaseMiddleware):
+    """
+    Inner middleware: gives handlers flagged {"db": "read"} or {"db": "write"}
+    a UnitOfWork as the `db` argument. A write is committed once after the
+    handler returns and rolled back if it raises.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any]
+    ) -> Any:
+        mode = get_flag(data, "db")
+        if mode == "read":
+            data["db"] = db = UnitOfWork()
+            try:
+                return await handler(event, data)
+            finally:
+                await db.close()
+        if mode == "write":
+            # Leaving the session without a commit rolls back
+            async with async_session() as session:
+                data["db"] = db = UnitOfWork(session)
+                result = await handler(event, data)
+                await db.commit()
+                return result
+        return await handler(event, data)
@@ -0,0 +1,47 @@
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from services.metrics import UpdateStats, current_update, finish_update
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Outer update middleware: times the whole update, including the SQL it
+    runs, and records it under the name of the handler that took it.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any]
+    ) -> Any:
+        stats = UpdateStats()
+        token = current_update.set(stats)
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = await handler(event, data)
+            failed = False
+            return result
+        finally:
+            current_update.reset(token)
+            finish_update(stats, time.perf_counter() - started, failed)
+
+
+class HandlerNameMiddleware(BaseMiddleware):
+    """Inner middleware: tells MetricsMiddleware which handler matched."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any]
+    ) -> Any:
+        stats = current_update.get()
+        if stats is not None and "handler" in data:
+            stats.handler = data["handler"].callback.__name__
+        return await handler(event, data)
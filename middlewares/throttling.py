@@ -0,0 +1,77 @@
+import logging
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import TelegramObject, Update
+
+from services import metrics
+from services.throttle import Throttler, WRITE_COMMANDS
+
+
+def classify(update: Update) -> tuple[str | None, str | None]:
+    """
+    Command class of an update (None - not throttled) and the payload used
+    to spot repeated presses.
+    """
+    if update.callback_query:
+        return "read", f"cb:{update.callback_query.data}"
+    if update.inline_query:
+        return "read", f"iq:{update.inline_query.query}"
+    message = update.message
+    if message:
+        text = message.text or message.caption or ""
+        if message.media_group_id and not text:
+            # The rest of an album counts as part of its captioned message
+            return None, None
+        if text.startswith("/"):
+            command = text.split(maxsplit=1)[0][1:].split("@")[0].lower()
+            return ("write" if command in WRITE_COMMANDS else "read"), f"msg:{text}"
+        # Files carry no text; each upload is its own request
+        return "read", f"msg:{text}" if message.text else None
+    return "read", None
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Drops updates from users (and group chats) that send faster than their
+    token bucket allows, before anything touches the database. Repeated
+    presses of the same button or command within a second are dropped too.
+    """
+
+    def __init__(self, throttler: Throttler | None = None):
+        self.throttler = throttler or Throttler()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any]
+    ) -> Any:
+        from_user = data.get("event_from_user")
+        if from_user is None or not isinstance(event, Update):
+            return await handler(event, data)
+
+        chat = data.get("event_chat")
+        group_id = chat.id if chat and chat.type != "private" else None
+        command_class, payload = classify(event)
+        if command_class is None:
+            return await handler(event, data)
+        verdict = self.throttler.check(from_user.id, group_id, command_class, payload)
+        if verdict is None:
+            return await handler(event, data)
+
+        metrics.throttled_updates.inc(reason=verdict.reason, command_class=command_class)
+        bot = data["bot"]
+        try:
+            if event.callback_query:
+                # Stop the button's loading spinner either way
+                await bot.answer_callback_query(
+                    event.callback_query.id, text="⏳ Подожди немного" if verdict.notify else None
+                )
+            elif verdict.notify and chat:
+                await bot.send_message(chat.id, "⏳ Слишком много запросов, подожди немного.")
+        except TelegramAPIError as e:
+            # The bot was blocked or the callback expired; the update is dropped anyway
+            logging.debug(f"Throttle notice to {from_user.id} failed: {e}")
+        return None
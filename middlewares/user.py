@@ -0,0 +1,26 @@
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User as TelegramUser
+
+from services.tenants import tenant_of
+from services.users import resolve_user
+
+
+class UserMiddleware(BaseMiddleware):
+    """
+    Resolves the bot's User for the sender of the update once
+    and passes it to handlers as the `user` argument, along with
+    the `tenant` (school) of the bot that received the update.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any]
+    ) -> Any:
+        from_user: TelegramUser | None = data.get("event_from_user")
+        data["tenant"] = tenant = tenant_of(data.get("bot"))
+        data["user"] = await resolve_user(tenant, from_user.id) if from_user else None
+        return await handler(event, data)
@@ -0,0 +1,200 @@
+import asyncio
+import json
+import logging
+import os
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, InputMediaPhoto, InputMediaDocument
+from sqlalchemy import select, delete
+
+from database.models import HomeworkAttachment
+from services.cache import TTLCache
+
+# Telegram's limits: 10 items per media group, 1024 characters per caption
+MAX_ATTACHMENTS = 10
+MAX_CAPTION_LENGTH = 1024
+# Album messages arrive one by one; they are collected for this many seconds
+MEDIA_GROUP_WAIT = float(os.getenv("MEDIA_GROUP_WAIT", "1.0"))
+
+MEDIA_TYPES = {"photo": InputMediaPhoto, "document": InputMediaDocument}
+
+
+@dataclass(frozen=True)
+class Attachment:
+    kind: str  # "photo" or "document"
+    file_id: str
+    file_unique_id: str
+
+
+def from_message(message: Message) -> Attachment | None:
+    if message.photo:
+        # The largest size; Telegram keeps the smaller ones behind the same file
+        photo = message.photo[-1]
+        return Attachment("photo", photo.file_id, photo.file_unique_id)
+    if message.document:
+        return Attachment("document", message.document.file_id, message.document.file_unique_id)
+    return None
+
+
+def dumps(attachments: list[Attachment]) -> str | None:
+    """Compact JSON for the outbox; None when there is nothing to attach."""
+    if not attachments:
+        return None
+    return json.dumps([[a.kind, a.file_id, a.file_unique_id] for a in attachments])
+
+
+def loads(data: str | None) -> list[Attachment]:
+    return [Attachment(*item) for item in json.loads(data)] if data else []
+
+
+async def save_attachments(session, homework_id: int, attachments: list[Attachment]):
+    session.add_all(
+        HomeworkAttachment(homework_id=homework_id, position=position, kind=a.kind,
+                           file_id=a.file_id, file_unique_id=a.file_unique_id)
+        for position, a in enumerate(attachments)
+    )
+
+
+async def load_attachments(session, homework_ids: list[int]) -> dict[int, list[Attachment]]:
+    """Attachments of the given homeworks, in the order they were sent."""
+    if not homework_ids:
+        return {}
+    result: dict[int, list[Attachment]] = {}
+    for homework_id, kind, file_id, file_unique_id in (await session.execute(
+        select(HomeworkAttachment.homework_id, HomeworkAttachment.kind,
+               HomeworkAttachment.file_id, HomeworkAttachment.file_unique_id)
+        .where(HomeworkAttachment.homework_id.in_(homework_ids))
+        .order_by(HomeworkAttachment.homework_id, HomeworkAttachment.position)
+    )).all():
+        result.setdefault(homework_id, []).append(Attachment(kind, file_id, file_unique_id))
+    return result
+
+
+async def delete_attachments(session, homework_ids: list[int]):
+    await session.execute(delete(HomeworkAttachment).where(HomeworkAttachment.homework_id.in_(homework_ids)))
+
+
+class FileIdCache:
+    """
+    The file_id Telegram last returned for each file (by file_unique_id),
+    so resends use an id that is known to work, and ids that Telegram
+    rejected, so they are not tried on every recipient of a broadcast.
+    """
+
+    def __init__(self, maxsize: int = 10000):
+        self._valid = TTLCache(maxsize, ttl=24 * 3600)
+        self._rejected = TTLCache(maxsize, ttl=24 * 3600)
+
+    def resolve(self, attachment: Attachment) -> str | None:
+        """The file_id to send, or None if the file can't be sent any more."""
+        if attachment.file_unique_id in self._rejected:
+            return None
+        return self._valid.get(attachment.file_unique_id, attachment.file_id)
+
+    def remember(self, messages: list[Message]):
+        for message in messages:
+            attachment = from_message(message)
+            if attachment:
+                self._valid.set(attachment.file_unique_id, attachment.file_id)
+
+    def reject(self, attachment: Attachment):
+        self._rejected.set(attachment.file_unique_id, True)
+        self._valid.invalidate(attachment.file_unique_id)
+
+    def stats(self) -> dict:
+        return {"valid": len(self._valid), "rejected": len(self._rejected)}
+
+
+file_ids = FileIdCache()
+
+
+def _groups(resolved: list[tuple[Attachment, str]]) -> list[list[tuple[Attachment, str]]]:
+    # Photos and documents can't be mixed in one media group
+    groups = []
+    for kind in MEDIA_TYPES:
+        items = [item for item in resolved if item[0].kind == kind]
+        groups.extend(items[i:i + MAX_ATTACHMENTS] for i in range(0, len(items), MAX_ATTACHMENTS))
+    return groups
+
+
+async def _send_group(bot: Bot, chat_id: int, group: list[tuple[Attachment, str]],
+                      caption: str | None) -> list[Message]:
+    if len(group) == 1:
+        attachment, file_id = group[0]
+        send = bot.send_photo if attachment.kind == "photo" else bot.send_document
+        return [await send(chat_id, file_id, caption=caption, parse_mode="HTML")]
+    media = [
+        MEDIA_TYPES[attachment.kind](media=file_id, caption=caption if i == 0 else None, parse_mode="HTML")
+        for i, (attachment, file_id) in enumerate(group)
+    ]
+    return await bot.send_media_group(chat_id, media)
+
+
+async def send_attachments(bot: Bot, chat_id: int, attachments: list[Attachment], caption: str | None = None):
+    """
+    Send attachments by file_id: one call per media group, with `caption` on the
+    first one when it fits. A file Telegram no longer knows is skipped and
+    remembered, and the rest is sent anyway.
+    """
+    resolved = [(a, file_id) for a in attachments if (file_id := file_ids.resolve(a))]
+    groups = _groups(resolved)
+    if caption and (len(caption) > MAX_CAPTION_LENGTH or not groups):
+        await bot.send_message(chat_id, caption, parse_mode="HTML")
+        caption = None
+
+    for group in groups:
+        try:
+            file_ids.remember(await _send_group(bot, chat_id, group, caption))
+        except TelegramBadRequest as e:
+            if len(group) == 1:
+                # An expired or foreign file_id; the text still has to arrive
+                logging.warning(f"Attachment {group[0][0].file_unique_id} rejected: {e}")
+                file_ids.reject(group[0][0])
+                if caption:
+                    await bot.send_message(chat_id, caption, parse_mode="HTML")
+            else:
+                # Find the broken item by sending the group one by one
+                for item in group:
+                    await send_attachments(bot, chat_id, [item[0]], caption)
+                    caption = None
+        caption = None
+
+
+class MediaGroupBuffer:
+    """
+    Collects the messages of an album (they arrive as separate updates
+    sharing media_group_id) and hands them over together once no new item
+    came for MEDIA_GROUP_WAIT seconds. Handlers never wait for it, so a
+    worker processing one update at a time keeps receiving the rest.
+    """
+
+    def __init__(self, on_complete: Callable[[list[Message]], Awaitable[None]], wait: float = MEDIA_GROUP_WAIT):
+        self.on_complete = on_complete
+        self.wait = wait
+        self._groups: dict[str, list[Message]] = {}
+        self._timers: dict[str, asyncio.TimerHandle] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def add(self, message: Message):
+        group_id = message.media_group_id
+        self._groups.setdefault(group_id, []).append(message)
+        timer = self._timers.pop(group_id, None)
+        if timer:
+            timer.cancel()
+        self._timers[group_id] = asyncio.get_running_loop().call_later(self.wait, self._flush, group_id)
+
+    def _flush(self, group_id: str):
+        self._timers.pop(group_id, None)
+        messages = sorted(self._groups.pop(group_id, []), key=lambda m: m.message_id)
+        task = asyncio.create_task(self._complete(messages))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _complete(self, messages: list[Message]):
+        try:
+            await self.on_complete(messages)
+        except Exception as e:
+            logging.error(f"Media group handling failed: {e}")
@@ -0,0 +1,77 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+
+from database.models import DEFAULT_TENANT
+
+# Telegram allows ~30 messages per second overall and ~1 per second per chat.
+# We stay a bit below the global limit to leave room for handler replies.
+GLOBAL_RATE = 25
+PER_CHAT_INTERVAL = 1.0
+WORKERS = 16
+BACKOFF_BASE = 0.5
+
+
+@dataclass
+class BroadcastMessage:
+    """A single outgoing message of a broadcast."""
+    chat_id: int
+    text: str
+    attachments: str | None = None  # JSON from services.attachments.dumps
+    tenant: str = DEFAULT_TENANT  # whose bot sends it (outbox only)
+
+
+@dataclass
+class BroadcastReport:
+    """Outcome of one broadcast run (one outbox batch)."""
+    delivered: int = 0
+    failed: int = 0
+    retried: int = 0
+    elapsed: float = 0.0
+    failed_chats: list[int] = field(default_factory=list)
+
+    @property
+    def total(self) -> int:
+        return self.delivered + self.failed + self.retried
+
+    def __str__(self) -> str:
+        return (f"delivered={self.delivered} failed={self.failed} "
+                f"retried={self.retried} elapsed={self.elapsed:.2f}s")
+
+
+class RateLimiter:
+    """Global token bucket plus a minimal interval between sends to one chat."""
+
+    def __init__(self, rate: float = GLOBAL_RATE, per_chat_interval: float = PER_CHAT_INTERVAL):
+        self.rate = rate
+        self.per_chat_interval = per_chat_interval
+        self._tokens = float(rate)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._chat_next: dict[int, float] = {}
+        self._paused_until = 0.0
+
+    def pause(self, seconds: float):
+        """Stop all sending for a while (used when Telegram answers RetryAfter)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, chat_id: int):
+        # Per-chat spacing first, so we don't burn a global token while waiting
+        delay = self._chat_next.get(chat_id, 0.0) - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    break
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+        self._chat_next[chat_id] = time.monotonic() + self.per_chat_interval
@@ -0,0 +1,147 @@
+import asyncio
+import bisect
+import html
+
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from sqlalchemy import select
+
+from database.setup import read_session
+from database.models import ClassGroup
+from services.invalidation import subscribe, publish
+
+PICKER_PAGE_SIZE = 8
+PICKER_COLUMNS = 2
+
+
+class ClassPick(CallbackData, prefix="cls"):
+    """Callback data of the class picker: "j" joins class `i`, "p" opens page `i`."""
+    a: str
+    i: int
+    q: str = ""  # name prefix the list is filtered by
+
+
+class ClassDirectory:
+    """
+    Every class name of one tenant, sorted case-insensitively, so a prefix is
+    two binary searches and a page is a slice. Loaded once; create_class adds to it.
+    """
+
+    def __init__(self, tenant: str):
+        self.tenant = tenant
+        self._keys: list[tuple[str, int]] = []  # (folded name, id), sorted
+        self._names: dict[int, str] = {}
+        self._loaded = False
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    async def load(self):
+        if self._loaded:
+            return
+        async with self._lock:
+            if self._loaded:
+                return
+            async with read_session() as session:
+                rows = (await session.execute(
+                    select(ClassGroup.id, ClassGroup.name).where(ClassGroup.tenant == self.tenant)
+                )).all()
+            # Classes added while loading are already in the list
+            for class_id, name in rows:
+                self.add((class_id, name))
+            self._loaded = True
+
+    def add(self, entry: tuple[int, str]):
+        class_id, name = entry
+        if class_id in self._names:
+            return
+        self._names[class_id] = name
+        bisect.insort(self._keys, (name.casefold(), class_id))
+
+    def _range(self, prefix: str) -> tuple[int, int]:
+        prefix = prefix.casefold()
+        lo = bisect.bisect_left(self._keys, (prefix,))
+        hi = bisect.bisect_left(self._keys, (prefix + "\U0010ffff",))
+        return lo, hi
+
+    async def search(self, prefix: str, page: int = 0,
+                     page_size: int = PICKER_PAGE_SIZE) -> tuple[list[tuple[int, str]], int]:
+        """One page of classes whose name starts with `prefix`, and how many match."""
+        await self.load()
+        lo, hi = self._range(prefix)
+        start = lo + page * page_size
+        page_keys = self._keys[start:min(start + page_size, hi)]
+        return [(class_id, self._names[class_id]) for _, class_id in page_keys], hi - lo
+
+    async def find(self, name: str) -> tuple[int, str] | None:
+        """The class with exactly this name, ignoring case; an exact-case match wins."""
+        await self.load()
+        lo, hi = self._range(name)
+        matches = [(class_id, self._names[class_id]) for folded, class_id in self._keys[lo:hi]
+                   if folded == name.casefold()]
+        return next((m for m in matches if m[1] == name), matches[0] if matches else None)
+
+    def clear(self):
+        """Forget everything; the next lookup loads the directory again."""
+        self._keys, self._names, self._loaded = [], {}, False
+
+    def name(self, class_id: int) -> str | None:
+        return self._names.get(class_id)
+
+    def stats(self) -> dict:
+        return {"classes": len(self._keys)}
+
+
+class_directories: dict[str, ClassDirectory] = {}
+
+
+def class_directory(tenant: str) -> ClassDirectory:
+    directory = class_directories.get(tenant)
+    if directory is None:
+        directory = class_directories[tenant] = ClassDirectory(tenant)
+    return directory
+
+
+def class_created(tenant: str, class_id: int, name: str):
+    """Add a new class to the tenant's directory in every worker."""
+    publish("class", (tenant, class_id, name))
+
+
+subscribe("class", lambda entry: class_directory(entry[0]).add(entry[1:]))
+
+
+def _pack(action: str, value: int, prefix: str) -> str:
+    # A prefix too long for 64 bytes is shortened: the list gets longer, never wrong
+    while True:
+        try:
+            return ClassPick(a=action, i=value, q=prefix).pack()
+        except ValueError:
+            if not prefix:
+                raise
+            prefix = prefix[:-1]
+
+
+async def class_picker(tenant: str, prefix: str = "",
+                       page: int = 0) -> tuple[str | None, InlineKeyboardMarkup | None]:
+    """Text and keyboard of one picker page, or (None, None) if no class matches."""
+    classes, total = await class_directory(tenant).search(prefix, page)
+    if not classes:
+        return None, None
+
+    pages = (total + PICKER_PAGE_SIZE - 1) // PICKER_PAGE_SIZE
+    title = "🏫 <b>Выбери класс</b>"
+    if prefix:
+        title += f" (на «{html.escape(prefix)}»)"
+    text = f"{title}\nНайдено: {total}" + (f", страница {page + 1} из {pages}" if pages > 1 else "")
+
+    buttons = [InlineKeyboardButton(text=name, callback_data=_pack("j", class_id, "")) for class_id, name in classes]
+    keyboard = [buttons[i:i + PICKER_COLUMNS] for i in range(0, len(buttons), PICKER_COLUMNS)]
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(text="◀", callback_data=_pack("p", page - 1, prefix)))
+    if page + 1 < pages:
+        nav.append(InlineKeyboardButton(text="▶", callback_data=_pack("p", page + 1, prefix)))
+    if nav:
+        keyboard.append(nav)
+    return text, InlineKeyboardMarkup(inline_keyboard=keyboard)
@@ -0,0 +1,163 @@
+import html
+import re
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from sqlalchemy import select, tuple_
+
+from database.models import Homework
+
+PAGE_SIZE = 5
+# Keep a page well under Telegram's 4096 character limit
+MAX_CONTENT_LENGTH = 600
+
+DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+class HomeworkFiles(CallbackData, prefix="hwf"):
+    """Callback data of the 📎 button that sends a homework's attachments."""
+    i: int
+
+
+class SearchPage(CallbackData, prefix="hws"):
+    """Callback data of the ◀/▶ buttons under /hw_search results.
+    Kept here so the handlers can register without importing services.search."""
+    q: str
+    p: int
+
+
+class HomeworkPage(CallbackData, prefix="hw"):
+    """Callback data of the ◀/▶ buttons under the homework list."""
+    d: str  # "o" - older than cursor, "n" - newer than cursor
+    c: int  # id of the first/last homework on the current page
+    s: str = ""  # subject prefix filter
+    f: str = ""  # date from, YYYY-MM-DD
+    t: str = ""  # date to (inclusive), YYYY-MM-DD
+
+
+@dataclass
+class HomeworkFilter:
+    subject: str = ""
+    date_from: str = ""
+    date_to: str = ""
+
+
+def parse_filter(args: list[str]) -> HomeworkFilter:
+    """
+    Parse "/hw [предмет] [с ГГГГ-ММ-ДД] [по ГГГГ-ММ-ДД]" arguments.
+    Raises ValueError on a malformed date.
+    """
+    dates = [arg for arg in args if DATE_RE.match(arg)]
+    for value in dates:
+        date.fromisoformat(value)
+    subject = " ".join(arg for arg in args if not DATE_RE.match(arg))
+    return HomeworkFilter(
+        subject=subject.replace(":", ""),
+        date_from=dates[0] if dates else "",
+        date_to=dates[1] if len(dates) > 1 else ""
+    )
+
+
+def _pack(direction: str, cursor: int, flt: HomeworkFilter) -> str:
+    # Subjects are matched by prefix, so a long one can be shortened to fit
+    subject = flt.subject
+    while True:
+        try:
+            return HomeworkPage(d=direction, c=cursor, s=subject, f=flt.date_from, t=flt.date_to).pack()
+        except ValueError:
+            if not subject:
+                raise
+            subject = subject[:-1]
+
+
+async def fetch_page(db, class_group_id: int, flt: HomeworkFilter,
+                     cursor: int | None = None, direction: str = "o"):
+    """
+    One page of homework, newest first, using keyset pagination on
+    (date_assigned, id). Returns (rows, has_newer, has_older).
+    """
+    query = select(
+        Homework.id, Homework.subject_name, Homework.content, Homework.date_assigned, Homework.attachment_id,
+        Homework.due_date
+    ).where(Homework.class_group_id == class_group_id)
+
+    if flt.subject:
+        # Prefix match that can still use the (class, subject, date) index
+        query = query.where(
+            Homework.subject_name >= flt.subject,
+            Homework.subject_name < flt.subject + "\uffff"
+        )
+    if flt.date_from:
+        query = query.where(Homework.date_assigned >= flt.date_from)
+    if flt.date_to:
+        day_after = (date.fromisoformat(flt.date_to) + timedelta(days=1)).isoformat()
+        query = query.where(Homework.date_assigned < day_after)
+
+    key = None
+    if cursor is not None:
+        key = (await db.execute(
+            select(Homework.date_assigned, Homework.id).where(
+                Homework.id == cursor, Homework.class_group_id == class_group_id
+            )
+        )).one_or_none()
+
+    if key is None:
+        # First page, or the cursor homework was deleted meanwhile
+        rows = (await db.execute(
+            query.order_by(Homework.date_assigned.desc(), Homework.id.desc()).limit(PAGE_SIZE + 1)
+        )).all()
+        return rows[:PAGE_SIZE], False, len(rows) > PAGE_SIZE
+
+    position = tuple_(Homework.date_assigned, Homework.id)
+    if direction == "o":
+        rows = (await db.execute(
+            query.where(position < tuple(key))
+            .order_by(Homework.date_assigned.desc(), Homework.id.desc()).limit(PAGE_SIZE + 1)
+        )).all()
+        return rows[:PAGE_SIZE], True, len(rows) > PAGE_SIZE
+
+    rows = (await db.execute(
+        query.where(position > tuple(key))
+        .order_by(Homework.date_assigned, Homework.id).limit(PAGE_SIZE + 1)
+    )).all()
+    more = len(rows) > PAGE_SIZE
+    return list(reversed(rows[:PAGE_SIZE])), more, True
+
+
+def render_page(rows, has_newer: bool, has_older: bool,
+                flt: HomeworkFilter) -> tuple[str, InlineKeyboardMarkup | None]:
+    text = ["📚 <b>Домашние задания:</b>\n"]
+    files = []
+    for hw_id, subject_name, content, date_assigned, attachment_id, due_date in rows:
+        # Cut the raw text, then escape, so an entity or tag is never split
+        if len(content) > MAX_CONTENT_LENGTH:
+            content = content[:MAX_CONTENT_LENGTH] + "…"
+        due = f", сдать к {due_date:%d.%m}" if due_date else ""
+        text.append(f"📖 <b>{html.escape(subject_name)}</b> ({date_assigned}{due}){' 📎' if attachment_id else ''}")
+        text.append(f"   {html.escape(content)}")
+        text.append("")
+        if attachment_id:
+            # Button labels are plain text, never parsed as HTML
+            files.append([InlineKeyboardButton(
+                text=f"📎 {subject_name} ({date_assigned[:10]})", callback_data=HomeworkFiles(i=hw_id).pack()
+            )])
+
+    buttons = []
+    if has_newer:
+        buttons.append(InlineKeyboardButton(text="◀", callback_data=_pack("n", rows[0][0], flt)))
+    if has_older:
+        buttons.append(InlineKeyboardButton(text="▶", callback_data=_pack("o", rows[-1][0], flt)))
+    keyboard = files + ([buttons] if buttons else [])
+    markup = InlineKeyboardMarkup(inline_keyboard=keyboard) if keyboard else None
+    return "\n".join(text), markup
+
+
+async def homework_page(db, class_group_id: int, flt: HomeworkFilter,
+                        cursor: int | None = None, direction: str = "o"):
+    """Rendered page text and keyboard, or (None, None) if nothing matches."""
+    rows, has_newer, has_older = await fetch_page(db, class_group_id, flt, cursor, direction)
+    if not rows:
+        return None, None
+    return render_page(rows, has_newer, has_older, flt)
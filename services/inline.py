@@ -0,0 +1,180 @@
+import html
+import os
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+
+from aiogram.types import InlineQueryResultArticle, InputTextMessageContent
+from sqlalchemy import select
+
+from database.setup import read_session
+from database.models import Schedule, Homework
+from services.invalidation import subscribe
+from services.timetable import WEEKDAYS, render_day
+
+# Telegram serves a repeated query from its own cache for this many seconds
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "300"))
+# Newest homework kept in the index per class
+INLINE_HOMEWORK = int(os.getenv("INLINE_HOMEWORK", "30"))
+MAX_RESULTS = 50
+MAX_DESCRIPTION_LENGTH = 100
+MAX_CONTENT_LENGTH = 600
+
+RELATIVE_DAYS = {"сегодня": 0, "завтра": 1, "послезавтра": 2}
+WEEKDAY_ABBREVIATIONS = ["пн", "вт", "ср", "чт", "пт", "сб", "вс"]
+
+
+@dataclass
+class ClassIndex:
+    """What inline queries of one class are answered from; None parts are loaded on demand."""
+    week: dict[int, list[tuple[int, str]]] | None = None  # day -> [(lesson, subject)]
+    homework: list[tuple[int, str, str, str]] | None = None  # [(id, subject, content, date)], newest first
+    generation: int = 0
+
+
+@dataclass
+class InlineQuery:
+    days: list[int] = field(default_factory=list)
+    subject: str = ""
+
+
+def parse_query(query: str, today: date) -> InlineQuery:
+    """"завтра", "пятница", "пт" -> days; anything else is a subject prefix."""
+    words = query.casefold().split()
+    if not words:
+        return InlineQuery(days=[today.weekday(), (today + timedelta(days=1)).weekday()])
+    word = words[0]
+    if word in RELATIVE_DAYS:
+        return InlineQuery(days=[(today + timedelta(days=RELATIVE_DAYS[word])).weekday()])
+    if word in WEEKDAY_ABBREVIATIONS:
+        return InlineQuery(days=[WEEKDAY_ABBREVIATIONS.index(word)])
+    for day, name in enumerate(WEEKDAYS):
+        if len(word) >= 3 and name.casefold().startswith(word):
+            return InlineQuery(days=[day])
+    return InlineQuery(subject=" ".join(words))
+
+
+def _shorten(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+class InlineIndex:
+    """
+    Week timetable and recent homework per class, so inline queries need no
+    SQL. Edits drop only the changed part of one class, which is read back
+    on the next query from that class.
+    """
+
+    def __init__(self, homework_limit: int = INLINE_HOMEWORK):
+        self.homework_limit = homework_limit
+        self._classes: dict[int, ClassIndex] = {}
+
+    def __len__(self) -> int:
+        return len(self._classes)
+
+    def _entry(self, class_group_id: int) -> ClassIndex:
+        entry = self._classes.get(class_group_id)
+        if entry is None:
+            entry = self._classes[class_group_id] = ClassIndex()
+        return entry
+
+    def drop_week(self, class_group_id: int):
+        entry = self._entry(class_group_id)
+        entry.week = None
+        entry.generation += 1
+
+    def drop_homework(self, class_group_id: int):
+        entry = self._entry(class_group_id)
+        entry.homework = None
+        entry.generation += 1
+
+    async def get(self, class_group_id: int) -> ClassIndex:
+        entry = self._entry(class_group_id)
+        if entry.week is not None and entry.homework is not None:
+            return entry
+
+        generation = entry.generation
+        week, homework = entry.week, entry.homework
+        async with read_session() as session:
+            if week is None:
+                week = {}
+                for day, lesson_number, subject_name in (await session.execute(
+                    select(Schedule.day_of_week, Schedule.lesson_number, Schedule.subject_name)
+                    .where(Schedule.class_group_id == class_group_id)
+                    .order_by(Schedule.day_of_week, Schedule.lesson_number)
+                )).all():
+                    week.setdefault(day, []).append((lesson_number, subject_name))
+            if homework is None:
+                homework = [tuple(row) for row in (await session.execute(
+                    select(Homework.id, Homework.subject_name, Homework.content, Homework.date_assigned)
+                    .where(Homework.class_group_id == class_group_id)
+                    .order_by(Homework.date_assigned.desc(), Homework.id.desc())
+                    .limit(self.homework_limit)
+                )).all()]
+
+        # An edit while reading: answer with what we read, but don't keep it
+        if entry.generation != generation:
+            return ClassIndex(week, homework, generation)
+        entry.week, entry.homework = week, homework
+        return entry
+
+    def answer(self, entry: ClassIndex, query: InlineQuery) -> list[InlineQueryResultArticle]:
+        if query.days:
+            return [self._day_article(entry, day) for day in query.days]
+
+        results = []
+        matching = {subject for lessons in entry.week.values() for _, subject in lessons
+                    if subject.casefold().startswith(query.subject)}
+        days = [day for day, lessons in sorted(entry.week.items())
+                if any(subject in matching for _, subject in lessons)]
+        if days:
+            names = ", ".join(sorted(matching))
+            text = f"📅 <b>{html.escape(names)}</b>: " + ", ".join(WEEKDAYS[day] for day in days)
+            results.append(InlineQueryResultArticle(
+                id="lessons", title=f"📅 {names}",
+                description=", ".join(WEEKDAYS[day] for day in days),
+                input_message_content=InputTextMessageContent(message_text=text, parse_mode="HTML"),
+            ))
+        for hw_id, subject_name, content, date_assigned in entry.homework:
+            if len(results) >= MAX_RESULTS:
+                break
+            if subject_name.casefold().startswith(query.subject):
+                results.append(self._homework_article(hw_id, subject_name, content, date_assigned))
+        return results
+
+    def _day_article(self, entry: ClassIndex, day: int) -> InlineQueryResultArticle:
+        lessons = entry.week.get(day, [])
+        text = render_day(day, lessons) or f"На {WEEKDAYS[day]} расписания нет."
+        # The newest homework of each subject of that day
+        latest = {}
+        for _, subject_name, content, _ in entry.homework:
+            latest.setdefault(subject_name, content)
+        homework = [
+            f"📖 <b>{html.escape(subject)}</b>: {html.escape(_shorten(latest[subject], MAX_CONTENT_LENGTH))}"
+            for subject in dict.fromkeys(subject for _, subject in lessons) if subject in latest
+        ]
+        if homework:
+            text += "\n\n" + "\n".join(homework)
+        return InlineQueryResultArticle(
+            id=f"day:{day}", title=f"📅 {WEEKDAYS[day]}",
+            description=", ".join(subject for _, subject in lessons) or "Уроков нет",
+            input_message_content=InputTextMessageContent(message_text=text, parse_mode="HTML"),
+        )
+
+    @staticmethod
+    def _homework_article(hw_id: int, subject_name: str, content: str,
+                          date_assigned: str) -> InlineQueryResultArticle:
+        text = (f"📖 <b>{html.escape(subject_name)}</b> ({date_assigned[:10]})\n"
+                f"{html.escape(_shorten(content, MAX_CONTENT_LENGTH))}")
+        return InlineQueryResultArticle(
+            id=f"hw:{hw_id}", title=f"📖 {subject_name} ({date_assigned[:10]})",
+            description=_shorten(content, MAX_DESCRIPTION_LENGTH),
+            input_message_content=InputTextMessageContent(message_text=text, parse_mode="HTML"),
+        )
+
+    def stats(self) -> dict:
+        return {"classes": len(self._classes)}
+
+
+inline_index = InlineIndex()
+subscribe("timetable", inline_index.drop_week)
+subscribe("homework", inline_index.drop_homework)
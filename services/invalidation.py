@@ -0,0 +1,35 @@
+import logging
+from collections import defaultdict
+from typing import Any, Callable
+
+# In-process caches subscribe to topics here. When the bot runs as several
+# worker processes, a forwarder is installed that also sends every event to
+# the other workers, which apply it through deliver().
+
+_subscribers: dict[str, list[Callable[[Any], None]]] = defaultdict(list)
+_forward: Callable[[str, Any], None] | None = None
+
+
+def subscribe(topic: str, callback: Callable[[Any], None]):
+    _subscribers[topic].append(callback)
+
+
+def set_forwarder(forward: Callable[[str, Any], None] | None):
+    global _forward
+    _forward = forward
+
+
+def deliver(topic: str, key: Any):
+    """Apply an event in this process only."""
+    for callback in _subscribers.get(topic, ()):
+        try:
+            callback(key)
+        except Exception as e:
+            logging.error(f"Invalidation handler for {topic} failed: {e}")
+
+
+def publish(topic: str, key: Any):
+    """Apply an event here and in every other worker process."""
+    deliver(topic, key)
+    if _forward:
+        _forward(topic, key)
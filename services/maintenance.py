@@ -0,0 +1,107 @@
+import logging
+import os
+import time
+from dataclasses import dataclass
+
+from sqlalchemy import select, delete, insert, func, literal
+
+from database.setup import engine, async_session
+from database.models import ClassGroup, Homework, HomeworkArchive
+from services.invalidation import publish
+from services.attachments import delete_attachments
+
+# Homework older than this many days is archived, unless the class set its own value
+HW_RETENTION_DAYS = int(os.getenv("HW_RETENTION_DAYS", "180"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+MAINTENANCE_TIME = os.getenv("MAINTENANCE_TIME", "03:30")
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+@dataclass
+class MaintenanceReport:
+    moved: int = 0
+    bytes_reclaimed: int = 0
+    elapsed: float = 0.0
+
+    def __str__(self) -> str:
+        return f"moved={self.moved} reclaimed={self.bytes_reclaimed}B elapsed={self.elapsed:.2f}s"
+
+
+def _expired_ids(limit: int):
+    """Ids and classes of homeworks older than their class's retention period."""
+    days = func.coalesce(ClassGroup.homework_retention_days, HW_RETENTION_DAYS)
+    cutoff = func.date("now", "localtime", literal("-").concat(days).concat(" days"))
+    return (
+        select(Homework.id, Homework.class_group_id)
+        .join(ClassGroup, ClassGroup.id == Homework.class_group_id)
+        .where(days > 0, Homework.date_assigned < cutoff)
+        .limit(limit)
+    )
+
+
+async def archive_homework(batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Move expired homework into homeworks_archive, one short transaction per batch."""
+    moved = 0
+    while True:
+        async with async_session() as session:
+            rows = (await session.execute(_expired_ids(batch_size))).all()
+            if not rows:
+                break
+            ids = [hw_id for hw_id, _ in rows]
+            await session.execute(insert(HomeworkArchive).from_select(
+                ["id", "class_group_id", "subject_name", "content", "attachment_id",
+                 "date_assigned", "due_date", "archived_at"],
+                select(
+                    Homework.id, Homework.class_group_id, Homework.subject_name, Homework.content,
+                    Homework.attachment_id, Homework.date_assigned, Homework.due_date,
+                    func.datetime("now", "localtime")
+                ).where(Homework.id.in_(ids))
+            ))
+            # The archive keeps the first file_id in attachment_id
+            await delete_attachments(session, ids)
+            await session.execute(delete(Homework).where(Homework.id.in_(ids)))
+            await session.commit()
+        for class_group_id in {class_id for _, class_id in rows}:
+            publish("homework", class_group_id)
+        moved += len(ids)
+        if len(ids) < batch_size:
+            break
+    return moved
+
+
+async def _pragma(conn, name: str) -> int:
+    return (await conn.exec_driver_sql(f"PRAGMA {name}")).scalar()
+
+
+async def compact() -> int:
+    """Return free pages to the OS and refresh planner statistics. Returns bytes reclaimed."""
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        page_size = await _pragma(conn, "page_size")
+        before = await _pragma(conn, "page_count")
+
+        if await _pragma(conn, "auto_vacuum") != AUTO_VACUUM_INCREMENTAL:
+            # Databases created before incremental vacuum need one full VACUUM to switch
+            logging.warning("Switching database to incremental auto_vacuum")
+            await conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+            await conn.exec_driver_sql("VACUUM")
+        else:
+            # The pragma frees one page per step and returns no rows, so a plain
+            # execute would stop after the first page; executescript steps to the end
+            raw = await conn.get_raw_connection()
+            await raw.driver_connection.executescript("PRAGMA incremental_vacuum")
+
+        await conn.exec_driver_sql("PRAGMA optimize")
+        after = await _pragma(conn, "page_count")
+    return max(before - after, 0) * page_size
+
+
+async def run_maintenance() -> MaintenanceReport:
+    report = MaintenanceReport()
+    started = time.monotonic()
+    report.moved = await archive_homework()
+    report.bytes_reclaimed = await compact()
+    report.elapsed = time.monotonic() - started
+    logging.info(f"Maintenance finished: {report}")
+    return report
@@ -0,0 +1,228 @@
+import logging
+import os
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable
+
+from aiohttp import web
+from sqlalchemy import event
+
+# Port of the Prometheus endpoint; 0 disables it
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# Updates slower than this are logged with their SQL; 0 disables the log
+SLOW_UPDATE_MS = float(os.getenv("SLOW_UPDATE_MS", "0"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Statements kept per update for the slow-update log
+MAX_LOGGED_QUERIES = 50
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple, le: str | None = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name, self.help, self.label_names = name, help, labels
+        self._values: dict[tuple, float] = {}
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.label_names = name, help, labels
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket..., sum, count]
+        self._values: dict[tuple, list[float]] = {}
+        _registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        series = self._values.get(key)
+        if series is None:
+            series = self._values[key] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in self._values.items():
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, bound)} {count}")
+            lines.append(f"{self.name}_bucket{_labels(self.label_names, key, '+Inf')} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    """A value read from `source` at scrape time, e.g. cache statistics."""
+
+    def __init__(self, name: str, help: str, source: Callable[[], dict[tuple, float]],
+                 labels: tuple[str, ...] = ()):
+        self.name, self.help, self.label_names, self.source = name, help, labels, source
+        _registry.append(self)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for key, value in self.source().items():
+            lines.append(f"{self.name}{_labels(self.label_names, key)} {value}")
+        return lines
+
+
+_registry: list = []
+
+update_duration = Histogram(
+    "bot_update_duration_seconds", "Time to process an update, by handler", ("handler",)
+)
+update_errors = Counter(
+    "bot_update_errors_total", "Updates whose handler raised", ("handler",)
+)
+sql_statements = Histogram(
+    "bot_sql_statements_per_update", "SQL statements executed per update", ("handler",), COUNT_BUCKETS
+)
+sql_duration = Histogram(
+    "bot_sql_duration_seconds", "Time spent in SQL per update", ("handler",)
+)
+reminder_duration = Histogram(
+    "bot_reminder_run_duration_seconds", "Duration of one check_lessons run", ("time",),
+    (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300)
+)
+reminder_messages = Counter(
+    "bot_reminder_messages_total", "Reminder messages queued", ("outcome",)
+)
+throttled_updates = Counter(
+    "bot_throttled_updates_total", "Updates dropped by throttling", ("reason", "command_class")
+)
+outbox_messages = Counter(
+    "bot_outbox_messages_total", "Outbox send attempts by outcome", ("outcome",)
+)
+update_wait = Histogram(
+    "bot_update_wait_seconds", "Time an update waited in its chat's queue before processing"
+)
+
+
+def _cache_stats() -> dict[tuple, float]:
+    from services.users import user_cache
+    from services import timetable
+    from services.inline import inline_index
+    from services.attachments import file_ids
+    from services.classes import class_directories
+
+    values = {("user", name): value for name, value in user_cache.stats().items()}
+    values[("timetable", "size")] = len(timetable._rendered)
+    values[("subject_days", "classes")] = len(timetable._subject_days)
+    values[("inline", "classes")] = len(inline_index)
+    values[("class_directory", "classes")] = sum(map(len, class_directories.values()))
+    values.update({("file_ids", name): value for name, value in file_ids.stats().items()})
+    return values
+
+
+cache_stats = Gauge("bot_cache", "In-process cache statistics", _cache_stats, ("cache", "stat"))
+
+
+def _queue_stats() -> dict[tuple, float]:
+    from services.updates import queue_stats
+
+    return {(name,): value for name, value in queue_stats().items()}
+
+
+update_queue = Gauge("bot_update_queue", "Updates queued per chat and running", _queue_stats, ("stat",))
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+@dataclass
+class UpdateStats:
+    """What one update did; lives in a context variable while it is processed."""
+    handler: str = "unhandled"
+    statements: int = 0
+    sql_seconds: float = 0.0
+    queries: list[tuple[str, float]] = field(default_factory=list)
+
+
+current_update: ContextVar[UpdateStats | None] = ContextVar("current_update", default=None)
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    # A connection runs one statement at a time
+    conn.info["query_started"] = time.perf_counter()
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"]
+    stats = current_update.get()
+    if stats is None:
+        return
+    stats.statements += 1
+    stats.sql_seconds += elapsed
+    if SLOW_UPDATE_MS and len(stats.queries) < MAX_LOGGED_QUERIES:
+        stats.queries.append((statement, elapsed))
+
+
+def instrument_engine(engine):
+    """Count and time the statements of an async engine per update."""
+    event.listen(engine.sync_engine, "before_cursor_execute", _before_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", _after_execute)
+
+
+def finish_update(stats: UpdateStats, elapsed: float, failed: bool):
+    update_duration.observe(elapsed, handler=stats.handler)
+    sql_statements.observe(stats.statements, handler=stats.handler)
+    sql_duration.observe(stats.sql_seconds, handler=stats.handler)
+    if failed:
+        update_errors.inc(handler=stats.handler)
+
+    if SLOW_UPDATE_MS and elapsed * 1000 >= SLOW_UPDATE_MS:
+        queries = "\n".join(f"  {duration * 1000:.1f} ms: {' '.join(sql.split())}"
+                            for sql, duration in stats.queries)
+        logging.warning(
+            f"Slow update: {stats.handler} took {elapsed * 1000:.1f} ms, "
+            f"{stats.statements} SQL statements in {stats.sql_seconds * 1000:.1f} ms\n{queries}"
+        )
+
+
+async def start_metrics_server(port: int = METRICS_PORT) -> web.AppRunner | None:
+    """Serve /metrics in Prometheus text format. Does nothing when the port is 0."""
+    if not port:
+        return None
+
+    async def metrics(request: web.Request) -> web.Response:
+        return web.Response(body=render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, port).start()
+    logging.warning(f"Metrics available on http://{METRICS_HOST}:{port}/metrics")
+    return runner
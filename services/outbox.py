@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramRetryAfter,
+)
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.dialects.sqlite import insert
+
+from database.setup import async_session, read_session
+from database.models import OutboxMessage, User
+from services.broadcast import BroadcastMessage, BroadcastReport, RateLimiter, BACKOFF_BASE, WORKERS
+from services.attachments import loads, send_attachments
+from services.tenants import bot_for, tenant_of
+from services import metrics
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+# After this many RetryAfter answers in a row a message goes back to the queue
+# (as one attempt), so a flood-limited chat doesn't hold a sending slot
+OUTBOX_FLOOD_RETRIES = int(os.getenv("OUTBOX_FLOOD_RETRIES", "3"))
+# A claimed message that isn't marked within this many seconds (the process
+# died mid-send) is sent again
+OUTBOX_CLAIM_TIMEOUT = int(os.getenv("OUTBOX_CLAIM_TIMEOUT", "300"))
+# Longest sleep while nothing is due; picks up rows queued by other processes
+OUTBOX_IDLE_POLL = float(os.getenv("OUTBOX_IDLE_POLL", "60"))
+# Delivered and dead messages are deleted by the maintenance job after this many days
+OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", "7"))
+MAX_BACKOFF = 3600
+INSERT_CHUNK = 500
+
+
+def _ts(moment: datetime | None = None) -> str:
+    return (moment or datetime.now()).isoformat(timespec="seconds")
+
+
+async def enqueue(session, messages: list[BroadcastMessage], run_key: str) -> int:
+    """
+    Queue messages in the caller's transaction; they are sent once it commits.
+    `run_key` names the job run, so queueing the same run again adds nothing.
+    Returns how many messages were new.
+    """
+    now = _ts()
+    rows = [{"dedup_key": f"{run_key}:{msg.tenant}:{msg.chat_id}", "tenant": msg.tenant, "chat_id": msg.chat_id,
+             "text": msg.text, "attachments": msg.attachments, "status": "pending", "attempts": 0,
+             "next_attempt_at": now, "created_at": now}
+            for msg in messages]
+    queued = 0
+    for i in range(0, len(rows), INSERT_CHUNK):
+        result = await session.execute(
+            insert(OutboxMessage).values(rows[i:i + INSERT_CHUNK])
+            .on_conflict_do_nothing(index_elements=[OutboxMessage.dedup_key])
+        )
+        queued += result.rowcount
+    return queued
+
+
+def _backoff(attempts: int) -> timedelta:
+    seconds = min(MAX_BACKOFF, BACKOFF_BASE * 2 ** attempts * (1 + random.random()))
+    return timedelta(seconds=seconds)
+
+
+class OutboxDrainer:
+    """
+    Sends queued messages in batches. A batch is claimed in one statement,
+    so replicas never send the same row, and every message is marked as
+    soon as Telegram answers. Transient errors are retried with backoff;
+    users who blocked the bot are dead-lettered and left out of later
+    broadcasts. Each message goes out through its tenant's bot, and every
+    bot has its own rate limiter, as Telegram's limits are per bot.
+    """
+
+    def __init__(self, bot: Bot, batch_size: int = OUTBOX_BATCH_SIZE, workers: int = WORKERS,
+                 limiter: RateLimiter | None = None):
+        self.bot = bot
+        self.batch_size = batch_size
+        self.limiter = limiter or RateLimiter()
+        self._limiters = {tenant_of(bot): self.limiter}
+        self._slots = asyncio.Semaphore(workers)
+        self._wakeup = asyncio.Event()
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _route(self, tenant: str) -> tuple[Bot | None, RateLimiter]:
+        bot = self.bot if tenant == tenant_of(self.bot) else bot_for(tenant)
+        limiter = self._limiters.get(tenant)
+        if limiter is None:
+            limiter = self._limiters[tenant] = RateLimiter()
+        return bot, limiter
+
+    async def claim(self) -> list:
+        now = datetime.now()
+        due = (
+            select(OutboxMessage.id)
+            .where(OutboxMessage.status.in_(("pending", "sending")), OutboxMessage.next_attempt_at <= _ts(now))
+            .order_by(OutboxMessage.next_attempt_at, OutboxMessage.id)
+            .limit(self.batch_size)
+        )
+        stmt = (
+            update(OutboxMessage)
+            .where(OutboxMessage.id.in_(due))
+            .values(status="sending", next_attempt_at=_ts(now + timedelta(seconds=OUTBOX_CLAIM_TIMEOUT)))
+            .returning(OutboxMessage.id, OutboxMessage.chat_id, OutboxMessage.text, OutboxMessage.attempts,
+                       OutboxMessage.attachments, OutboxMessage.tenant)
+            .execution_options(synchronize_session=False)
+        )
+        async with async_session() as session:
+            rows = (await session.execute(stmt)).all()
+            await session.commit()
+        return rows
+
+    async def drain_once(self) -> BroadcastReport:
+        """Send one batch and report what became of it."""
+        report = BroadcastReport()
+        started = time.monotonic()
+        rows = await self.claim()
+        statuses = await asyncio.gather(*(self._send(*row) for row in rows))
+        for (_, chat_id, *_), status in zip(rows, statuses):
+            if status == "delivered":
+                report.delivered += 1
+            elif status == "dead":
+                report.failed += 1
+                report.failed_chats.append(chat_id)
+            else:
+                report.retried += 1
+        report.elapsed = time.monotonic() - started
+        if rows:
+            logging.info(f"Outbox batch sent: {report}")
+        return report
+
+    async def _send(self, message_id: int, chat_id: int, text: str, attempts: int, attachments: str | None,
+                    tenant: str) -> str:
+        """Deliver one message; returns the status it was marked with."""
+        bot, limiter = self._route(tenant)
+        flood_retries = 0
+        async with self._slots:
+            while True:
+                await limiter.acquire(chat_id)
+                try:
+                    if bot is None:
+                        # The school's token was removed from the config; retried until it is back
+                        raise LookupError(f"No bot for tenant {tenant}")
+                    if attachments:
+                        await send_attachments(bot, chat_id, loads(attachments), caption=text)
+                    else:
+                        await bot.send_message(chat_id, text, parse_mode="HTML")
+                    return await self._mark(message_id, attempts + 1, "delivered")
+                except TelegramRetryAfter as e:
+                    # Flood control, not this message's fault: wait and send again
+                    limiter.pause(e.retry_after)
+                    flood_retries += 1
+                    if flood_retries >= OUTBOX_FLOOD_RETRIES:
+                        status = "dead" if attempts + 1 >= OUTBOX_MAX_ATTEMPTS else "pending"
+                        return await self._mark(message_id, attempts + 1, status, str(e),
+                                                retry_in=timedelta(seconds=e.retry_after))
+                except TelegramForbiddenError as e:
+                    return await self._mark(message_id, attempts + 1, "dead", str(e), blocked_chat=(tenant, chat_id))
+                except TelegramBadRequest as e:
+                    return await self._mark(message_id, attempts + 1, "dead", str(e))
+                except Exception as e:
+                    logging.warning(f"Outbox message {message_id} to {chat_id} failed: {e}")
+                    status = "dead" if attempts + 1 >= OUTBOX_MAX_ATTEMPTS else "pending"
+                    return await self._mark(message_id, attempts + 1, status, str(e))
+
+    async def _mark(self, message_id: int, attempts: int, status: str, error: str | None = None,
+                    blocked_chat: tuple[str, int] | None = None, retry_in: timedelta | None = None) -> str:
+        now = datetime.now()
+        values = {"status": status, "attempts": attempts, "last_error": error and error[:256]}
+        if status == "delivered":
+            values["sent_at"] = _ts(now)
+        elif status == "pending":
+            values["next_attempt_at"] = _ts(now + (retry_in or _backoff(attempts)))
+
+        async with async_session() as session:
+            await session.execute(update(OutboxMessage).where(OutboxMessage.id == message_id).values(**values))
+            if blocked_chat is not None:
+                tenant, chat_id = blocked_chat
+                await session.execute(
+                    update(User).where(User.tenant == tenant, User.telegram_id == chat_id, User.blocked_at.is_(None))
+                    .values(blocked_at=_ts(now))
+                )
+            await session.commit()
+
+        metrics.outbox_messages.inc(outcome="retried" if status == "pending" else status)
+        if status == "dead":
+            logging.info(f"Outbox message {message_id} dead-lettered: {error}")
+        return status
+
+    async def _next_due(self) -> float:
+        """Seconds until the earliest queued message is due, at most OUTBOX_IDLE_POLL."""
+        async with read_session() as session:
+            next_due = (await session.execute(
+                select(func.min(OutboxMessage.next_attempt_at))
+                .where(OutboxMessage.status.in_(("pending", "sending")))
+            )).scalar()
+        if next_due is None:
+            return OUTBOX_IDLE_POLL
+        delay = (datetime.fromisoformat(next_due) - datetime.now()).total_seconds()
+        return min(max(delay, 0), OUTBOX_IDLE_POLL)
+
+    async def run(self):
+        while True:
+            # Cleared before looking, so a notify() during the batch isn't lost
+            self._wakeup.clear()
+            try:
+                if (await self.drain_once()).total:
+                    continue
+                delay = await self._next_due()
+            except Exception as e:
+                logging.error(f"Outbox drainer failed: {e}")
+                delay = OUTBOX_IDLE_POLL
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def prune() -> int:
+    """Delete delivered and dead messages older than OUTBOX_RETENTION_DAYS."""
+    cutoff = _ts(datetime.now() - timedelta(days=OUTBOX_RETENTION_DAYS))
+    async with async_session() as session:
+        result = await session.execute(
+            delete(OutboxMessage).where(
+                OutboxMessage.status.in_(("delivered", "dead")), OutboxMessage.created_at < cutoff
+            )
+        )
+        await session.commit()
+    return result.rowcount
+
+
+_drainer: OutboxDrainer | None = None
+_run_task: asyncio.Task | None = None
+
+
+def start_drainer(bot: Bot) -> OutboxDrainer:
+    global _drainer, _run_task
+    _drainer = OutboxDrainer(bot)
+    _run_task = asyncio.create_task(_drainer.run())
+    return _drainer
+
+
+def notify():
+    """Wake the drainer after committing new messages (if it runs in this process)."""
+    if _drainer is not None:
+        _drainer.notify()
@@ -0,0 +1,206 @@
+import csv
+import io
+import json
+from dataclasses import dataclass, field
+
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.sqlite import insert
+
+from database.models import ClassGroup, Schedule
+from services.timetable import WEEKDAYS, bump_version
+
+MAX_IMPORT_BYTES = 1024 * 1024
+MAX_ERRORS = 20
+UPSERT_CHUNK = 500
+
+# Accepted spellings of a weekday besides 0-6
+DAY_NAMES = {name.lower(): i for i, name in enumerate(WEEKDAYS)}
+DAY_NAMES.update({name: i for i, name in enumerate(["пн", "вт", "ср", "чт", "пт", "сб", "вс"])})
+
+
+class ScheduleImportError(ValueError):
+    """The uploaded file can't be applied; carries every problem found."""
+
+    def __init__(self, errors: list[str]):
+        super().__init__("\n".join(errors))
+        self.errors = errors
+
+
+@dataclass
+class ImportRow:
+    line: int
+    class_name: str | None
+    day: int
+    lesson: int
+    subject: str
+
+
+@dataclass
+class ImportResult:
+    added: list[str] = field(default_factory=list)
+    changed: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+    unchanged: int = 0
+    classes: set[int] = field(default_factory=set)
+
+
+def _parse_day(value) -> int:
+    value = str(value).strip().lower()
+    if value in DAY_NAMES:
+        return DAY_NAMES[value]
+    day = int(value)
+    if day < 0 or day > 6:
+        raise ValueError()
+    return day
+
+
+def _records(data: bytes, filename: str):
+    """Yield (line, dict) pairs from a CSV or JSON upload."""
+    if filename.lower().endswith(".json"):
+        records = json.loads(data.decode("utf-8-sig"))
+        if isinstance(records, dict):
+            records = records.get("lessons", [])
+        if not isinstance(records, list):
+            raise ScheduleImportError(["JSON должен быть списком уроков"])
+        yield from enumerate(records, start=1)
+        return
+
+    text = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8-sig", newline="")
+    sample = text.read(2048)
+    text.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    # Line 1 is the header
+    yield from enumerate(csv.DictReader(text, dialect=dialect), start=2)
+
+
+def parse_rows(data: bytes, filename: str) -> list[ImportRow]:
+    """
+    Validate the whole file in one pass.
+    Columns: class (optional), day (0-6 or name), lesson, subject.
+    """
+    rows, errors = [], []
+    seen: dict[tuple, int] = {}
+    for line, record in _records(data, filename):
+        if len(errors) >= MAX_ERRORS:
+            break
+        if not isinstance(record, dict):
+            errors.append(f"Строка {line}: ожидается объект с полями day, lesson, subject")
+            continue
+        record = {str(k).strip().lower(): v for k, v in record.items() if k is not None}
+        try:
+            day = _parse_day(record.get("day", ""))
+        except ValueError:
+            errors.append(f"Строка {line}: день должен быть от 0 до 6")
+            continue
+        try:
+            lesson = int(str(record.get("lesson", "")).strip())
+            if lesson < 1:
+                raise ValueError()
+        except ValueError:
+            errors.append(f"Строка {line}: номер урока должен быть положительным числом")
+            continue
+        subject = str(record.get("subject") or "").strip()
+        if not subject or len(subject) > 128:
+            errors.append(f"Строка {line}: пустое или слишком длинное название предмета")
+            continue
+        class_name = str(record.get("class") or "").strip() or None
+
+        key = (class_name, day, lesson)
+        if key in seen:
+            errors.append(f"Строка {line}: урок уже указан в строке {seen[key]}")
+            continue
+        seen[key] = line
+        rows.append(ImportRow(line, class_name, day, lesson, subject))
+
+    if errors:
+        raise ScheduleImportError(errors)
+    if not rows:
+        raise ScheduleImportError(["Файл не содержит уроков"])
+    return rows
+
+
+async def apply_rows(db, rows: list[ImportRow], default_class_id: int | None,
+                     tenant: str, other_classes: bool = False) -> ImportResult:
+    """
+    Upsert the lessons in the update's write transaction (`db`, a UnitOfWork);
+    the caller commits. Every (class, day) in the file is treated as complete,
+    so lessons missing from it are removed. Classes are looked up by name
+    among the tenant's own; unless `other_classes` is set, the file may only
+    touch the sender's class (`default_class_id`).
+    """
+    names = {row.class_name for row in rows if row.class_name}
+    class_ids = {}
+    if names:
+        class_ids = dict((await db.execute(
+            select(ClassGroup.name, ClassGroup.id).where(ClassGroup.tenant == tenant, ClassGroup.name.in_(names))
+        )).all())
+
+    errors = []
+    lessons: dict[tuple[int, int, int], str] = {}
+    for row in rows:
+        class_id = class_ids.get(row.class_name) if row.class_name else default_class_id
+        if class_id is None:
+            errors.append(f"Строка {row.line}: класс '{row.class_name or ''}' не найден")
+            continue
+        if class_id != default_class_id and not other_classes:
+            errors.append(f"Строка {row.line}: расписание других классов может загружать только староста")
+            continue
+        key = (class_id, row.day, row.lesson)
+        if key in lessons:
+            errors.append(f"Строка {row.line}: урок для этого класса уже указан")
+            continue
+        lessons[key] = row.subject
+    if errors:
+        raise ScheduleImportError(errors[:MAX_ERRORS])
+
+    result = ImportResult(classes={key[0] for key in lessons})
+    days = {(class_id, day) for class_id, day, _ in lessons}
+    existing = {
+        (class_id, day, lesson): (schedule_id, subject)
+        for schedule_id, class_id, day, lesson, subject in (await db.execute(
+            select(Schedule.id, Schedule.class_group_id, Schedule.day_of_week,
+                   Schedule.lesson_number, Schedule.subject_name)
+            .where(Schedule.class_group_id.in_(result.classes))
+        )).all()
+        if (class_id, day) in days
+    }
+    names_by_id = {class_id: name for name, class_id in class_ids.items()}
+
+    def label(key) -> str:
+        class_id, day, lesson = key
+        prefix = f"{names_by_id[class_id]}, " if class_id in names_by_id else ""
+        return f"{prefix}{WEEKDAYS[day]}, урок {lesson}"
+
+    upserts = []
+    for key, subject in sorted(lessons.items()):
+        old = existing.get(key)
+        if old is None:
+            result.added.append(f"{label(key)}: {subject}")
+        elif old[1] != subject:
+            result.changed.append(f"{label(key)}: {old[1]} → {subject}")
+        else:
+            result.unchanged += 1
+            continue
+        upserts.append({"class_group_id": key[0], "day_of_week": key[1],
+                        "lesson_number": key[2], "subject_name": subject})
+
+    removed_ids = []
+    for key, (schedule_id, subject) in sorted(existing.items()):
+        if key not in lessons:
+            result.removed.append(f"{label(key)}: {subject}")
+            removed_ids.append(schedule_id)
+
+    for i in range(0, len(upserts), UPSERT_CHUNK):
+        stmt = insert(Schedule).values(upserts[i:i + UPSERT_CHUNK])
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=[Schedule.class_group_id, Schedule.day_of_week, Schedule.lesson_number],
+            set_={"subject_name": stmt.excluded.subject_name}
+        ))
+    for i in range(0, len(removed_ids), UPSERT_CHUNK):
+        await db.execute(delete(Schedule).where(Schedule.id.in_(removed_ids[i:i + UPSERT_CHUNK])))
+    for class_id in result.classes:
+        db.on_commit(lambda class_id=class_id: bump_version(class_id))
+    return result
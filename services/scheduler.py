@@ -1,64 +1,226 @@
+import asyncio
+import html
 import logging
+import os
+import socket
+import time
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
 from aiogram import Bot
 from sqlalchemy import select
-from datetime import datetime
+from sqlalchemy.dialects.sqlite import insert
+from datetime import date, datetime, timedelta
 
-from database.setup import async_session
-from database.models import User, ClassGroup, Schedule, Homework
+from database.setup import async_session, read_session
+from database.models import User, ClassGroup, Homework, ReminderTime, JobLease
+from services.broadcast import BroadcastMessage
+from services.outbox import enqueue, notify, start_drainer, prune
+from services.attachments import MAX_ATTACHMENTS, load_attachments, dumps
+from services.maintenance import MAINTENANCE_TIME, run_maintenance
+from services.invalidation import subscribe
+from services import metrics
 
 scheduler = AsyncIOScheduler()
 
-async def check_lessons(bot: Bot):
+# Used for classes that haven't configured their own reminder times
+DEFAULT_REMINDER_TIMES = ["08:00", "12:00", "15:00"]  # Morning, lunch, evening
+
+# A run that is late by more than this (e.g. the bot was down) is skipped.
+# Several missed runs of one job are coalesced into one.
+MISFIRE_GRACE = int(os.getenv("REMINDER_MISFIRE_GRACE", "3600"))
+
+REPLICA_ID = os.getenv("REPLICA_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+REMINDER_JOB_PREFIX = "reminder:"
+MAINTENANCE_JOB = "maintenance"
+
+async def load_reminders(session, class_ids: set[int], due: date) -> list[BroadcastMessage]:
+    """Build reminders about homework due on `due` for every user with two set-based queries."""
+    # One range of the (class, due_date) index per class
+    rows = (await session.execute(
+        select(Homework.id, Homework.class_group_id, Homework.subject_name, Homework.content,
+               Homework.attachment_id)
+        .where(Homework.class_group_id.in_(class_ids), Homework.due_date == due)
+        .order_by(Homework.class_group_id, Homework.id)
+    )).all()
+
+    texts: dict[int, list[str]] = {}
+    with_files: dict[int, list[int]] = {}
+    for hw_id, class_group_id, subject_name, content, attachment_id in rows:
+        hw_text = texts.setdefault(class_group_id, ["📚 <b>Домашние задания на завтра:</b>\n"])
+        hw_text.append(f"📖 {html.escape(subject_name)}: {html.escape(content)}")
+        if attachment_id:
+            with_files.setdefault(class_group_id, []).append(hw_id)
+
+    if not texts:
+        return []
+
+    # Sent by file_id along with the text, one media group per recipient
+    attachments = await load_attachments(session, [hw_id for ids in with_files.values() for hw_id in ids])
+    files = {class_group_id: dumps([a for hw_id in ids for a in attachments.get(hw_id, [])][:MAX_ATTACHMENTS])
+             for class_group_id, ids in with_files.items()}
+
+    recipients = (await session.execute(
+        select(User.telegram_id, User.class_group_id, User.tenant).where(
+            User.class_group_id.in_(list(texts)), User.blocked_at.is_(None)
+        )
+    )).all()
+
+    rendered = {class_group_id: "\n".join(lines) for class_group_id, lines in texts.items()}
+    return [BroadcastMessage(telegram_id, rendered[class_group_id], attachments=files.get(class_group_id),
+                             tenant=tenant)
+            for telegram_id, class_group_id, tenant in recipients]
+
+async def load_reminder_times(session) -> dict[str, set[int]]:
+    """Map each reminder time (HH:MM) to the classes that want a reminder then."""
+    by_time: dict[str, set[int]] = {}
+    configured = set()
+    for class_group_id, time in (await session.execute(
+        select(ReminderTime.class_group_id, ReminderTime.time)
+    )).all():
+        by_time.setdefault(time, set()).add(class_group_id)
+        configured.add(class_group_id)
+
+    class_ids = (await session.execute(select(ClassGroup.id))).scalars().all()
+    for class_group_id in class_ids:
+        if class_group_id not in configured:
+            for time in DEFAULT_REMINDER_TIMES:
+                by_time.setdefault(time, set()).add(class_group_id)
+    return by_time
+
+def last_occurrence(time: str, now: datetime | None = None) -> datetime:
+    """The most recent moment (not in the future) the daily HH:MM fired."""
+    now = now or datetime.now()
+    hour, minute = map(int, time.split(":"))
+    fire_time = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if fire_time > now:
+        fire_time -= timedelta(days=1)
+    return fire_time
+
+async def claim_lease(session, job_id: str, fire_time: datetime) -> bool:
     """
-    Checks for upcoming lessons and homework reminders.
-    This runs every 5 minutes.
+    Claim one run of a job for this replica within the caller's transaction.
+    Only the replica that moves the lease forward gets True.
     """
+    fired_at = fire_time.isoformat()
+    stmt = insert(JobLease).values(job_id=job_id, fired_at=fired_at, owner=REPLICA_ID)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[JobLease.job_id],
+        set_={"fired_at": fired_at, "owner": REPLICA_ID},
+        where=JobLease.fired_at < fired_at
+    )
+    result = await session.execute(stmt)
+    return result.rowcount == 1
+
+async def claim_run(job_id: str, fire_time: datetime) -> bool:
+    """Atomically claim one run of a job for this replica."""
+    async with async_session() as session:
+        claimed = await claim_lease(session, job_id, fire_time)
+        await session.commit()
+    return claimed
+
+async def check_lessons(reminder_time: str) -> int:
+    """
+    Queues the homework reminder for one reminder time; the outbox drainer sends it.
+    Fired by a cron trigger; the lease makes sure one replica queues it.
+    """
+    fire_time = last_occurrence(reminder_time)
+    job_id = REMINDER_JOB_PREFIX + reminder_time
+    started = time.perf_counter()
+    async with async_session() as session:
+        # The lease and the messages commit together: after a crash either
+        # the whole run is queued or it is still unclaimed
+        if not await claim_lease(session, job_id, fire_time):
+            logging.info(f"Reminder {reminder_time} already sent by another replica")
+            return 0
+        class_ids = (await load_reminder_times(session)).get(reminder_time)
+        # Every run of the day reminds about tomorrow's lessons
+        due = fire_time.date() + timedelta(days=1)
+        messages = await load_reminders(session, class_ids, due) if class_ids else []
+        queued = await enqueue(session, messages, f"{job_id}@{fire_time.isoformat()}")
+        await session.commit()
+    notify()
+
+    metrics.reminder_duration.observe(time.perf_counter() - started, time=reminder_time)
+    metrics.reminder_messages.inc(queued, outcome="queued")
+    logging.info(f"Reminders queued at {reminder_time}: {queued}")
+    return queued
+
+async def sync_reminder_jobs():
+    """Make the cron jobs match the reminder times stored in the database."""
+    async with read_session() as session:
+        times = set(await load_reminder_times(session))
+
+    for job in scheduler.get_jobs():
+        if job.id.startswith(REMINDER_JOB_PREFIX) and job.id[len(REMINDER_JOB_PREFIX):] not in times:
+            job.remove()
+
+    for time in times:
+        job_id = REMINDER_JOB_PREFIX + time
+        if scheduler.get_job(job_id):
+            continue
+        hour, minute = time.split(":")
+        scheduler.add_job(
+            check_lessons,
+            CronTrigger(hour=hour, minute=minute),
+            id=job_id,
+            kwargs={"reminder_time": time},
+            coalesce=True,
+            misfire_grace_time=MISFIRE_GRACE
+        )
+    return times
+
+async def catch_up_missed(times: set[str]):
+    """Fire, once, every reminder whose last occurrence was missed while we were down."""
     now = datetime.now()
-    current_time_str = now.strftime("%H:%M") 
-    weekday = now.weekday() # 0-6
-
-    # Simple reminder times - you can customize these
-    REMINDER_TIMES = ["08:00", "12:00", "15:00"]  # Morning, lunch, evening
-    
-    if current_time_str in REMINDER_TIMES:
-        async with async_session() as session:
-            classes = (await session.execute(select(ClassGroup))).scalars().all()
-            
-            for class_group in classes:
-                # Get all users in this class
-                users = (await session.execute(
-                    select(User).where(User.class_group_id == class_group.id)
-                )).scalars().all()
-                
-                if not users:
-                    continue
-                
-                # Send homework reminder
-                homeworks = (await session.execute(
-                    select(Homework).where(
-                        Homework.class_group_id == class_group.id
-                    ).order_by(Homework.date_assigned.desc())
-                )).scalars().all()
-                
-                if homeworks:
-                    hw_text = ["📚 <b>Напоминание о домашних заданиях:</b>\n"]
-                    for hw in homeworks[:3]:  # Limit to 3 recent homeworks
-                        hw_text.append(f"📖 {hw.subject_name}: {hw.content}")
-                    
-                    # Send to all users in the class
-                    for user in users:
-                        try:
-                            await bot.send_message(
-                                user.telegram_id,
-                                "\n".join(hw_text),
-                                parse_mode="HTML"
-                            )
-                        except Exception as e:
-                            logging.error(f"Failed to send reminder to {user.telegram_id}: {e}")
-
-    logging.info(f"Scheduler check: {current_time_str}")
-
-def start_scheduler(bot: Bot):
-    scheduler.add_job(check_lessons, "interval", minutes=5, kwargs={"bot": bot})
+    async with read_session() as session:
+        leases = dict((await session.execute(
+            select(JobLease.job_id, JobLease.fired_at)
+        )).all())
+
+    for time in sorted(times):
+        fire_time = last_occurrence(time, now)
+        if (now - fire_time).total_seconds() > MISFIRE_GRACE:
+            continue
+        if leases.get(REMINDER_JOB_PREFIX + time, "") >= fire_time.isoformat():
+            continue
+        logging.info(f"Catching up missed reminder {time}")
+        await check_lessons(time)
+
+async def maintenance_job():
+    """Nightly homework archival and database compaction, on one replica only."""
+    if not await claim_run(MAINTENANCE_JOB, last_occurrence(MAINTENANCE_TIME)):
+        return
+    await run_maintenance()
+    pruned = await prune()
+    logging.info(f"Outbox: {pruned} old messages deleted")
+
+_resync_tasks: set[asyncio.Task] = set()
+
+def _resync_later():
+    """Re-read reminder times after a class changed them."""
+    task = asyncio.create_task(sync_reminder_jobs())
+    _resync_tasks.add(task)
+    task.add_done_callback(_resync_tasks.discard)
+
+async def start_scheduler(bot: Bot):
+    times = await sync_reminder_jobs()
+    hour, minute = MAINTENANCE_TIME.split(":")
+    scheduler.add_job(
+        maintenance_job,
+        CronTrigger(hour=hour, minute=minute),
+        id=MAINTENANCE_JOB,
+        coalesce=True,
+        misfire_grace_time=MISFIRE_GRACE,
+        replace_existing=True
+    )
     scheduler.start()
+    subscribe("reminders", lambda class_group_id: _resync_later())
+
+    # Sends whatever reminders and alerts are queued, including ones left by a previous run
+    start_drainer(bot)
+
+    # Lesson alerts run on their own timers rather than cron jobs
+    from services.timeline import start_timeline
+    start_timeline()
+    await catch_up_missed(times)
@@ -0,0 +1,136 @@
+import difflib
+import html
+import re
+from dataclasses import dataclass
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from sqlalchemy import select, func, table, column, literal_column
+
+from database.models import Homework
+from services.homework import MAX_CONTENT_LENGTH, SearchPage
+
+SEARCH_PAGE_SIZE = 5
+# Words this similar to a subject (0..1) are read as that subject: "алгебр", "алгбера"
+SUBJECT_MATCH_CUTOFF = 0.75
+SNIPPET_TOKENS = 24
+# Highlight markers that can't occur in homework text; replaced after escaping
+MARK_START, MARK_END = "\x02", "\x03"
+
+WORD_RE = re.compile(r"\w+")
+
+# The FTS5 table from models.HOMEWORK_FTS_DDL; its hidden column of the same name takes MATCH
+homeworks_fts = table("homeworks_fts", column("rowid"), column("homeworks_fts"))
+_fts = literal_column("homeworks_fts")
+
+
+@dataclass
+class SearchQuery:
+    subject: str = ""  # exact subject_name the results are limited to
+    words: tuple[str, ...] = ()
+
+
+def match_subject(word: str, subjects: list[str]) -> str | None:
+    """The class's subject a word stands for, by prefix or by similarity."""
+    word = word.casefold()
+    if len(word) < 3:
+        return None
+    folded = {subject.casefold(): subject for subject in subjects}
+    for name, subject in folded.items():
+        if name.startswith(word):
+            return subject
+    close = difflib.get_close_matches(word, folded, n=1, cutoff=SUBJECT_MATCH_CUTOFF)
+    return folded[close[0]] if close else None
+
+
+def parse_query(query: str, subjects: list[str]) -> SearchQuery:
+    """The first word that names a subject filters by it; the rest are searched for."""
+    words = WORD_RE.findall(query.casefold())
+    subject = ""
+    for i, word in enumerate(words):
+        subject = match_subject(word, subjects) or ""
+        if subject:
+            del words[i]
+            break
+    return SearchQuery(subject, tuple(words))
+
+
+def fts_expression(words: tuple[str, ...]) -> str:
+    # Every word must occur, as a word or the start of one; quoting keeps FTS syntax out
+    return " ".join(f'"{word}"*' for word in words)
+
+
+async def class_subjects(db, class_group_id: int) -> list[str]:
+    return list((await db.execute(
+        select(Homework.subject_name).where(Homework.class_group_id == class_group_id).distinct()
+    )).scalars().all())
+
+
+async def search_homework(db, class_group_id: int, query: str, page: int = 0):
+    """One page of matches, best first, read through the update's UnitOfWork. Returns (rows, has_more)."""
+    parsed = parse_query(query, await class_subjects(db, class_group_id))
+    if not parsed.subject and not parsed.words:
+        return [], False
+
+    if parsed.words:
+        snippet = func.snippet(_fts, 1, MARK_START, MARK_END, "…", SNIPPET_TOKENS)
+        stmt = (
+            select(Homework.id, Homework.subject_name, snippet, Homework.date_assigned)
+            .select_from(homeworks_fts)
+            .join(Homework, Homework.id == homeworks_fts.c.rowid)
+            .where(homeworks_fts.c.homeworks_fts.op("MATCH")(fts_expression(parsed.words)),
+                   Homework.class_group_id == class_group_id)
+            # Words found in the subject weigh more than in the text
+            .order_by(func.bm25(_fts, 2.0, 1.0), Homework.date_assigned.desc())
+        )
+    else:
+        stmt = (
+            select(Homework.id, Homework.subject_name, Homework.content, Homework.date_assigned)
+            .where(Homework.class_group_id == class_group_id)
+            .order_by(Homework.date_assigned.desc(), Homework.id.desc())
+        )
+    if parsed.subject:
+        stmt = stmt.where(Homework.subject_name == parsed.subject)
+
+    rows = (await db.execute(
+        stmt.limit(SEARCH_PAGE_SIZE + 1).offset(page * SEARCH_PAGE_SIZE)
+    )).all()
+    return rows[:SEARCH_PAGE_SIZE], len(rows) > SEARCH_PAGE_SIZE
+
+
+def _highlight(snippet: str) -> str:
+    if len(snippet) > MAX_CONTENT_LENGTH:
+        snippet = snippet[:MAX_CONTENT_LENGTH] + "…"
+    return html.escape(snippet).replace(MARK_START, "<b>").replace(MARK_END, "</b>")
+
+
+def _button(label: str, query: str, page: int) -> InlineKeyboardButton | None:
+    try:
+        return InlineKeyboardButton(text=label, callback_data=SearchPage(q=query, p=page).pack())
+    except ValueError:
+        # The query doesn't fit into 64 bytes of callback data
+        return None
+
+
+def render_results(rows, query: str, page: int, has_more: bool) -> tuple[str, InlineKeyboardMarkup | None]:
+    text = [f"🔎 <b>Поиск: {html.escape(query)}</b>\n"]
+    for hw_id, subject_name, snippet, date_assigned in rows:
+        text.append(f"📖 <b>{html.escape(subject_name)}</b> ({date_assigned[:10]})")
+        text.append(f"   {_highlight(snippet)}")
+        text.append("")
+
+    buttons = []
+    if page > 0:
+        buttons.append(_button("◀", query, page - 1))
+    if has_more:
+        buttons.append(_button("▶", query, page + 1))
+    buttons = [button for button in buttons if button]
+    markup = InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+    return "\n".join(text), markup
+
+
+async def search_page(db, class_group_id: int, query: str, page: int = 0):
+    """Rendered results and keyboard, or (None, None) if nothing matches."""
+    rows, has_more = await search_homework(db, class_group_id, query, page)
+    if not rows:
+        return None, None
+    return render_results(rows, query, page, has_more)
@@ -0,0 +1,27 @@
+import logging
+import time
+
+# Imported first thing by main.py, so this is roughly when our imports begin
+_started = time.perf_counter()
+_last = _started
+_phases: list[tuple[str, float]] = []
+
+
+def mark(phase: str):
+    """Record the time spent since the previous mark as `phase`."""
+    global _last
+    now = time.perf_counter()
+    _phases.append((phase, now - _last))
+    _last = now
+
+
+def since_start() -> float:
+    return time.perf_counter() - _started
+
+
+def report(phase: str | None = None):
+    """Log every phase so far; for a per-module breakdown run with -X importtime."""
+    if phase:
+        mark(phase)
+    phases = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in _phases)
+    logging.warning(f"Startup: {phases}; total {since_start() * 1000:.0f} ms")
@@ -0,0 +1,56 @@
+import os
+
+from aiogram import Bot
+
+from database.models import DEFAULT_TENANT
+
+# Every school is a tenant served by its own bot. Classes and users carry the
+# tenant; everything else (lessons, homework, reminders) hangs off a class.
+
+_tenant_by_bot: dict[int, str] = {}
+_bots: dict[str, Bot] = {}
+
+
+def parse_tokens(value: str) -> dict[str, str]:
+    """'gym5=123:AA…,lyceum=456:BB…' -> {"gym5": "123:AA…", "lyceum": "456:BB…"}"""
+    tokens = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        tenant, sep, token = (part.strip() for part in item.partition("="))
+        if not sep or not tenant or not token:
+            # Never echo the entry: it may contain a token
+            raise ValueError("BOT_TOKENS entries must look like tenant=token")
+        if len(tenant) > 32:
+            raise ValueError(f"Tenant name too long: {tenant}")
+        tokens[tenant] = token
+    return tokens
+
+
+def configured_tokens() -> dict[str, str]:
+    """BOT_TOKEN as the default tenant, plus the schools listed in BOT_TOKENS."""
+    tokens = {}
+    if token := os.getenv("BOT_TOKEN"):
+        tokens[DEFAULT_TENANT] = token
+    tokens.update(parse_tokens(os.getenv("BOT_TOKENS", "")))
+    return tokens
+
+
+def register(tenant: str, bot: Bot):
+    _tenant_by_bot[bot.id] = tenant
+    _bots[tenant] = bot
+
+
+def tenant_of(bot: Bot | None) -> str:
+    """The tenant a bot serves; bots that were never registered serve the default one."""
+    if bot is None:
+        return DEFAULT_TENANT
+    return _tenant_by_bot.get(bot.id, DEFAULT_TENANT)
+
+
+def bot_for(tenant: str) -> Bot | None:
+    return _bots.get(tenant)
+
+
+def tenants() -> list[str]:
+    return list(_bots)
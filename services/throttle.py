@@ -0,0 +1,107 @@
+import os
+import time
+from collections import Counter
+from dataclasses import dataclass
+
+from services.cache import TTLCache
+
+
+@dataclass(frozen=True)
+class Limit:
+    """Token bucket: `burst` updates at once, refilled at `rate` per second."""
+    rate: float
+    burst: int
+
+
+# Commands that write to the database get the tighter "write" bucket
+WRITE_COMMANDS = {
+    "start", "add_hw", "remove_hw", "add_schedule", "remove_schedule", "import_schedule",
+    "create_class", "join_class", "reminders", "bells", "hw_retention", "lesson_alerts",
+}
+
+LIMITS = {
+    "read": Limit(float(os.getenv("THROTTLE_RATE", "1")), int(os.getenv("THROTTLE_BURST", "5"))),
+    "write": Limit(float(os.getenv("THROTTLE_WRITE_RATE", "0.2")), int(os.getenv("THROTTLE_WRITE_BURST", "3"))),
+}
+# Shared by everyone in a group chat, on top of the per-user buckets
+CHAT_LIMIT = Limit(float(os.getenv("THROTTLE_CHAT_RATE", "3")), int(os.getenv("THROTTLE_CHAT_BURST", "20")))
+# The same text or button pressed again within this many seconds is dropped
+DUPLICATE_WINDOW = float(os.getenv("THROTTLE_DUPLICATE_WINDOW", "1"))
+# Upper bound on tracked users; idle entries expire once their bucket would be full again
+THROTTLE_STATE_SIZE = int(os.getenv("THROTTLE_STATE_SIZE", "100000"))
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated", "warned")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+        self.warned = False
+
+
+@dataclass(frozen=True)
+class Verdict:
+    reason: str  # "duplicate", "user" or "chat"
+    notify: bool  # first rejection in a row, worth telling the user about
+
+
+class Throttler:
+    """
+    Per-user buckets for each command class plus one bucket per group chat.
+    State lives in TTL caches, so memory follows the number of active users.
+    """
+
+    def __init__(self, limits: dict[str, Limit] | None = None, chat_limit: Limit = CHAT_LIMIT,
+                 duplicate_window: float = DUPLICATE_WINDOW, maxsize: int = THROTTLE_STATE_SIZE):
+        self.limits = limits or LIMITS
+        self.chat_limit = chat_limit
+        refill = max(limit.burst / limit.rate for limit in [*self.limits.values(), chat_limit])
+        self._buckets = TTLCache(maxsize, ttl=refill)
+        self._recent = TTLCache(maxsize, ttl=duplicate_window) if duplicate_window > 0 else None
+        self.throttled: Counter[str] = Counter()
+
+    def _take(self, key: tuple, limit: Limit) -> _Bucket | None:
+        """Take a token; returns the bucket if it was empty."""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = _Bucket(limit.burst, now)
+        else:
+            bucket.tokens = min(limit.burst, bucket.tokens + (now - bucket.updated) * limit.rate)
+            bucket.updated = now
+        # Setting again also pushes the expiry back
+        self._buckets.set(key, bucket)
+        if bucket.tokens < 1:
+            return bucket
+        bucket.tokens -= 1
+        bucket.warned = False
+        return None
+
+    def check(self, user_id: int, chat_id: int | None, command_class: str,
+              payload: str | None = None) -> Verdict | None:
+        """None if the update may go on, otherwise why it is dropped."""
+        if payload is not None and self._recent is not None:
+            key = (user_id, payload)
+            if key in self._recent:
+                return self._reject("duplicate", None)
+            self._recent.set(key, True)
+
+        empty = self._take((user_id, command_class), self.limits[command_class])
+        if empty:
+            return self._reject("user", empty)
+        if chat_id is not None:
+            empty = self._take(("chat", chat_id), self.chat_limit)
+            if empty:
+                return self._reject("chat", empty)
+        return None
+
+    def _reject(self, reason: str, bucket: _Bucket | None) -> Verdict:
+        self.throttled[reason] += 1
+        notify = bucket is not None and not bucket.warned
+        if bucket is not None:
+            bucket.warned = True
+        return Verdict(reason, notify)
+
+    def stats(self) -> dict:
+        return {"tracked": len(self._buckets), **self.throttled}
@@ -0,0 +1,217 @@
+import asyncio
+import heapq
+import html
+import itertools
+import logging
+import os
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import select
+
+from database.setup import async_session, read_session
+from database.models import User, ClassGroup, Schedule, Homework
+from services.broadcast import BroadcastMessage
+from services.invalidation import subscribe
+from services.timetable import parse_bells
+from services.outbox import enqueue, notify
+from services.attachments import MAX_ATTACHMENTS, load_attachments, dumps
+
+# The first lesson of the day is announced this many minutes before its bell;
+# every next one when the previous lesson ends
+LESSON_ALERT_LEAD = int(os.getenv("LESSON_ALERT_LEAD", "5"))
+LESSON_JOB_PREFIX = "lesson:"
+MAX_HOMEWORK_LENGTH = 300
+
+
+@dataclass(order=True)
+class LessonEvent:
+    """Announce `lesson_number` of a class at `at`."""
+    at: datetime
+    seq: int
+    class_group_id: int = field(compare=False)
+    generation: int = field(compare=False)
+    lesson_number: int = field(compare=False)
+    subject_name: str = field(compare=False)
+    starts_at: time = field(compare=False)
+    kind: str = field(compare=False)  # "start" - before the first bell, "end" - previous lesson ended
+
+
+class LessonTimeline:
+    """
+    Today's lesson events of every class in a min-heap. The loop sleeps
+    exactly until the earliest one, so nothing polls between bells.
+    Edits of one class replace only that class's events: its generation
+    is bumped and stale events are dropped when they reach the top.
+    """
+
+    def __init__(self, lead: int = LESSON_ALERT_LEAD):
+        self.lead = timedelta(minutes=lead)
+        self._heap: list[LessonEvent] = []
+        self._generations: dict[int, int] = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._day: date | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def events_for(self, class_group_id: int, bells: dict[int, tuple[time, time]],
+                   lessons: list[tuple[int, str]], day: date, now: datetime) -> list[LessonEvent]:
+        generation = self._generations.get(class_group_id, 0)
+        events, previous_end = [], None
+        for lesson_number, subject_name in sorted(lessons):
+            if lesson_number not in bells:
+                continue
+            start, end = bells[lesson_number]
+            if previous_end is None:
+                at, kind = datetime.combine(day, start) - self.lead, "start"
+            else:
+                at, kind = datetime.combine(day, previous_end), "end"
+            previous_end = end
+            if at > now:
+                events.append(LessonEvent(at, next(self._seq), class_group_id, generation,
+                                          lesson_number, subject_name, start, kind))
+        return events
+
+    async def _load(self, class_ids: list[int] | None, day: date) -> list[LessonEvent]:
+        now = datetime.now()
+        async with read_session() as session:
+            query = select(ClassGroup.id, ClassGroup.schedule_calls).where(ClassGroup.schedule_calls.is_not(None))
+            if class_ids is not None:
+                query = query.where(ClassGroup.id.in_(class_ids))
+            bells = {class_id: parse_bells(calls) for class_id, calls in (await session.execute(query)).all()}
+            bells = {class_id: value for class_id, value in bells.items() if value}
+            if not bells:
+                return []
+
+            lessons: dict[int, list[tuple[int, str]]] = {}
+            for class_id, lesson_number, subject_name in (await session.execute(
+                select(Schedule.class_group_id, Schedule.lesson_number, Schedule.subject_name).where(
+                    Schedule.class_group_id.in_(list(bells)), Schedule.day_of_week == day.weekday()
+                )
+            )).all():
+                lessons.setdefault(class_id, []).append((lesson_number, subject_name))
+
+        events = []
+        for class_id, class_lessons in lessons.items():
+            events.extend(self.events_for(class_id, bells[class_id], class_lessons, day, now))
+        return events
+
+    async def rebuild(self):
+        """Build the whole day's heap; runs at start and at midnight."""
+        self._day = date.today()
+        self._heap = await self._load(None, self._day)
+        heapq.heapify(self._heap)
+        logging.info(f"Lesson timeline for {self._day}: {len(self._heap)} events")
+
+    async def reschedule(self, class_group_id: int):
+        """Replace the remaining events of one class after its bells or lessons changed."""
+        self._generations[class_group_id] = self._generations.get(class_group_id, 0) + 1
+        if self._day is None:
+            return
+        for event in await self._load([class_group_id], self._day):
+            heapq.heappush(self._heap, event)
+        # The new earliest event may come before the one the loop sleeps for
+        self._wakeup.set()
+
+    def _reschedule_later(self, class_group_id: int):
+        self._spawn(self.reschedule(class_group_id))
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(self._guarded(coro))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    async def _guarded(coro):
+        try:
+            await coro
+        except Exception as e:
+            logging.error(f"Lesson timeline task failed: {e}")
+
+    async def run(self):
+        while True:
+            try:
+                await self._loop()
+            except Exception as e:
+                logging.error(f"Lesson timeline failed, restarting in a minute: {e}")
+                self._day = None
+                await asyncio.sleep(60)
+
+    async def _loop(self):
+        while True:
+            now = datetime.now()
+            midnight = datetime.combine(now.date() + timedelta(days=1), time())
+            if now.date() != self._day:
+                await self.rebuild()
+                continue
+
+            while self._heap and self._heap[0].at <= now:
+                event = heapq.heappop(self._heap)
+                if event.generation == self._generations.get(event.class_group_id, 0):
+                    self._spawn(self._fire(event))
+
+            wake_at = min(self._heap[0].at, midnight) if self._heap else midnight
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), (wake_at - datetime.now()).total_seconds())
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, event: LessonEvent):
+        from services.scheduler import claim_lease
+
+        job_id = f"{LESSON_JOB_PREFIX}{event.class_group_id}:{event.lesson_number}"
+        async with async_session() as session:
+            if not await claim_lease(session, job_id, event.at):
+                return
+            subscribers = (await session.execute(
+                select(User.telegram_id, User.tenant).where(
+                    User.class_group_id == event.class_group_id, User.lesson_alerts.is_(True),
+                    User.blocked_at.is_(None)
+                )
+            )).all()
+            # Homework set for this lesson: due on its date (services.timetable.due_date)
+            due = (await session.execute(
+                select(Homework.id, Homework.content, Homework.attachment_id).where(
+                    Homework.class_group_id == event.class_group_id,
+                    Homework.due_date == event.at.date(),
+                    Homework.subject_name == event.subject_name
+                ).order_by(Homework.id)
+            )).all()
+            files = None
+            with_files = [hw_id for hw_id, _, attachment_id in due if attachment_id]
+            if with_files:
+                attachments = await load_attachments(session, with_files)
+                files = dumps([a for hw_id in with_files for a in attachments.get(hw_id, [])][:MAX_ATTACHMENTS])
+
+            text = [f"🔔 Следующий урок: {event.lesson_number}. <b>{html.escape(event.subject_name)}</b> "
+                    f"в {event.starts_at.strftime('%H:%M')}"]
+            for _, homework, _ in due:
+                if len(homework) > MAX_HOMEWORK_LENGTH:
+                    homework = homework[:MAX_HOMEWORK_LENGTH] + "…"
+                text.append(f"📖 ДЗ: {html.escape(homework)}")
+            text = "\n".join(text)
+
+            queued = await enqueue(session, [BroadcastMessage(chat_id, text, attachments=files, tenant=tenant)
+                                             for chat_id, tenant in subscribers],
+                                   f"{job_id}@{event.at.isoformat()}")
+            await session.commit()
+        notify()
+        logging.info(f"Lesson {event.lesson_number} of class {event.class_group_id} announced to {queued} users")
+
+
+_timeline: LessonTimeline | None = None
+_run_task: asyncio.Task | None = None
+
+
+def start_timeline() -> LessonTimeline:
+    """Start the lesson timeline loop; bell and timetable edits patch it as they happen."""
+    global _timeline, _run_task
+    _timeline = LessonTimeline()
+    subscribe("timetable", _timeline._reschedule_later)
+    subscribe("bells", _timeline._reschedule_later)
+    _run_task = asyncio.create_task(_timeline.run())
+    return _timeline
@@ -0,0 +1,110 @@
+import html
+import json
+import logging
+from datetime import date, time, timedelta
+
+from services.invalidation import subscribe, publish
+
+WEEKDAYS = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
+
+# Per-class version, bumped on every timetable edit
+_versions: dict[int, int] = {}
+# (class_group_id, day_of_week) -> (version, rendered text or None if the day is empty)
+_rendered: dict[tuple[int, int], tuple[int, str | None]] = {}
+# class_group_id -> (version, {casefolded subject: weekdays it is taught on})
+_subject_days: dict[int, tuple[int, dict[str, frozenset[int]]]] = {}
+
+
+def _bump_local(class_group_id: int):
+    _versions[class_group_id] = _versions.get(class_group_id, 0) + 1
+
+
+def bump_version(class_group_id: int):
+    """Mark every cached day of the class as stale, in every worker."""
+    publish("timetable", class_group_id)
+
+
+subscribe("timetable", _bump_local)
+
+
+def render_day(day_of_week: int, lessons: list[tuple[int, str]]) -> str | None:
+    if not lessons:
+        return None
+    text = [f"📅 <b>Расписание на {WEEKDAYS[day_of_week]}</b>\n"]
+    for lesson_number, subject_name in lessons:
+        text.append(f"{lesson_number}. {html.escape(subject_name)}")
+    return "\n".join(text)
+
+
+async def get_day_text(db, class_group_id: int, day_of_week: int) -> str | None:
+    """Rendered timetable for one day of a class, or None if there are no lessons."""
+    version = _versions.get(class_group_id, 0)
+    cached = _rendered.get((class_group_id, day_of_week))
+    if cached and cached[0] == version:
+        return cached[1]
+
+    lessons = await db.schedule.day(class_group_id, day_of_week)
+
+    text = render_day(day_of_week, lessons)
+    # Only store if nobody edited the timetable while we were reading it
+    if _versions.get(class_group_id, 0) == version:
+        _rendered[(class_group_id, day_of_week)] = (version, text)
+    return text
+
+
+async def subject_days(db, class_group_id: int) -> dict[str, frozenset[int]]:
+    """Weekdays each subject of a class is taught on, keyed by the casefolded subject."""
+    version = _versions.get(class_group_id, 0)
+    cached = _subject_days.get(class_group_id)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    days: dict[str, set[int]] = {}
+    for subject_name, day_of_week in await db.schedule.subject_days(class_group_id):
+        days.setdefault(subject_name.casefold(), set()).add(day_of_week)
+    table = {subject: frozenset(weekdays) for subject, weekdays in days.items()}
+    if _versions.get(class_group_id, 0) == version:
+        _subject_days[class_group_id] = (version, table)
+    return table
+
+
+def next_lesson_date(weekdays: frozenset[int], after: date) -> date | None:
+    """The first day after `after` that falls on one of `weekdays` (0=Monday)."""
+    for offset in range(1, 8):
+        day = after + timedelta(days=offset)
+        if day.weekday() in weekdays:
+            return day
+    return None
+
+
+async def due_date(db, class_group_id: int, subject: str, assigned: date) -> date | None:
+    """The next lesson of the subject after `assigned`, or None if it isn't in the timetable."""
+    weekdays = (await subject_days(db, class_group_id)).get(subject.casefold())
+    return next_lesson_date(weekdays, assigned) if weekdays else None
+
+
+# Bells are stored with the class; the lesson timeline (services/timeline.py) reads them too.
+
+def parse_bells(schedule_calls: str | None) -> dict[int, tuple[time, time]]:
+    """ClassGroup.schedule_calls ({"1": ["08:30", "09:15"], ...}) as lesson -> (start, end)."""
+    if not schedule_calls:
+        return {}
+    try:
+        return {
+            int(lesson): (time.fromisoformat(start), time.fromisoformat(end))
+            for lesson, (start, end) in json.loads(schedule_calls).items()
+        }
+    except (ValueError, TypeError, AttributeError) as e:
+        logging.error(f"Invalid schedule_calls {schedule_calls!r}: {e}")
+        return {}
+
+
+def format_bells(bells: dict[int, tuple[time, time]]) -> str:
+    return json.dumps({
+        str(lesson): [start.strftime("%H:%M"), end.strftime("%H:%M")]
+        for lesson, (start, end) in sorted(bells.items())
+    })
+
+
+def cache_stats() -> dict:
+    return {"classes": len(_versions), "entries": len(_rendered)}
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import os
+import signal
+import time
+import weakref
+from collections import deque
+from typing import Any, Awaitable, Callable, Hashable
+
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramUnauthorizedError
+from aiogram.types import Update
+from aiogram.utils.backoff import Backoff, BackoffConfig
+
+from services.metrics import update_wait
+
+# Updates processed at once across all chats; one chat never has more than one running
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "16"))
+# Updates queued or running in total; beyond that, receiving waits
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+# How long shutdown waits for queued updates
+UPDATE_DRAIN_TIMEOUT = float(os.getenv("UPDATE_DRAIN_TIMEOUT", "25"))
+POLLING_TIMEOUT = 10
+# Retry delays after a failed getUpdates, as in aiogram's own polling
+POLLING_BACKOFF = BackoffConfig(min_delay=1.0, max_delay=5.0, factor=1.3, jitter=0.1)
+
+_schedulers: "weakref.WeakSet[UpdateScheduler]" = weakref.WeakSet()
+
+
+def chat_key(update: dict[str, Any]) -> int:
+    """The chat (or user) a raw update belongs to. Updates with one key are processed in order."""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        if isinstance(value.get("chat"), dict):
+            return value["chat"]["id"]
+        if isinstance(value.get("message"), dict):
+            return value["message"]["chat"]["id"]
+        for field in ("from", "user"):
+            if isinstance(value.get(field), dict):
+                return value[field]["id"]
+    return 0
+
+
+def update_key(update: Update) -> int:
+    """chat_key() of a parsed Update."""
+    event = update.event
+    chat = getattr(event, "chat", None)
+    if chat is None and getattr(event, "message", None) is not None:
+        chat = event.message.chat
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None) or getattr(event, "user", None)
+    return user.id if user else 0
+
+
+class UpdateScheduler:
+    """
+    Processes updates of different chats concurrently, at most `concurrency`
+    at once, and the updates of one chat strictly one after another, in the
+    order they were submitted. A chat gets its queue with its first update
+    and loses it as soon as the queue runs empty, so idle chats cost nothing.
+    When `max_pending` updates are queued or running, submit() waits, which
+    stops receiving until handlers catch up.
+    """
+
+    def __init__(self, process: Callable[[Any], Awaitable[Any]],
+                 concurrency: int = UPDATE_CONCURRENCY, max_pending: int = UPDATE_QUEUE_SIZE):
+        self.process = process
+        self.pending = 0
+        self.running = 0
+        self._slots = asyncio.Semaphore(concurrency)
+        self._room = asyncio.Semaphore(max_pending)
+        self._chats: dict[Hashable, deque[tuple[float, Any]]] = {}
+        self._tasks: set[asyncio.Task] = set()
+        _schedulers.add(self)
+
+    async def submit(self, key: Hashable, update: Any):
+        await self._room.acquire()
+        self.pending += 1
+        # No await from here on: the chat's task can't finish in between
+        queue = self._chats.get(key)
+        if queue is not None:
+            queue.append((time.monotonic(), update))
+            return
+        self._chats[key] = deque([(time.monotonic(), update)])
+        task = asyncio.create_task(self._run(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key: Hashable):
+        queue = self._chats[key]
+        try:
+            while queue:
+                queued_at, update = queue.popleft()
+                async with self._slots:
+                    update_wait.observe(time.monotonic() - queued_at)
+                    self.running += 1
+                    try:
+                        await self.process(update)
+                    except Exception as e:
+                        logging.error(f"Error processing update of chat {key}: {e}")
+                    finally:
+                        self.running -= 1
+                        self.pending -= 1
+                        self._room.release()
+        finally:
+            del self._chats[key]
+
+    async def drain(self, timeout: float = UPDATE_DRAIN_TIMEOUT):
+        """Wait for everything submitted so far."""
+        tasks = set(self._tasks)
+        if not tasks:
+            return
+        logging.info(f"Draining {self.pending} updates")
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+        if pending:
+            logging.warning(f"{self.pending} updates did not finish before shutdown")
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "running": self.running,
+            "chats": len(self._chats),
+            "deepest": max(map(len, self._chats.values()), default=0),
+        }
+
+
+def queue_stats() -> dict:
+    """stats() of all schedulers of this process, added up (deepest: the maximum)."""
+    total = {"pending": 0, "running": 0, "chats": 0, "deepest": 0}
+    for scheduler in list(_schedulers):
+        for name, value in scheduler.stats().items():
+            total[name] = max(total[name], value) if name == "deepest" else total[name] + value
+    return total
+
+
+async def poll(bot: Bot, allowed_updates: list[str], dispatch: Callable[[Update], Awaitable[Any]]):
+    """
+    Long polling: hand every update to `dispatch` until cancelled. Errors
+    are retried with a growing delay; a revoked token ends the loop.
+    """
+    from aiogram.methods import GetUpdates
+
+    backoff = Backoff(POLLING_BACKOFF)
+    offset = None
+    while True:
+        try:
+            updates = await bot(GetUpdates(offset=offset, timeout=POLLING_TIMEOUT,
+                                           allowed_updates=allowed_updates))
+        except TelegramUnauthorizedError as e:
+            logging.error(f"Bot {bot.id} stopped polling: {e}")
+            return
+        except Exception as e:
+            # Includes TelegramConflictError: another instance polls the same token
+            logging.error(f"Failed to fetch updates: {type(e).__name__}: {e}, "
+                          f"retrying in {backoff.next_delay:.1f}s")
+            await backoff.asleep()
+            continue
+        backoff.reset()
+        for update in updates:
+            await dispatch(update)
+            offset = update.update_id + 1
+
+
+async def run_polling(dp: Dispatcher, *bots: Bot):
+    """
+    Poll every bot through one UpdateScheduler until SIGINT/SIGTERM, then
+    drain and stop. A chat is ordered per bot: the same person talking to
+    two bots is two chats.
+    """
+    scheduler = UpdateScheduler(lambda item: dp.feed_update(*item))
+    workflow_data = {"dispatcher": dp, "bots": bots, **dp.workflow_data}
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    def dispatcher_for(bot: Bot):
+        return lambda update: scheduler.submit((bot.id, update_key(update)), (bot, update))
+
+    # Like aiogram, startup handlers get the last bot
+    await dp.emit_startup(bot=bots[-1], **workflow_data)
+    allowed_updates = dp.resolve_used_update_types()
+    tasks = [asyncio.create_task(poll(bot, allowed_updates, dispatcher_for(bot))) for bot in bots]
+    # Stop on a signal or once no bot is left polling
+    stopper = asyncio.create_task(stop.wait())
+    try:
+        await asyncio.wait({stopper, asyncio.gather(*tasks, return_exceptions=True)},
+                           return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        stopper.cancel()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await scheduler.drain()
+        try:
+            await dp.emit_shutdown(bot=bots[-1], **workflow_data)
+        finally:
+            await asyncio.gather(*(bot.session.close() for bot in bots))
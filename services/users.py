@@ -0,0 +1,65 @@
+import os
+from dataclasses import dataclass
+
+from sqlalchemy import select
+
+from database.setup import read_session
+from database.models import User
+from services.cache import TTLCache
+from services.invalidation import subscribe, publish
+
+_NOT_CACHED = object()
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """The part of a User that handlers need on every update."""
+    id: int
+    tenant: str
+    telegram_id: int
+    role: str
+    class_group_id: int | None
+
+
+user_cache = TTLCache(
+    maxsize=int(os.getenv("USER_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("USER_CACHE_TTL", "300"))
+)
+
+
+# Entries are keyed by (tenant, telegram_id): every school's bot has its own users
+
+async def load_user(tenant: str, telegram_id: int) -> CachedUser | None:
+    """Read the user from the database and store the result in the cache."""
+    async with read_session() as session:
+        row = (await session.execute(
+            select(User.id, User.tenant, User.telegram_id, User.role, User.class_group_id)
+            .where(User.tenant == tenant, User.telegram_id == telegram_id)
+        )).one_or_none()
+    user = CachedUser(*row) if row else None
+    # Unregistered users are cached too, so spamming /help costs no queries
+    user_cache.set((tenant, telegram_id), user)
+    return user
+
+
+async def resolve_user(tenant: str, telegram_id: int) -> CachedUser | None:
+    user = user_cache.get((tenant, telegram_id), _NOT_CACHED)
+    if user is _NOT_CACHED:
+        user = await load_user(tenant, telegram_id)
+    return user
+
+
+def remember_user(user) -> CachedUser:
+    """Put a freshly written user (an ORM object or a row with the same columns) into the cache."""
+    cached = CachedUser(user.id, user.tenant, user.telegram_id, user.role, user.class_group_id)
+    # Other workers may hold an older entry for this user
+    publish("user", (user.tenant, user.telegram_id))
+    user_cache.set((user.tenant, user.telegram_id), cached)
+    return cached
+
+
+def invalidate_user(tenant: str, telegram_id: int):
+    publish("user", (tenant, telegram_id))
+
+
+subscribe("user", user_cache.invalidate)
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import os
+import signal
+from typing import Any
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from services.updates import UpdateScheduler, chat_key
+from services.tenants import tenant_of
+
+# Public base URL Telegram should call; Render exposes it as RENDER_EXTERNAL_URL.
+# Leave empty to run the server without registering a webhook (local testing).
+WEBHOOK_URL = os.getenv("WEBHOOK_URL") or os.getenv("RENDER_EXTERNAL_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8080"))
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "32"))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "25"))
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """
+    Acknowledges updates immediately and hands them to an UpdateScheduler:
+    at most `max_concurrency` run at once, and one chat's updates run in
+    order. When the scheduler is full the request waits, so Telegram slows
+    down instead of us piling up tasks. On shutdown new updates are
+    refused and queued ones are drained.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: str | None = None,
+                 max_concurrency: int = WEBHOOK_MAX_CONCURRENCY,
+                 drain_timeout: float = WEBHOOK_DRAIN_TIMEOUT, **data: Any):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+        self.drain_timeout = drain_timeout
+        self.updates = UpdateScheduler(lambda update: self._background_feed_update(self.bot, update),
+                                       concurrency=max_concurrency)
+        self._closing = False
+
+    @property
+    def in_flight(self) -> int:
+        return self.updates.pending
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self._closing:
+            # Telegram will redeliver the update to us or another instance
+            return web.Response(status=503, text="Shutting down")
+        return await super().handle(request)
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        await self.updates.submit(chat_key(update), update)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def close(self) -> None:
+        # Bots share one HTTP session; run_webhook closes it after every handler drained
+        self._closing = True
+        await self.updates.drain(self.drain_timeout)
+
+
+def webhook_path(bot: Bot, bots: list[Bot]) -> str:
+    """WEBHOOK_PATH for a single bot; with several, each gets WEBHOOK_PATH/<tenant>."""
+    return WEBHOOK_PATH if len(bots) == 1 else f"{WEBHOOK_PATH.rstrip('/')}/{tenant_of(bot)}"
+
+
+def create_app(dp: Dispatcher, bots: list[Bot]) -> web.Application:
+    app = web.Application()
+    handlers = []
+    for bot in bots:
+        handler = BoundedRequestHandler(dp, bot, secret_token=WEBHOOK_SECRET)
+        handler.register(app, path=webhook_path(bot, bots))
+        handlers.append(handler)
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok", "in_flight": sum(h.in_flight for h in handlers)})
+
+    app.router.add_get("/healthz", health)
+    setup_application(app, dp, bot=bots[-1], bots=bots)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bots: list[Bot]):
+    """Serve updates over HTTP until SIGINT/SIGTERM, then drain and stop."""
+    app = create_app(dp, bots)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+
+    if WEBHOOK_URL:
+        for bot in bots:
+            await bot.set_webhook(
+                WEBHOOK_URL.rstrip("/") + webhook_path(bot, bots),
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=dp.resolve_used_update_types(),
+                max_connections=min(WEBHOOK_MAX_CONCURRENCY, 100)
+            )
+    logging.warning(f"Webhook server listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}, "
+                    f"{', '.join(webhook_path(bot, bots) for bot in bots)}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        # Runs on_shutdown: the handlers drain in-flight updates
+        await runner.cleanup()
+        await asyncio.gather(*(bot.session.close() for bot in bots))
@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import multiprocessing as mp
+import os
+import secrets
+import signal
+import sys
+import threading
+from typing import Any
+
+from services.updates import chat_key
+
+# Updates waiting per worker; when a queue is full the supervisor stops fetching
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "1000"))
+# Only this worker runs the reminder scheduler
+SCHEDULER_WORKER = int(os.getenv("SCHEDULER_WORKER", "0"))
+# Same setting as main.py; workers inherit the supervisor's environment
+LOG_LEVEL = os.getenv("LOG_LEVEL", "WARNING")
+
+
+def _setup_logging():
+    logging.basicConfig(
+        level=LOG_LEVEL,
+        stream=sys.stdout,
+        format='%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+
+def worker_main(index: int, inbox, events):
+    """Entry point of a worker process."""
+    _setup_logging()
+    # The supervisor tells us when to stop, after its receiver has stopped, so
+    # queued updates (already acknowledged to Telegram) are not lost. Platforms
+    # send SIGTERM (and a terminal SIGINT) to every process of the group.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(_worker(index, inbox, events))
+
+
+async def _start_scheduler(bot):
+    from services.scheduler import start_scheduler
+
+    try:
+        await start_scheduler(bot)
+    except Exception as e:
+        logging.error(f"Failed to start the scheduler: {e}")
+
+
+async def _worker(index: int, inbox, events, bot=None):
+    from aiogram import Dispatcher
+    from main import create_bot, setup_dispatcher
+    from services import invalidation
+    from services.metrics import METRICS_PORT, start_metrics_server
+    from services.updates import UpdateScheduler
+
+    # Cache invalidations made here are sent to the other workers via the supervisor
+    invalidation.set_forwarder(lambda topic, key: events.put((index, topic, key)))
+
+    bot = bot or create_bot()
+    dp = Dispatcher()
+    setup_dispatcher(dp)
+    scheduler_task = None
+    if index == SCHEDULER_WORKER:
+        # Catching up missed reminders must not hold back this worker's updates
+        scheduler_task = asyncio.create_task(_start_scheduler(bot))
+    # Every worker has its own metrics, on consecutive ports
+    if METRICS_PORT:
+        await start_metrics_server(METRICS_PORT + index)
+
+    # Chats of this worker run concurrently, each one in order; a full
+    # scheduler stops reading the inbox, which fills up and pauses the supervisor
+    updates = UpdateScheduler(lambda update: dp.feed_raw_update(bot, update))
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            item = await loop.run_in_executor(None, inbox.get)
+            if item is None:
+                break
+            kind, *payload = item
+            if kind == "invalidate":
+                invalidation.deliver(*payload)
+                continue
+            await updates.submit(chat_key(payload[0]), payload[0])
+        await updates.drain()
+    finally:
+        if scheduler_task:
+            # Still catching up at shutdown: nothing left to wait for
+            scheduler_task.cancel()
+            await asyncio.gather(scheduler_task, return_exceptions=True)
+        await bot.session.close()
+
+
+def _fan_out(events, inboxes):
+    """Forward each worker's cache invalidations to all other workers."""
+    while True:
+        item = events.get()
+        if item is None:
+            return
+        source, topic, key = item
+        for i, inbox in enumerate(inboxes):
+            if i != source:
+                inbox.put(("invalidate", topic, key))
+
+
+async def _poll(bot, allowed_updates, dispatch, stop: asyncio.Event):
+    from services.updates import poll
+
+    async def forward(update):
+        await dispatch(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+
+    await poll(bot, allowed_updates, forward)
+    # Polling only returns once the token is rejected
+    stop.set()
+
+
+async def _serve_webhook(bot, allowed_updates, dispatch, stop: asyncio.Event):
+    from aiohttp import web
+    from services.webhook import (
+        WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT
+    )
+
+    async def handle(request: web.Request) -> web.Response:
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if WEBHOOK_SECRET and not secrets.compare_digest(token, WEBHOOK_SECRET):
+            return web.Response(body="Unauthorized", status=401)
+        await dispatch(await request.json())
+        return web.json_response({})
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok"})
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle)
+    app.router.add_get("/healthz", health)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    if WEBHOOK_URL:
+        await bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                              secret_token=WEBHOOK_SECRET, allowed_updates=allowed_updates)
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+
+
+async def run_supervisor(count: int):
+    """
+    Receive updates in this process and shard them by chat across `count`
+    worker processes, so every chat is handled by one worker, in order.
+    """
+    from aiogram import Dispatcher
+    from database.setup import init_db
+    from main import BOT_MODE, create_bot, setup_dispatcher
+
+    # Migrations run once, before any worker touches the database
+    await init_db()
+
+    probe = Dispatcher()
+    setup_dispatcher(probe)
+    allowed_updates = probe.resolve_used_update_types()
+
+    ctx = mp.get_context("spawn")
+    inboxes = [ctx.Queue(WORKER_QUEUE_SIZE) for _ in range(count)]
+    events = ctx.Queue()
+    workers = [
+        ctx.Process(target=worker_main, args=(i, inboxes[i], events), name=f"worker-{i}")
+        for i in range(count)
+    ]
+    for worker in workers:
+        worker.start()
+    threading.Thread(target=_fan_out, args=(events, inboxes), daemon=True).start()
+    logging.warning(f"Started {count} workers")
+
+    loop = asyncio.get_running_loop()
+
+    async def dispatch(update: dict[str, Any]):
+        # Blocks while the worker's queue is full, which pauses fetching
+        inbox = inboxes[chat_key(update) % count]
+        await loop.run_in_executor(None, inbox.put, ("update", update))
+
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    bot = create_bot()
+    receiver = _serve_webhook if BOT_MODE == "webhook" else _poll
+    task = asyncio.create_task(receiver(bot, allowed_updates, dispatch, stop))
+    await stop.wait()
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    await bot.session.close()
+
+    # Workers finish what is queued, then exit
+    for inbox in inboxes:
+        inbox.put(None)
+    for worker in workers:
+        await loop.run_in_executor(None, worker.join, 30)
+    events.put(None)